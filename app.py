@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_from_directory, Response
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 import os
 import pandas as pd
@@ -8,19 +8,27 @@ import json
 import sys
 import datetime
 import traceback
-from collections import Counter
 import re # Added for parsing effect strings
 # Укажи путь к своему симулятору!
 sys.path.append(r"C:/Хранилище/Документы/DeckBuild/Cursor/Cob")
-from simulator import simulate_game, Card
+from simulator import Card
+from catalog_service import CatalogService
+from jobs import JobQueue, JobRejected
+from game_export import GameExportWriter, EXPORT_DIR, check_format
+from contextlib import closing
+import simulator as sim
 
 app = Flask(__name__)
 CORS(app)
 
-CARDS_CSV = 'https://docs.google.com/spreadsheets/d/e/2PACX-1vRZQwtU_n44GNrXPXOWMJSYIiw_bbSdbQ224k58hy6pCPXIb65Cl4gcuNzhTvPQEpthwduWBI5ndPtX/pub?gid=1628155421&single=true&output=csv'
-STARTER_CSV = 'https://docs.google.com/spreadsheets/d/e/2PACX-1vRZQwtU_n44GNrXPXOWMJSYIiw_bbSdbQ224k58hy6pCPXIb65Cl4gcuNzhTvPQEpthwduWBI5ndPtX/pub?gid=0&single=true&output=csv'
+# Источники можно подменить локальным файлом или локальным HTTP-сервером (работа офлайн)
+CARDS_CSV = os.environ.get('COB_CARDS_CSV') or 'https://docs.google.com/spreadsheets/d/e/2PACX-1vRZQwtU_n44GNrXPXOWMJSYIiw_bbSdbQ224k58hy6pCPXIb65Cl4gcuNzhTvPQEpthwduWBI5ndPtX/pub?gid=1628155421&single=true&output=csv'
+STARTER_CSV = os.environ.get('COB_STARTER_CSV') or 'https://docs.google.com/spreadsheets/d/e/2PACX-1vRZQwtU_n44GNrXPXOWMJSYIiw_bbSdbQ224k58hy6pCPXIb65Cl4gcuNzhTvPQEpthwduWBI5ndPtX/pub?gid=0&single=true&output=csv'
 # Добавляем ссылку на таблицу с эффектами/весами
-EFFECTS_CSV = 'https://docs.google.com/spreadsheets/d/e/2PACX-1vRZQwtU_n44GNrXPXOWMJSYIiw_bbSdbQ224k58hy6pCPXIb65Cl4gcuNzhTvPQEpthwduWBI5ndPtX/pub?gid=700597969&single=true&output=csv'
+EFFECTS_CSV = os.environ.get('COB_EFFECTS_CSV') or 'https://docs.google.com/spreadsheets/d/e/2PACX-1vRZQwtU_n44GNrXPXOWMJSYIiw_bbSdbQ224k58hy6pCPXIb65Cl4gcuNzhTvPQEpthwduWBI5ndPtX/pub?gid=700597969&single=true&output=csv'
+
+# seed массовых прогонов, если запрос не передал свой
+DEFAULT_SEED = 0
 
 # Функция fix_nan больше не нужна, так как мы убрали поле 'raw'
 
@@ -135,6 +143,12 @@ def parse_starters():
         starters.append(starter)
     return starters
 
+def fetch_catalog():
+    return parse_main_cards(), parse_starters()
+
+# Карты отдаются из снимка в памяти; таблицы перечитываются в фоне по TTL
+CATALOG = CatalogService(fetch_catalog)
+
 @app.route('/')
 def index():
     return send_from_directory(os.path.dirname(__file__), 'index.html')
@@ -145,338 +159,150 @@ def favicon():
 
 @app.route('/api/cards', methods=['GET'])
 def get_cards():
-    main = parse_main_cards()
-    starters = parse_starters()
-    return jsonify({'main': main, 'starters': starters})
+    snapshot = CATALOG.get()
+    return jsonify({'main': snapshot['main'], 'starters': snapshot['starters'], 'version': snapshot['version']})
+
+def simulation_request(data):
+    # Разбор запроса на симуляцию: общий для /api/simulate и фоновых задач
+    strategy1 = data.get('strategy1', 'red')
+    strategy2 = data.get('strategy2', 'poison')
+    hp1 = int(data.get('hp1', 40))
+    hp2 = int(data.get('hp2', 50))
+    num_games = int(data.get('num_games', 1))  # было 1000, теперь 1
+    # Режим точности: вместо числа игр задаётся ширина доверительного интервала P1_win_percent
+    # (в процентных пунктах, опционально и avg_turns); num_games тогда — бюджет max_games
+    target_ci_width = data.get('target_ci_width')
+    if target_ci_width is not None:
+        num_games = int(data.get('max_games', 100000))
+    enabled_cards = set(name.strip().lower() for name in data.get('enabled_cards', []))
+    # Массовые прогоны по умолчанию "тихие": строки лога вообще не строятся
+    silent = bool(data.get('silent', num_games > 1))
+    snapshot = CATALOG.get()
+    config = {
+        'strategy1': strategy1,
+        'strategy2': strategy2,
+        'user_strategy1': data.get('user_strategy1'),
+        'user_strategy2': data.get('user_strategy2'),
+        'hp1': hp1,
+        'hp2': hp2,
+        'enabled_cards': enabled_cards,
+        'log_options': data.get('log_options', None),
+        'silent': silent,
+        'trade_row_size': int(data.get('trade_row_size', 5)),
+        # Замеры времени по фазам партии (sim.PhaseProfile) — в ответе stats['profile']
+        'profile': bool(data.get('profile', False)),
+        'cards': [c for c in snapshot['main'] if c['name'].strip().lower() in enabled_cards],
+        'starters': snapshot['starters'],
+    }
+    params = {
+        'strategy1': strategy1,
+        'strategy2': strategy2,
+        'hp1': hp1,
+        'hp2': hp2,
+        'num_games': num_games,
+        'enabled_cards': list(enabled_cards)
+    }
+    return {
+        'config': config,
+        'params': params,
+        'num_games': num_games,
+        'target_ci_width': target_ci_width,
+        'single_game': num_games == 1 and target_ci_width is None,
+        'silent': silent,
+        # Массовые прогоны по умолчанию идут с фиксированным seed: одинаковый запрос
+        # отдаётся из кэша результатов, а больший num_games только доигрывает недостающие партии
+        'seed': data.get('seed', DEFAULT_SEED if num_games > 1 else None),
+        'workers': data.get('workers'),
+        'cache': bool(data.get('cache', True)),
+        # Построчная выгрузка партий: export=true (npz) или имя формата — npz/parquet/feather
+        'export': None if not data.get('export') or num_games == 1 else
+                  check_format('npz' if data['export'] is True else str(data['export'])),
+        # Лог одной партии: 'detailed' — снимки зон по ходам (для UI), 'replay' — компактный реплей (replay.py)
+        'log_format': check_log_format(data.get('log_format', 'detailed')),
+    }
+
+LOG_FORMATS = ('detailed', 'replay')
+
+def check_log_format(fmt):
+    if fmt not in LOG_FORMATS:
+        raise ValueError(f"Неизвестный формат лога: {fmt} (доступны: {', '.join(LOG_FORMATS)})")
+    return fmt
+
+def open_export(req):
+    # Каждая выгрузка — свой каталог в EXPORT_DIR; путь возвращается в ответе
+    if req['export'] is None:
+        return None
+    name = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    return GameExportWriter(os.path.join(EXPORT_DIR, name), req['export'],
+                            meta={'params': req['params'], 'seed': req['seed']})
+
+def finish_export(export, results, complete=True):
+    if export is not None:
+        results['export'] = export.close(complete)
+    return results
+
+def simulate_to_precision_request(req, data, progress=None, export=None):
+    target_turns = data.get('target_turns_ci_width')
+    stats = sim.simulate_to_precision(
+        req['config'], float(req['target_ci_width']),
+        turns_ci_width=None if target_turns is None else float(target_turns),
+        max_games=req['num_games'], batch=int(data.get('batch', 1000)),
+        confidence=float(data.get('confidence', 0.95)),
+        seed=req['seed'], workers=req['workers'], cache=req['cache'], progress=progress, export=export)
+    req['params']['num_games'] = stats['precision']['games']
+    return stats
+
+def run_single_game(req):
+    # -> (результат партии, статистика); каталог и лог партии — в состоянии потока запроса
+    config, seed = req['config'], req['seed']
+    sim.prepare_run(config)
+    with sim.log_run(silent=req['silent']):
+        replay = req['log_format'] == 'replay'
+        profile = sim.PhaseProfile() if config['profile'] else None
+        res = sim.run_config_game(config, collect_log=not replay, collect_replay=replay,
+                                  seed=None if seed is None else sim.game_seed(seed, 0), profile=profile)
+    agg = sim.SimAggregate(config)
+    agg.add_game(sim.summarize_game(res))
+    agg.profile = profile
+    stats = agg.finalize()
+    stats['params'] = req['params']
+    return res, stats
+
+def stream_job(kind, data, games, run):
+    # NDJSON: строка {"type": "progress", ...} на каждый срез задачи, в конце {"type": "result", ...}.
+    # Задача стартует сразу, без очереди (переполненная очередь — 429 до начала потока)
+    job = JOBS.start(kind, data, games, run)
+    def generate():
+        try:
+            for progress in job.follow():
+                yield json.dumps(progress, ensure_ascii=False, default=str) + '\n'
+            try:
+                event = {'type': 'result', **job.wait()}
+            except Exception as e:
+                event = {'type': 'result', 'result': 'error', 'error': str(e)}
+            yield json.dumps(event, ensure_ascii=False, default=str) + '\n'
+        finally:
+            # Закрытый клиентом поток отменяет задачу (выгрузка помечается незавершённой)
+            JOBS.forget(job)
+    return generate()
 
 @app.route('/api/simulate', methods=['POST'])
 def simulate():
     try:
         data = request.json
-        strategy1 = data.get('strategy1', 'red')
-        strategy2 = data.get('strategy2', 'poison')
-        user_strategy1 = data.get('user_strategy1')
-        user_strategy2 = data.get('user_strategy2')
-        hp1 = int(data.get('hp1', 40))
-        hp2 = int(data.get('hp2', 50))
-        num_games = int(data.get('num_games', 1))  # было 1000, теперь 1
-        enabled_cards = set(name.strip().lower() for name in data.get('enabled_cards', []))
-        log_options = data.get('log_options', None)
-        all_cards = parse_main_cards()
-        filtered_cards = [c for c in all_cards if c['name'].strip().lower() in enabled_cards]
-        starter_names = set(card['name'] for card in parse_starters())
-
-        def get_card_priority_func(user_strategy):
-            if not user_strategy:
-                return None
-            # Собираем приоритеты: {card_name: (priority, enabled)}
-            card_priority = {}
-            for color, arr in user_strategy.get('cards', {}).items():
-                for idx, obj in enumerate(arr):
-                    card_priority[obj['name'].strip().lower()] = (idx, obj.get('enabled', True))
-            effect_filters = user_strategy.get('effect_filters', {})
-            def priority(card):
-                name = card.name.strip().lower() if hasattr(card, 'name') else card['name'].strip().lower()
-                if name in card_priority:
-                    prio, enabled = card_priority[name]
-                    return (0 if enabled else 10000, prio)
-                return (10000, 9999)
-            def is_enabled(card):
-                name = card.name.strip().lower() if hasattr(card, 'name') else card['name'].strip().lower()
-                # 1. Проверка enabled-флага
-                enabled = card_priority.get(name, (None, True))[1]
-                if not enabled:
-                    return False
-                # 2. Больше не фильтруем по effect_filters (все карты разрешены, если не отключены явно)
-                return True
-            return priority, is_enabled
-
-        def is_card_allowed(card_name, enabled_cards, user_strategy):
-            name = card_name.strip().lower()
-            if name not in enabled_cards:
-                return False
-            if user_strategy and 'cards' in user_strategy:
-                for color, arr in user_strategy['cards'].items():
-                    for obj in arr:
-                        if obj['name'].strip().lower() == name:
-                            return obj.get('enabled', True)
-            return True
-
-        # Передаём приоритеты в симулятор через глобальные переменные (или паттерн)
-        import simulator as sim
-        sim.MAIN_CARDS = filtered_cards
-        sim.STARTER_CARDS = parse_starters()
-        sim.USER_STRATEGY1 = user_strategy1
-        sim.USER_STRATEGY2 = user_strategy2
-        sim.STRATEGY1 = strategy1
-        sim.STRATEGY2 = strategy2
-        sim.get_card_priority_func = get_card_priority_func
-        sim.ACTIVE_LOG_OPTIONS = set(log_options or [])
-
-        win1 = win2 = poison_win = 0
-        poison_win1 = poison_win2 = 0
-        turns_list = []
-        hp1_end = []
-        hp2_end = []
-        total_damage = 0
-        total_damage1 = 0
-        total_damage2 = 0
-        trash_counter = {}
-        gear_absorb = {}
-        card_value = {}
-        # Новые счетчики для анализа победителей/проигравших
-        winner_card_counter = {}
-        loser_card_counter = {}
-        winner_hp = []
-        winner_poison = []
-        hp_diff = []
-        # Сбор финальных значений яда и кровотока
-        poison1_end = []
-        poison2_end = []
-        bleed1_end = []
-        bleed2_end = []
-        # Новые метрики по эффектам и трэшу
-        sum_damage_dealt1 = sum_damage_dealt2 = 0
-        sum_poison_dealt1 = sum_poison_dealt2 = 0
-        sum_bleed_dealt1 = sum_bleed_dealt2 = 0
-        sum_heal_received1 = sum_heal_received2 = 0
-        sum_poison_heal_received1 = sum_poison_heal_received2 = 0
-        sum_bleed_heal_received1 = sum_bleed_heal_received2 = 0
-        sum_trash1 = sum_trash2 = 0
-        sum_trash_this1 = sum_trash_this2 = 0
-        # Gear-статистика по всем играм
-        gear_played1 = Counter()
-        gear_played2 = Counter()
-        gear_destroyed1 = Counter()
-        gear_destroyed2 = Counter()
-        gear_trashed1 = Counter()
-        gear_trashed2 = Counter()
-        gear_on_table1 = Counter()
-        gear_on_table2 = Counter()
-        for game_num in range(num_games):
-            collect_log_flag = (num_games == 1)
-            try:
-                res = simulate_game(strategy1, strategy2, log=False, custom_hp=(hp1, hp2), collect_log=collect_log_flag, user_strategy1=user_strategy1, user_strategy2=user_strategy2, log_options=log_options)
-            except Exception as e:
-                print('=== ERROR in simulate_game ===')
-                print(traceback.format_exc())
-                return jsonify({'result': 'error', 'error': str(e), 'traceback': traceback.format_exc()}), 500
-            turns_list.append(res['turns'])
-            p1 = res['player1']
-            p2 = res['player2']
-            # HP
-            hp1_end.append(p1.health)
-            hp2_end.append(p2.health)
-            # Damage (разница стартового и финального HP обоих игроков)
-            total_damage += (hp1 - p1.health) + (hp2 - p2.health)
-            total_damage1 += (hp2 - p2.health)  # сколько P1 нанёс P2
-            total_damage2 += (hp1 - p1.health)  # сколько P2 нанёс P1
-            # Value карт (по частоте трэша и встречаемости в колоде)
-            for idx, pl in enumerate([p1, p2]):
-                strat = [user_strategy1, user_strategy2][idx]
-                for c in getattr(pl, 'deck', []) + getattr(pl, 'discard', []) + getattr(pl, 'hand', []):
-                    if c.name not in starter_names and is_card_allowed(c.name, enabled_cards, strat):
-                        card_value[c.name] = card_value.get(c.name, 0) + 1
-            # Трэш
-            for idx, pl in enumerate([p1, p2]):
-                strat = [user_strategy1, user_strategy2][idx]
-                for c in getattr(pl, 'trash_pile', []):
-                    if c.name not in starter_names and is_card_allowed(c.name, enabled_cards, strat):
-                        trash_counter[c.name] = trash_counter.get(c.name, 0) + 1
-            # Gear absorb (если у карты есть поле absorbed_damage)
-            for pl in [p1, p2]:
-                for c in getattr(pl, 'deck', []) + getattr(pl, 'discard', []) + getattr(pl, 'hand', []):
-                    if hasattr(c, 'is_gear') and getattr(c, 'is_gear', False):
-                        val = getattr(c, 'absorbed_damage', 0)
-                        gear_absorb[c.name] = gear_absorb.get(c.name, 0) + val
-            # Победы
-            if res['winner'] == 'P1':
-                win1 += 1
-                winner = p1
-                loser = p2
-                opp = p2
-                # Победа через яд
-                if getattr(p2, 'poison', 0) >= 20:
-                    poison_win1 += 1
-            elif res['winner'] == 'P2':
-                win2 += 1
-                winner = p2
-                loser = p1
-                opp = p1
-                # Победа через яд
-                if getattr(p1, 'poison', 0) >= 20:
-                    poison_win2 += 1
-            else:
-                opp = None
-                winner = None
-                loser = None
-            # Аналитика по победителю/проигравшему
-            if winner and loser:
-                for idx, pl in enumerate([winner, loser]):
-                    strat = [user_strategy1, user_strategy2][[winner, loser].index(pl)]
-                    counter = winner_card_counter if pl is winner else loser_card_counter
-                    for c in getattr(pl, 'deck', []) + getattr(pl, 'discard', []) + getattr(pl, 'hand', []):
-                        if c.name not in starter_names and is_card_allowed(c.name, enabled_cards, strat):
-                            counter[c.name] = counter.get(c.name, 0) + 1
-                # HP и яд победителя
-                winner_hp.append(winner.health)
-                winner_poison.append(getattr(winner, 'poison', 0))
-                hp_diff.append(winner.health - loser.health)
-            # Новые метрики по gear и spy
-            gear_saved_damage_p1 = getattr(res, 'gear_saved_damage_p1', getattr(res['player1'], 'gear_saved_damage', 0))
-            gear_saved_damage_p2 = getattr(res, 'gear_saved_damage_p2', getattr(res['player2'], 'gear_saved_damage', 0))
-            spy_discarded_p1 = getattr(res, 'spy_discarded_p1', getattr(res['player1'], 'spy_discarded', 0))
-            spy_discarded_p2 = getattr(res, 'spy_discarded_p2', getattr(res['player2'], 'spy_discarded', 0))
-            gear_destroyed_p1 = getattr(res, 'gear_destroyed_p1', getattr(res['player1'], 'gear_destroyed', 0))
-            gear_destroyed_p2 = getattr(res, 'gear_destroyed_p2', getattr(res['player2'], 'gear_destroyed', 0))
-            # Суммируем по всем играм
-            if 'gear_saved_damage' not in locals():
-                gear_saved_damage = [0, 0]
-                spy_discarded = [0, 0]
-                gear_destroyed = [0, 0]
-            gear_saved_damage[0] += gear_saved_damage_p1
-            gear_saved_damage[1] += gear_saved_damage_p2
-            spy_discarded[0] += spy_discarded_p1
-            spy_discarded[1] += spy_discarded_p2
-            gear_destroyed[0] += gear_destroyed_p1
-            gear_destroyed[1] += gear_destroyed_p2
-            # Новые метрики по эффектам и трэшу
-            sum_damage_dealt1 += res.get('damage_dealt1', 0)
-            sum_damage_dealt2 += res.get('damage_dealt2', 0)
-            sum_poison_dealt1 += res.get('poison_dealt1', 0)
-            sum_poison_dealt2 += res.get('poison_dealt2', 0)
-            sum_bleed_dealt1 += res.get('bleed_dealt1', 0)
-            sum_bleed_dealt2 += res.get('bleed_dealt2', 0)
-            sum_heal_received1 += res.get('heal_received1', 0)
-            sum_heal_received2 += res.get('heal_received2', 0)
-            sum_poison_heal_received1 += res.get('poison_heal_received1', 0)
-            sum_poison_heal_received2 += res.get('poison_heal_received2', 0)
-            sum_bleed_heal_received1 += res.get('bleed_heal_received1', 0)
-            sum_bleed_heal_received2 += res.get('bleed_heal_received2', 0)
-            sum_trash1 += res.get('trash1', 0)
-            sum_trash2 += res.get('trash2', 0)
-            sum_trash_this1 += res.get('trash_this1', 0)
-            sum_trash_this2 += res.get('trash_this2', 0)
-            # Gear-статистика
-            gs1 = res.get('gear_stats1', {})
-            gs2 = res.get('gear_stats2', {})
-            gear_played1.update(gs1.get('played', {}))
-            gear_played2.update(gs2.get('played', {}))
-            gear_destroyed1.update(gs1.get('destroyed', {}))
-            gear_destroyed2.update(gs2.get('destroyed', {}))
-            gear_trashed1.update(gs1.get('trashed', {}))
-            gear_trashed2.update(gs2.get('trashed', {}))
-            gear_on_table1.update(gs1.get('on_table', {}))
-            gear_on_table2.update(gs2.get('on_table', {}))
-            # Яд и кровоток
-            poison1_end.append(getattr(p1, 'poison', 0))
-            poison2_end.append(getattr(p2, 'poison', 0))
-            bleed1_end.append(getattr(p1, 'bleed', 0))
-            bleed2_end.append(getattr(p2, 'bleed', 0))
-        avg_turns = sum(turns_list) / len(turns_list) if turns_list else 0
-        avg_hp1 = sum(hp1_end) / len(hp1_end) if hp1_end else 0
-        avg_hp2 = sum(hp2_end) / len(hp2_end) if hp2_end else 0
-        avg_poison1 = sum(poison1_end) / len(poison1_end) if poison1_end else 0
-        avg_poison2 = sum(poison2_end) / len(poison2_end) if poison2_end else 0
-        avg_bleed1 = sum(bleed1_end) / len(bleed1_end) if bleed1_end else 0
-        avg_bleed2 = sum(bleed2_end) / len(bleed2_end) if bleed2_end else 0
-        avg_damage = total_damage / num_games if num_games else 0
-        # Топ трэш
-        trashed_cards = sorted(trash_counter.items(), key=lambda x: -x[1])
-        # Топ value
-        top_cards = sorted(card_value.items(), key=lambda x: -x[1])[:10]
-        # Топ gear (только реально сыгравшие gear)
-        top_gear = sorted(gear_absorb.items(), key=lambda x: -x[1])
-        # Новая статистика по Priestess
-        def priestess_stats(player):
-            bought = sum(1 for c in getattr(player, 'deck', []) + getattr(player, 'discard', []) + getattr(player, 'hand', []) if getattr(c, 'name', '').lower() == 'priestess')
-            trashed = sum(1 for c in getattr(player, 'trash_pile', []) if getattr(c, 'name', '').lower() == 'priestess')
-            as_gear = sum(1 for c in getattr(player, 'gear', []) if getattr(c, 'name', '').lower() == 'priestess')
-            absorbed = sum(getattr(c, 'absorbed_damage', 0) for c in getattr(player, 'deck', []) + getattr(player, 'discard', []) + getattr(player, 'hand', []) + getattr(player, 'gear', []) if getattr(c, 'name', '').lower() == 'priestess')
-            return {'bought': bought, 'trashed': trashed, 'as_gear': as_gear, 'absorbed': absorbed}
-        priestess_stats1 = priestess_stats(p1)
-        priestess_stats2 = priestess_stats(p2)
-        # Новые метрики
-        top_winner_cards = sorted(winner_card_counter.items(), key=lambda x: -x[1])[:10]
-        top_loser_cards = sorted(loser_card_counter.items(), key=lambda x: -x[1])[:10]
-        avg_winner_hp = sum(winner_hp) / len(winner_hp) if winner_hp else 0
-        avg_winner_poison = sum(winner_poison) / len(winner_poison) if winner_poison else 0
-        avg_hp_diff = sum(hp_diff) / len(hp_diff) if hp_diff else 0
-        # gear_saved_damage теперь средний по игрокам
-        gear_saved_damage_avg = [round(x/num_games, 2) for x in gear_saved_damage]
-        # Проценты побед
-        P1_win_percent = round(100 * win1 / num_games, 2) if num_games else 0
-        P2_win_percent = round(100 * win2 / num_games, 2) if num_games else 0
+        req = simulation_request(data)
+        if not req['single_game']:
+            # Массовый прогон и прогон до точности — та же задача, что и /api/jobs, но без очереди и с ожиданием ответа
+            games, run = simulate_job(data, req)
+            if data.get('stream') and req['target_ci_width'] is None:
+                return Response(stream_with_context(stream_job('simulate', data, games, run)),
+                                mimetype='application/x-ndjson')
+            return jsonify(JOBS.run('simulate', data, games, run))
+        # Одна партия — с подробным логом, прямо в потоке запроса: не ждёт очереди и не занимает лимит
+        res, stats = run_single_game(req)
         results = {
             'result': 'ok',
-            'stats': {
-                'P1_win': win1,
-                'P2_win': win2,
-                'P1_win_percent': P1_win_percent,
-                'P2_win_percent': P2_win_percent,
-                'avg_turns': round(avg_turns, 2),
-                'avg_hp1': round(avg_hp1, 2),
-                'avg_hp2': round(avg_hp2, 2),
-                'avg_poison1': round(avg_poison1, 2),
-                'avg_poison2': round(avg_poison2, 2),
-                'avg_bleed1': round(avg_bleed1, 2),
-                'avg_bleed2': round(avg_bleed2, 2),
-                'avg_damage': round(avg_damage, 2),
-                'avg_damage1': round(total_damage1 / num_games, 2),
-                'avg_damage2': round(total_damage2 / num_games, 2),
-                'gear_saved_damage': gear_saved_damage_avg, # средний урон, поглощённый gear у каждого игрока
-                'gear_saved_damage_total': gear_saved_damage, # суммарно по gear для каждого игрока
-                'trashed_cards': trashed_cards,
-                'top_cards': top_cards,
-                'gear_absorbed': top_gear,
-                'params': {
-                    'strategy1': strategy1,
-                    'strategy2': strategy2,
-                    'hp1': hp1,
-                    'hp2': hp2,
-                    'num_games': num_games,
-                    'enabled_cards': list(enabled_cards)
-                },
-                # Новые метрики:
-                'top_winner_cards': top_winner_cards,
-                'top_loser_cards': top_loser_cards,
-                'avg_winner_hp': round(avg_winner_hp, 2),
-                'avg_winner_poison': round(avg_winner_poison, 2),
-                'avg_hp_diff': round(avg_hp_diff, 2),
-                'spy_discarded': spy_discarded,
-                'gear_destroyed': gear_destroyed,
-                'poison_win1': poison_win1,
-                'poison_win2': poison_win2,
-                # Новая статистика по Priestess:
-                'priestess_stats1': priestess_stats1,
-                'priestess_stats2': priestess_stats2,
-                # Новые средние метрики по эффектам и трэшу:
-                'avg_damage_dealt1': round(sum_damage_dealt1 / num_games, 2),
-                'avg_damage_dealt2': round(sum_damage_dealt2 / num_games, 2),
-                'avg_poison_dealt1': round(sum_poison_dealt1 / num_games, 2),
-                'avg_poison_dealt2': round(sum_poison_dealt2 / num_games, 2),
-                'avg_bleed_dealt1': round(sum_bleed_dealt1 / num_games, 2),
-                'avg_bleed_dealt2': round(sum_bleed_dealt2 / num_games, 2),
-                'avg_heal_received1': round(sum_heal_received1 / num_games, 2),
-                'avg_heal_received2': round(sum_heal_received2 / num_games, 2),
-                'avg_poison_heal_received1': round(sum_poison_heal_received1 / num_games, 2),
-                'avg_poison_heal_received2': round(sum_poison_heal_received2 / num_games, 2),
-                'avg_bleed_heal_received1': round(sum_bleed_heal_received1 / num_games, 2),
-                'avg_bleed_heal_received2': round(sum_bleed_heal_received2 / num_games, 2),
-                'avg_trash1': round(sum_trash1 / num_games, 2),
-                'avg_trash2': round(sum_trash2 / num_games, 2),
-                'avg_trash_this1': round(sum_trash_this1 / num_games, 2),
-                'avg_trash_this2': round(sum_trash_this2 / num_games, 2),
-                # Gear-статистика по всем играм (по именам карт):
-                'gear_played1': dict(gear_played1),
-                'gear_played2': dict(gear_played2),
-                'gear_destroyed1': dict(gear_destroyed1),
-                'gear_destroyed2': dict(gear_destroyed2),
-                'gear_trashed1': dict(gear_trashed1),
-                'gear_trashed2': dict(gear_trashed2),
-                'gear_on_table1': dict(gear_on_table1),
-                'gear_on_table2': dict(gear_on_table2),
-            }
+            'stats': stats
         }
         # --- Универсальная функция сериализации карты ---
         def card_to_dict(card):
@@ -510,79 +336,370 @@ def simulate():
                 'trash_pile': [card_to_dict(c) for c in getattr(player, 'trash_pile', [])],
             }
         # detailed_log только для одной игры
-        if num_games == 1:
-            # Patch detailed_log to convert Card objects to dicts
-            def patch_log(log):
-                if isinstance(log, list):
-                    return [patch_log(x) for x in log]
-                if isinstance(log, dict):
-                    newd = {}
-                    for k, v in log.items():
-                        # Сериализуем все списки карт
-                        if k in ('hand', 'deck', 'discard', 'gear', 'trash_pile', 'played', 'bought') and isinstance(v, list):
-                            newd[k] = [card_to_dict(c) if hasattr(c, 'name') else c for c in v]
-                        # Сериализуем списки шагов покупок и состояний рынка
-                        elif k in ('buy_steps', 'market_states') and isinstance(v, list):
-                            newd[k] = [patch_log(x) for x in v]
-                        # Сериализуем эффекты
-                        elif k == 'effects' and isinstance(v, list):
-                            newd[k] = []
-                            for eff in v:
-                                if isinstance(eff, dict) and 'card' in eff and hasattr(eff['card'], 'name'):
-                                    eff2 = eff.copy()
-                                    eff2['card'] = getattr(eff['card'], 'name', str(eff['card']))
-                                    newd[k].append(eff2)
-                                else:
-                                    newd[k].append(eff)
-                        else:
-                            newd[k] = patch_log(v)
-                    return newd
-                return log
-            # Patch player1/player2 if present
-            if 'player1' in res and hasattr(res['player1'], 'deck'):
-                results['player1'] = player_to_dict(res['player1'])
-            if 'player2' in res and hasattr(res['player2'], 'deck'):
-                results['player2'] = player_to_dict(res['player2'])
-            # Patch detailed_log if present
-            if 'detailed_log' in res:
-                results['detailed_log'] = patch_log(res['detailed_log'])
-            # --- ДОБАВЛЯЮ: в конце каждого хода (end_status) сохраняю подробную информацию ---
-            def enrich_end_status(action, player):
-                # Добавить подробную инфу о руке, колоде, сбросе, трэше
-                action['end_status']['hand_count'] = len(getattr(player, 'hand', []))
-                action['end_status']['deck_count'] = len(getattr(player, 'deck', []))
-                action['end_status']['discard_count'] = len(getattr(player, 'discard', []))
-                action['end_status']['trash_count'] = len(getattr(player, 'trash_pile', []))
-                action['end_status']['hand_cards'] = [getattr(c, 'name', None) for c in getattr(player, 'hand', [])]
-                action['end_status']['deck_cards'] = [getattr(c, 'name', None) for c in getattr(player, 'deck', [])]
-                action['end_status']['discard_cards'] = [getattr(c, 'name', None) for c in getattr(player, 'discard', [])]
-                action['end_status']['trash_cards'] = [getattr(c, 'name', None) for c in getattr(player, 'trash_pile', [])]
-            # enrich detailed_log
-            if 'detailed_log' in results and isinstance(results['detailed_log'], list):
-                for turn in results['detailed_log']:
-                    for action in turn.get('actions', []):
-                        # played: сохраняем повторы (каждый экземпляр)
-                        if 'played' in action and isinstance(action['played'], list):
-                            action['played'] = [card_to_dict(c) if hasattr(c, 'name') else c for c in action['played']]
-                        # enrich end_status
-                        if 'end_status' in action:
-                            pl = None
-                            if action.get('player') == 'P1' and 'player1' in results:
-                                pl = res['player1']
-                            elif action.get('player') == 'P2' and 'player2' in results:
-                                pl = res['player2']
-                            if pl:
-                                enrich_end_status(action, pl)
-                results['detailed_log'] = patch_log(results['detailed_log'])
+        # Patch detailed_log to convert Card objects to dicts
+        def patch_log(log):
+            if isinstance(log, list):
+                return [patch_log(x) for x in log]
+            if isinstance(log, dict):
+                newd = {}
+                for k, v in log.items():
+                    # Сериализуем все списки карт
+                    if k in ('hand', 'deck', 'discard', 'gear', 'trash_pile', 'played', 'bought') and isinstance(v, list):
+                        newd[k] = [card_to_dict(c) if hasattr(c, 'name') else c for c in v]
+                    # Сериализуем списки шагов покупок и состояний рынка
+                    elif k in ('buy_steps', 'market_states') and isinstance(v, list):
+                        newd[k] = [patch_log(x) for x in v]
+                    # Сериализуем эффекты
+                    elif k == 'effects' and isinstance(v, list):
+                        newd[k] = []
+                        for eff in v:
+                            if isinstance(eff, dict) and 'card' in eff and hasattr(eff['card'], 'name'):
+                                eff2 = eff.copy()
+                                eff2['card'] = getattr(eff['card'], 'name', str(eff['card']))
+                                newd[k].append(eff2)
+                            else:
+                                newd[k].append(eff)
+                    else:
+                        newd[k] = patch_log(v)
+                return newd
+            return log
+        # Patch player1/player2 if present
+        if 'player1' in res and hasattr(res['player1'], 'deck'):
+            results['player1'] = player_to_dict(res['player1'])
+        if 'player2' in res and hasattr(res['player2'], 'deck'):
+            results['player2'] = player_to_dict(res['player2'])
+        if res['replay'] is not None:
+            # Реплей уже из простых типов: сериализуется как есть, без обхода patch_log
+            results['replay'] = res['replay']
+        # Patch detailed_log if present
+        if res.get('detailed_log') is not None:
+            results['detailed_log'] = patch_log(res['detailed_log'])
+        # --- ДОБАВЛЯЮ: в конце каждого хода (end_status) сохраняю подробную информацию ---
+        def enrich_end_status(action, player):
+            # Добавить подробную инфу о руке, колоде, сбросе, трэше
+            action['end_status']['hand_count'] = len(getattr(player, 'hand', []))
+            action['end_status']['deck_count'] = len(getattr(player, 'deck', []))
+            action['end_status']['discard_count'] = len(getattr(player, 'discard', []))
+            action['end_status']['trash_count'] = len(getattr(player, 'trash_pile', []))
+            action['end_status']['hand_cards'] = [getattr(c, 'name', None) for c in getattr(player, 'hand', [])]
+            action['end_status']['deck_cards'] = [getattr(c, 'name', None) for c in getattr(player, 'deck', [])]
+            action['end_status']['discard_cards'] = [getattr(c, 'name', None) for c in getattr(player, 'discard', [])]
+            action['end_status']['trash_cards'] = [getattr(c, 'name', None) for c in getattr(player, 'trash_pile', [])]
+        # enrich detailed_log
+        if 'detailed_log' in results and isinstance(results['detailed_log'], list):
+            for turn in results['detailed_log']:
+                for action in turn.get('actions', []):
+                    # played: сохраняем повторы (каждый экземпляр)
+                    if 'played' in action and isinstance(action['played'], list):
+                        action['played'] = [card_to_dict(c) if hasattr(c, 'name') else c for c in action['played']]
+                    # enrich end_status
+                    if 'end_status' in action:
+                        pl = None
+                        if action.get('player') == 'P1' and 'player1' in results:
+                            pl = res['player1']
+                        elif action.get('player') == 'P2' and 'player2' in results:
+                            pl = res['player2']
+                        if pl:
+                            enrich_end_status(action, pl)
+            results['detailed_log'] = patch_log(results['detailed_log'])
         # Сохраняем в файл
         # timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
         # with open(f'simulation_result_{timestamp}.json', 'w', encoding='utf-8') as file:
         #     json.dump(results, file, ensure_ascii=False, indent=2)
         return jsonify(results)
+    except JobRejected as e:
+        return jsonify({'result': 'error', 'error': str(e)}), 429
     except Exception as e:
         print('=== ERROR in /api/simulate ===')
         print(traceback.format_exc())
         return jsonify({'result': 'error', 'error': str(e), 'traceback': traceback.format_exc()}), 500
 
+def tournament_request(data):
+    # entrants: имена встроенных паттернов и/или сохранённые user_strategy JSON
+    enabled_cards = set(name.strip().lower() for name in data.get('enabled_cards', []))
+    snapshot = CATALOG.get()
+    return {
+        'entrants': data.get('entrants') or ['red', 'poison', 'random'],
+        'catalog': {
+            'cards': [c for c in snapshot['main'] if c['name'].strip().lower() in enabled_cards],
+            'starters': snapshot['starters'],
+            'log_options': [],
+        },
+        'games_per_match': int(data.get('games_per_match', 100)),
+        'max_rounds': int(data.get('max_rounds', 20)),
+        'stable_rounds': int(data.get('stable_rounds', 3)),
+        'hp': (int(data.get('hp1', 50)), int(data.get('hp2', 50))),
+        'seed': data.get('seed', DEFAULT_SEED),
+        'workers': data.get('workers'),
+    }
+
+def run_tournament_request(req, on_round=None):
+    sim.prepare_run(req['catalog'])
+    results = sim.run_adaptive_tournament(
+        req['entrants'],
+        games_per_match=req['games_per_match'],
+        max_rounds=req['max_rounds'],
+        stable_rounds=req['stable_rounds'],
+        hp=req['hp'],
+        seed=req['seed'],
+        workers=req['workers'],
+        on_round=on_round)
+    return {'result': 'ok', **results}
+
+@app.route('/api/tournament', methods=['POST'])
+def tournament():
+    try:
+        return jsonify(run_sync('tournament', request.json))
+    except JobRejected as e:
+        return jsonify({'result': 'error', 'error': str(e)}), 429
+    except Exception as e:
+        print('=== ERROR in /api/tournament ===')
+        print(traceback.format_exc())
+        return jsonify({'result': 'error', 'error': str(e), 'traceback': traceback.format_exc()}), 500
+
+def compare_request(data):
+    # A/B: variant_a и variant_b (имя паттерна или user_strategy) на месте seat против соперника
+    # с другого места (strategy1/2, user_strategy1/2); остальное — как у /api/simulate
+    if data.get('variant_a') is None or data.get('variant_b') is None:
+        raise ValueError('Нужны оба варианта: variant_a и variant_b')
+    req = simulation_request(data)
+    seat = int(data.get('seat', 1))
+    if seat not in (1, 2):
+        raise ValueError('seat — 1 или 2')
+    req.update(variant_a=data['variant_a'], variant_b=data['variant_b'], seat=seat,
+               num_games=int(data.get('num_games', 1000)) if req['target_ci_width'] is None else req['num_games'],
+               batch=int(data.get('batch', 1000)), confidence=float(data.get('confidence', 0.95)))
+    return req
+
+def run_compare_request(req, progress=None):
+    report = sim.compare_paired(
+        req['config'], req['variant_a'], req['variant_b'], seat=req['seat'],
+        n_games=req['num_games'],
+        target_ci_width=None if req['target_ci_width'] is None else float(req['target_ci_width']),
+        max_games=req['num_games'], batch=req['batch'], confidence=req['confidence'],
+        seed=req['seed'] if req['seed'] is not None else DEFAULT_SEED, workers=req['workers'], progress=progress)
+    return {'result': 'ok', **report}
+
+@app.route('/api/compare', methods=['POST'])
+def compare():
+    try:
+        return jsonify(run_sync('compare', request.json))
+    except JobRejected as e:
+        return jsonify({'result': 'error', 'error': str(e)}), 429
+    except Exception as e:
+        print('=== ERROR in /api/compare ===')
+        print(traceback.format_exc())
+        return jsonify({'result': 'error', 'error': str(e), 'traceback': traceback.format_exc()}), 500
+
+def sweep_request(data):
+    # grid: {карта: {'cost': [...], 'copies': [...], 'effects': {'Damage': [...]}}} — см. sim.sweep_balance
+    if not data.get('grid'):
+        raise ValueError('Не задана сетка grid')
+    enabled_cards = set(name.strip().lower() for name in data.get('enabled_cards', []))
+    snapshot = CATALOG.get()
+    return {
+        'grid': data['grid'],
+        'entrants': data.get('entrants') or ['red', 'poison', 'random'],
+        'catalog': {
+            'cards': [c for c in snapshot['main'] if c['name'].strip().lower() in enabled_cards],
+            'starters': snapshot['starters'],
+            'log_options': [],
+        },
+        'games_per_matchup': int(data.get('games_per_matchup', 200)),
+        'max_variants': int(data.get('max_variants', 64)),
+        'hp': (int(data.get('hp1', 50)), int(data.get('hp2', 50))),
+        'seed': data.get('seed', DEFAULT_SEED),
+        'workers': data.get('workers'),
+    }
+
+def run_sweep_request(req, on_variant=None):
+    sim.prepare_run(req['catalog'])
+    results = sim.sweep_balance(
+        req['grid'], req['entrants'],
+        games_per_matchup=req['games_per_matchup'],
+        max_variants=req['max_variants'],
+        hp=req['hp'],
+        seed=req['seed'],
+        workers=req['workers'],
+        on_variant=on_variant)
+    return {'result': 'ok', **results}
+
+@app.route('/api/sweep', methods=['POST'])
+def sweep():
+    try:
+        return jsonify(run_sync('sweep', request.json))
+    except JobRejected as e:
+        return jsonify({'result': 'error', 'error': str(e)}), 429
+    except Exception as e:
+        print('=== ERROR in /api/sweep ===')
+        print(traceback.format_exc())
+        return jsonify({'result': 'error', 'error': str(e), 'traceback': traceback.format_exc()}), 500
+
+def optimize_request(data):
+    # user_strategy — база, space — пространство поиска (sim.strategy_candidates), opponents — как entrants турнира
+    if not data.get('user_strategy'):
+        raise ValueError('Не задана базовая стратегия user_strategy')
+    enabled_cards = set(name.strip().lower() for name in data.get('enabled_cards', []))
+    snapshot = CATALOG.get()
+    return {
+        'base': data['user_strategy'],
+        'opponents': data.get('opponents') or ['red', 'poison', 'random'],
+        'space': data.get('space') or {},
+        'catalog': {
+            'cards': [c for c in snapshot['main'] if c['name'].strip().lower() in enabled_cards],
+            'starters': snapshot['starters'],
+            'log_options': [],
+        },
+        'min_games': int(data.get('min_games', 40)),
+        'max_games': int(data.get('max_games', 2000)),
+        'eta': int(data.get('eta', 3)),
+        'keep': int(data.get('keep', 3)),
+        'hp': (int(data.get('hp1', 50)), int(data.get('hp2', 50))),
+        'seed': data.get('seed', DEFAULT_SEED),
+        'workers': data.get('workers'),
+    }
+
+def run_optimize_request(req, on_round=None):
+    sim.prepare_run(req['catalog'])
+    results = sim.optimize_strategy(
+        req['base'], req['opponents'], req['space'],
+        min_games=req['min_games'],
+        max_games=req['max_games'],
+        eta=req['eta'],
+        keep=req['keep'],
+        hp=req['hp'],
+        seed=req['seed'],
+        workers=req['workers'],
+        on_round=on_round)
+    return {'result': 'ok', **results}
+
+@app.route('/api/optimize', methods=['POST'])
+def optimize():
+    try:
+        return jsonify(run_sync('optimize', request.json))
+    except JobRejected as e:
+        return jsonify({'result': 'error', 'error': str(e)}), 429
+    except Exception as e:
+        print('=== ERROR in /api/optimize ===')
+        print(traceback.format_exc())
+        return jsonify({'result': 'error', 'error': str(e), 'traceback': traceback.format_exc()}), 500
+
+# --- Фоновые задачи ---
+def simulate_job(data, req=None):
+    # Запрос разбирается сразу (ошибки — при отправке), играется — в потоке очереди
+    req = req or simulation_request(data)
+    def run(job):
+        export = open_export(req)
+        try:
+            if req['target_ci_width'] is not None:
+                stats = simulate_to_precision_request(req, data, progress=job.report, export=export)
+            else:
+                events = sim.simulate_stream(req['config'], req['num_games'], seed=req['seed'], workers=req['workers'],
+                                             cache=req['cache'], every_games=data.get('progress_games'),
+                                             every_ms=int(data.get('progress_ms', 250)), export=export)
+                with closing(events):
+                    for event in events:
+                        if event['type'] == 'progress':
+                            job.report(event)
+                        else:
+                            stats = event['stats']
+        except BaseException:
+            finish_export(export, {}, complete=False)
+            raise
+        stats['params'] = req['params']
+        return finish_export(export, {'result': 'ok', 'stats': stats})
+    return req['num_games'], run
+
+def tournament_job(data):
+    req = tournament_request(data)
+    def run(job):
+        return run_tournament_request(req, on_round=lambda rounds, max_rounds: job.report(
+            {'rounds': rounds, 'max_rounds': max_rounds}))
+    games = req['games_per_match'] * max(1, len(req['entrants']) // 2) * req['max_rounds']
+    return games, run
+
+def optimize_job(data):
+    req = optimize_request(data)
+    def run(job):
+        return run_optimize_request(req, on_round=lambda rounds, alive, games: job.report(
+            {'rounds': rounds, 'alive': alive, 'games': games}))
+    # Оценка сверху для очереди: раунд 0 для max_candidates кандидатов и столько же на каждый следующий
+    candidates = int(req['space'].get('max_candidates', 64))
+    rounds = max(1, math.ceil(math.log(max(2, candidates), max(2, req['eta']))))
+    games = candidates * req['min_games'] * len(req['opponents']) * (rounds + 1)
+    return games, run
+
+def compare_job(data):
+    req = compare_request(data)
+    def run(job):
+        return run_compare_request(req, progress=job.report)
+    return 2 * req['num_games'], run
+
+def sweep_job(data):
+    req = sweep_request(data)
+    def run(job):
+        return run_sweep_request(req, on_variant=lambda done, total: job.report({'variants': done, 'total': total}))
+    variants = len(sim.sweep_variants(req['grid']))
+    entrants = len(req['entrants'])
+    games = variants * max(1, entrants * (entrants - 1)) * req['games_per_matchup']
+    return games, run
+
+JOB_KINDS = {'simulate': simulate_job, 'tournament': tournament_job, 'optimize': optimize_job, 'compare': compare_job,
+             'sweep': sweep_job}
+JOBS = JobQueue()
+
+def run_sync(kind, data):
+    # Синхронный запрос — та же задача под тем же лимитом, но без очереди; ответ после её завершения
+    games, run = JOB_KINDS[kind](data)
+    return JOBS.run(kind, data, games, run)
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    try:
+        data = request.json
+        kind = data.get('kind', 'simulate')
+        if kind not in JOB_KINDS:
+            return jsonify({'result': 'error', 'error': f'Неизвестный тип задачи: {kind}'}), 400
+        games, run = JOB_KINDS[kind](data)
+        job = JOBS.submit(kind, data, games, run)
+        return jsonify({'result': 'ok', **job.to_dict()}), 202
+    except JobRejected as e:
+        return jsonify({'result': 'error', 'error': str(e)}), 429
+    except Exception as e:
+        print('=== ERROR in /api/jobs ===')
+        print(traceback.format_exc())
+        return jsonify({'result': 'error', 'error': str(e), 'traceback': traceback.format_exc()}), 500
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({'result': 'ok', 'jobs': [job.to_dict() for job in JOBS.list()],
+                    'queued_games': JOBS.queued_games()})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({'result': 'error', 'error': 'Задача не найдена'}), 404
+    return jsonify({'result': 'ok', **job.to_dict()})
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({'result': 'error', 'error': 'Задача не найдена'}), 404
+    if job.status == 'done':
+        return jsonify(job.result)
+    if job.status == 'error':
+        return jsonify({'result': 'error', 'error': job.error}), 500
+    return jsonify({'result': 'error', 'error': f'Задача в статусе {job.status}', **job.to_dict()}), 409
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = JOBS.cancel(job_id)
+    if job is None:
+        return jsonify({'result': 'error', 'error': 'Задача не найдена'}), 404
+    return jsonify({'result': 'ok', **job.to_dict()})
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True) 
\ No newline at end of file
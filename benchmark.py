@@ -0,0 +1,454 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# --- Бенчмарк симулятора на локальном каталоге ---
+# Каталог, таблица эффектов и пользовательские стратегии лежат в benchmarks/ — без Google Sheets.
+#   python benchmark.py run [--quick] [--label L] [--compare]  — все замеры, результат дописывается в историю
+#   python benchmark.py compare [--base N] [--head N] [--threshold P] — сравнение двух прогонов из истории
+#   python benchmark.py list                                   — прогоны в истории
+#   python benchmark.py scale --axis A [--points ...] [--output F] — масштабирование на синтетическом каталоге
+#   python benchmark.py row-index [--points ...] [--output F]  — порог индекса ряда рынка (ROW_INDEX_MIN_SIZE)
+# Каждый замер повторяется несколько раз и берётся лучшее время; скорость — операций в секунду
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+FIXTURE_MAIN = os.path.join(BENCH_DIR, 'cards_main.csv')
+FIXTURE_STARTERS = os.path.join(BENCH_DIR, 'cards_starters.csv')
+FIXTURE_EFFECTS = os.path.join(BENCH_DIR, 'card_effects.csv')
+FIXTURE_STRATEGIES = os.path.join(BENCH_DIR, 'strategies.json')
+HISTORY_FILE = os.environ.get('COB_BENCH_HISTORY', os.path.join(BENCH_DIR, 'history.json'))
+BENCH_SEED = 2024
+REPEAT = 3
+# Замедление больше стольких процентов считается регрессией
+REGRESSION_THRESHOLD = 10.0
+
+# Парсеры каталога из app.py читают источники из окружения: подставляем файлы фикстуры
+# до импорта app, а снимок cards.json рабочего каталога не читаем вовсе
+os.environ['COB_CARDS_CSV'] = FIXTURE_MAIN
+os.environ['COB_STARTER_CSV'] = FIXTURE_STARTERS
+os.environ['COB_EFFECTS_CSV'] = FIXTURE_EFFECTS
+os.environ['COB_CATALOG_SNAPSHOT'] = ''
+
+import app
+import catalog_gen
+import simulator as sim
+
+# (имя, паттерн P1, паттерн P2, стратегия P1, стратегия P2, collect_log)
+GAME_CASES = (
+    ('games_red_vs_poison', 'red', 'poison', None, None, False),
+    ('games_random_vs_random', 'random', 'random', None, None, False),
+    ('games_user_pair', None, None, 'aggro', 'poison', False),
+    ('games_user_pair_log', None, None, 'aggro', 'poison', True),
+)
+# Объём работы одного повтора; --quick делит его на 10
+WORK = {
+    'catalog_parse': 20,
+    'catalog_compile': 200,
+    'games': 2000,
+    'games_log': 300,
+    'buy_states': 200,
+}
+BUY_TURNS = range(1, 13)
+BUY_BUDGETS = range(0, 8)
+
+
+def best_time(func, repeat=REPEAT):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def load_fixture():
+    main_cards, starter_cards = app.parse_main_cards(), app.parse_starters()
+    sim.prepare_run({'cards': main_cards, 'starters': starter_cards, 'log_options': []})
+    with open(FIXTURE_STRATEGIES, encoding='utf-8') as f:
+        strategies = json.load(f)
+    return main_cards, starter_cards, strategies
+
+
+def result(n, elapsed, unit):
+    return {'rate': round(n / elapsed, 2), 'unit': unit, 'n': n, 'best_s': round(elapsed, 6)}
+
+
+# --- Замеры ---
+def bench_catalog_parse(n):
+    def run():
+        for _ in range(n):
+            app.parse_main_cards()
+            app.parse_starters()
+    return result(n, best_time(run), 'catalogs/s')
+
+
+def bench_catalog_compile(n, main_cards, starter_cards):
+    # Холодная сборка: кэши программ эффектов и типов карт сбрасываются перед каждой
+    def run():
+        for _ in range(n):
+            sim._EFFECT_PROGRAMS.clear()
+            sim._CARD_TYPES.clear()
+            sim.load_catalog(list(main_cards), list(starter_cards))
+            sim.get_catalog()
+    elapsed = best_time(run)
+    sim.load_catalog(main_cards, starter_cards)
+    return result(n, elapsed, 'catalogs/s')
+
+
+def bench_games(n, case, strategies):
+    name, pattern1, pattern2, strat1, strat2, collect_log = case
+    user1 = strategies[strat1] if strat1 else None
+    user2 = strategies[strat2] if strat2 else None
+    def run():
+        with sim.log_run(silent=True):
+            for i in range(n):
+                sim.simulate_game(pattern1, pattern2, custom_hp=(40, 50), collect_log=collect_log,
+                                  user_strategy1=user1, user_strategy2=user2, seed=sim.game_seed(BENCH_SEED, i))
+    return result(n, best_time(run), 'games/s')
+
+
+def buy_states(n):
+    # Стартовые позиции: свежий рынок и игрок на каждом seed; buy_strategy их не меняет
+    states = []
+    for i in range(n):
+        sim.RNG.seed(sim.game_seed(BENCH_SEED, i))
+        market = sim.TradeMarket(sim.get_catalog().main_cards)
+        player = sim.Player('P1')
+        player.market = market
+        states.append((player, market))
+    return states
+
+
+def bench_buy(states, pattern=None, user_strategy=None):
+    def run():
+        for player, market in states:
+            for turn in BUY_TURNS:
+                for budget in BUY_BUDGETS:
+                    sim.buy_strategy(player, market, budget, 0, pattern=pattern, user_strategy=user_strategy,
+                                     turn_num=turn)
+    n = len(states) * len(BUY_TURNS) * len(BUY_BUDGETS)
+    return result(n, best_time(run), 'decisions/s')
+
+
+def run_suite(quick=False, progress=print):
+    scale = 10 if quick else 1
+    work = {key: max(1, n // scale) for key, n in WORK.items()}
+    results = {}
+    def record(name, res):
+        results[name] = res
+        progress(f"{name:28s} {res['rate']:>12.1f} {res['unit']}")
+    record('catalog_parse', bench_catalog_parse(work['catalog_parse']))
+    main_cards, starter_cards, strategies = load_fixture()
+    record('catalog_compile', bench_catalog_compile(work['catalog_compile'], main_cards, starter_cards))
+    for case in GAME_CASES:
+        record(case[0], bench_games(work['games_log'] if case[5] else work['games'], case, strategies))
+    states = buy_states(work['buy_states'])
+    sim.RNG.seed(BENCH_SEED)
+    record('buy_strategy_pattern', bench_buy(states, pattern='red'))
+    record('buy_strategy_user', bench_buy(states, user_strategy=strategies['aggro']))
+    return results
+
+
+# --- Масштабирование на синтетических каталогах ---
+# Одна ось меняется, остальное — SCALE_BASE. На каждой точке: время партии и хода,
+# сборка TradeMarket, одно решение buy_strategy и среднее время вызова по фазам хода
+# (PhaseProfile, отдельный прогон). Для числовых осей считается наклон в log-log:
+# 1 — линейный рост, больше SUPERLINEAR_SLOPE — сверхлинейный
+SCALE_BASE = {'n_cards': 30, 'copies': 3, 'mix': 'mixed', 'starter_deck': 10, 'trade_row_size': 5,
+              'hp': 50, 'max_turns': 30}
+# ось -> (параметр make_config, точки по умолчанию, поправки к SCALE_BASE). Для оси max_turns
+# HP поднят так, чтобы партии доигрывали до лимита ходов, а не заканчивались на ~13-м
+SCALE_AXES = {
+    'cards': ('n_cards', (10, 20, 40, 80, 160, 320), {}),
+    'copies': ('copies', (1, 2, 4, 8, 16), {}),
+    'row': ('trade_row_size', (3, 5, 10, 20, 40), {}),
+    'starter': ('starter_deck', (10, 20, 40, 80), {}),
+    'hp': ('hp', (25, 50, 100, 200, 400), {}),
+    'max_turns': ('max_turns', (15, 30, 60, 120, 240), {'hp': 100000}),
+    'mix': ('mix', tuple(catalog_gen.EFFECT_MIXES), {}),
+}
+SCALE_WORK = {'games': 200, 'markets': 200, 'buy_states': 50}
+SUPERLINEAR_SLOPE = 1.15
+SCALE_PHASES = ('setup', 'status', 'blessing', 'play', 'buy', 'end_turn', 'buy/buy_strategy')
+
+
+def loglog_slope(xs, ys):
+    points = [(math.log(x), math.log(y)) for x, y in zip(xs, ys) if x > 0 and y > 0]
+    if len(points) < 2:
+        return None
+    mx = sum(x for x, _ in points) / len(points)
+    my = sum(y for _, y in points) / len(points)
+    var = sum((x - mx) ** 2 for x, _ in points)
+    if not var:
+        return None
+    return round(sum((x - mx) * (y - my) for x, y in points) / var, 3)
+
+
+def scale_point(params, work, seed=BENCH_SEED):
+    config = catalog_gen.make_config(seed=seed, **params)
+    sim.prepare_run(config)
+    n_games = work['games']
+    turns = []
+    def games():
+        turns.clear()
+        with sim.log_run(silent=True):
+            for i in range(n_games):
+                turns.append(sim.run_config_game(config, seed=sim.game_seed(seed, i))['turns'])
+    game_s = best_time(games)
+    row = params['trade_row_size']
+    main_cards = sim.get_catalog().main_cards
+    def markets():
+        for _ in range(work['markets']):
+            sim.TradeMarket(main_cards, row)
+    market_s = best_time(markets)
+    states = []
+    for i in range(work['buy_states']):
+        sim.RNG.seed(sim.game_seed(seed, i))
+        market = sim.TradeMarket(main_cards, row)
+        player = sim.Player('P1')
+        player.market = market
+        states.append((player, market))
+    def buys():
+        for player, market in states:
+            for turn in BUY_TURNS:
+                for budget in BUY_BUDGETS:
+                    sim.buy_strategy(player, market, budget, 0, pattern='red', turn_num=turn)
+    buy_s = best_time(buys)
+    profile = sim.PhaseProfile()
+    with sim.log_run(silent=True):
+        for i in range(n_games):
+            sim.run_config_game(config, seed=sim.game_seed(seed, i), profile=profile)
+    report = profile.report()['phases']
+    return {
+        'catalog_cards': sum(c.get('copies', 1) for c in config['cards']),
+        'avg_turns': round(sum(turns) / n_games, 2),
+        'game_ms': round(game_s * 1000 / n_games, 4),
+        'turn_us': round(game_s * 1e6 / max(1, sum(turns)), 3),
+        'market_us': round(market_s * 1e6 / work['markets'], 3),
+        'buy_us': round(buy_s * 1e6 / (len(states) * len(BUY_TURNS) * len(BUY_BUDGETS)), 3),
+        'phase_us': {phase: report[phase]['avg_us'] for phase in SCALE_PHASES if phase in report},
+    }
+
+
+def run_scale(axis, points=None, quick=False, progress=print):
+    param, default_points, overrides = SCALE_AXES[axis]
+    base = dict(SCALE_BASE, **overrides)
+    points = list(points or default_points)
+    work = {key: max(1, n // (10 if quick else 1)) for key, n in SCALE_WORK.items()}
+    rows = []
+    progress(f"{axis:>10s} {'карт':>6s} {'ходов':>6s} {'партия мс':>10s} {'ход мкс':>9s} "
+             f"{'рынок мкс':>10s} {'покупка мкс':>12s}")
+    for value in points:
+        params = dict(base, **{param: value})
+        res = scale_point(params, work)
+        rows.append(dict(res, value=value))
+        progress(f"{str(value):>10s} {res['catalog_cards']:>6d} {res['avg_turns']:>6.1f} {res['game_ms']:>10.3f} "
+                 f"{res['turn_us']:>9.2f} {res['market_us']:>10.2f} {res['buy_us']:>12.2f}")
+    slopes = {}
+    if all(isinstance(v, (int, float)) for v in points):
+        xs = [row['value'] for row in rows]
+        for metric in ('game_ms', 'turn_us', 'market_us', 'buy_us'):
+            slopes[metric] = loglog_slope(xs, [row[metric] for row in rows])
+        for phase in SCALE_PHASES:
+            if all(phase in row['phase_us'] for row in rows):
+                slopes['phase:' + phase] = loglog_slope(xs, [row['phase_us'][phase] for row in rows])
+    superlinear = sorted(m for m, s in slopes.items() if s is not None and s > SUPERLINEAR_SLOPE)
+    if slopes:
+        progress('Наклон log-log: ' + ', '.join(f"{m} {s}" for m, s in slopes.items() if s is not None))
+    if superlinear:
+        progress(f"Сверхлинейный рост (наклон > {SUPERLINEAR_SLOPE}): {', '.join(superlinear)}")
+    return {'axis': axis, 'param': param, 'base': base, 'quick': quick, 'points': rows,
+            'slopes': slopes, 'superlinear': superlinear}
+
+
+# --- Порог индекса ряда рынка (sim.ROW_INDEX_MIN_SIZE) ---
+# Большой синтетический каталог, чтобы ряд любой длины было чем заполнить. На каждой длине ряда
+# одни и те же партии играются с линейным проходом по ряду и с RowIndex; порог — наименьшая
+# длина, начиная с которой индекс быстрее на всех точках
+ROW_INDEX_CATALOG = {'n_cards': 320, 'copies': 8}
+ROW_INDEX_POINTS = (8, 16, 24, 32, 48, 64, 128, 256)
+ROW_INDEX_GAMES = 100
+
+
+def run_row_index(points=None, quick=False, progress=print):
+    points = sorted(points or ROW_INDEX_POINTS)
+    n_games = max(1, ROW_INDEX_GAMES // (10 if quick else 1))
+    threshold = sim.ROW_INDEX_MIN_SIZE
+    rows = []
+    progress(f"{'ряд':>6s} {'линейно мс':>11s} {'индекс мс':>10s} {'ускорение':>10s}")
+    try:
+        for size in points:
+            config = catalog_gen.make_config(seed=BENCH_SEED, trade_row_size=size, **ROW_INDEX_CATALOG)
+            sim.prepare_run(config)
+            def games():
+                with sim.log_run(silent=True):
+                    for i in range(n_games):
+                        sim.run_config_game(config, seed=sim.game_seed(BENCH_SEED, i))
+            times = {}
+            for mode, min_size in (('linear', size + 1), ('index', 0)):
+                sim.ROW_INDEX_MIN_SIZE = min_size
+                times[mode] = best_time(games) * 1000 / n_games
+            rows.append({'row': size, 'linear_ms': round(times['linear'], 4), 'index_ms': round(times['index'], 4),
+                         'speedup': round(times['linear'] / times['index'], 3)})
+            progress(f"{size:>6d} {times['linear']:>11.3f} {times['index']:>10.3f} {rows[-1]['speedup']:>10.2f}")
+    finally:
+        sim.ROW_INDEX_MIN_SIZE = threshold
+    crossover = None
+    for row in reversed(rows):
+        if row['speedup'] <= 1:
+            break
+        crossover = row['row']
+    progress(f"Индекс быстрее начиная с ряда: {crossover or '-'} (ROW_INDEX_MIN_SIZE = {threshold})")
+    return {'catalog': ROW_INDEX_CATALOG, 'games': n_games, 'points': rows, 'crossover': crossover,
+            'row_index_min_size': threshold}
+
+
+# --- История прогонов ---
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def load_history(path=HISTORY_FILE):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_history(history, path=HISTORY_FILE):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(history, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def make_run(results, label=None, quick=False):
+    return {
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'label': label,
+        'commit': git_commit(),
+        'quick': quick,
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+
+
+def compare_runs(base, head, threshold=REGRESSION_THRESHOLD):
+    # -> строки сравнения по замерам, общим для обоих прогонов; change — изменение скорости в %
+    rows = []
+    for name, res in head['results'].items():
+        if name not in base['results']:
+            continue
+        before, after = base['results'][name]['rate'], res['rate']
+        change = 100 * (after / before - 1) if before else 0
+        rows.append({'name': name, 'base': before, 'head': after, 'unit': res['unit'],
+                     'change': round(change, 2), 'regression': change < -threshold})
+    return rows
+
+
+def run_title(idx, run):
+    label = f" [{run['label']}]" if run.get('label') else ''
+    return f"#{idx} {run['time']} {run.get('commit') or '-'}{label}"
+
+
+def print_comparison(history, base_idx, head_idx, threshold):
+    base, head = history[base_idx], history[head_idx]
+    print(f"База:  {run_title(base_idx % len(history), base)}")
+    print(f"Новый: {run_title(head_idx % len(history), head)}")
+    if base.get('quick') != head.get('quick') or base.get('machine') != head.get('machine'):
+        print("Внимание: прогоны сделаны в разных режимах или на разных машинах — сравнение приблизительное")
+    rows = compare_runs(base, head, threshold)
+    for row in rows:
+        flag = '  МЕДЛЕННЕЕ' if row['regression'] else ''
+        print(f"{row['name']:28s} {row['base']:>12.1f} -> {row['head']:>12.1f} {row['unit']:12s} "
+              f"{row['change']:+7.2f}%{flag}")
+    regressions = [row['name'] for row in rows if row['regression']]
+    if regressions:
+        print(f"Замедление больше {threshold}%: {', '.join(regressions)}")
+    return regressions
+
+
+# --- Командная строка ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарк симулятора CoB на локальном каталоге')
+    parser.add_argument('--history', default=HISTORY_FILE, help='JSON-файл истории прогонов')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='выполнить все замеры и дописать результат в историю')
+    run.add_argument('--quick', action='store_true', help='в 10 раз меньше работы (для быстрой проверки)')
+    run.add_argument('--label', help='метка прогона в истории')
+    run.add_argument('--compare', action='store_true', help='сразу сравнить с предыдущим прогоном')
+    run.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    compare = commands.add_parser('compare', help='сравнить два прогона из истории')
+    compare.add_argument('--base', type=int, default=-2, help='индекс базового прогона (по умолчанию предпоследний)')
+    compare.add_argument('--head', type=int, default=-1, help='индекс нового прогона (по умолчанию последний)')
+    compare.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                         help='порог замедления в процентах')
+    commands.add_parser('list', help='показать прогоны в истории')
+    scale = commands.add_parser('scale', help='рост времени по одной оси синтетического каталога (catalog_gen)')
+    scale.add_argument('--axis', choices=list(SCALE_AXES), required=True)
+    scale.add_argument('--points', nargs='+', help='значения оси (по умолчанию — стандартный ряд)')
+    scale.add_argument('--quick', action='store_true', help='в 10 раз меньше партий на точку')
+    scale.add_argument('--output', help='сохранить результат в JSON')
+    row_index = commands.add_parser('row-index', help='линейный проход по ряду рынка против RowIndex по длине ряда')
+    row_index.add_argument('--points', nargs='+', type=int, help='длины ряда (по умолчанию — стандартный ряд)')
+    row_index.add_argument('--quick', action='store_true', help='в 10 раз меньше партий на точку')
+    row_index.add_argument('--output', help='сохранить результат в JSON')
+    args = parser.parse_args(argv)
+
+    if args.command == 'scale':
+        points = args.points
+        if points and args.axis != 'mix':
+            points = [int(v) for v in points]
+        report = run_scale(args.axis, points, quick=args.quick)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=1)
+        return 1 if report['superlinear'] else 0
+
+    if args.command == 'row-index':
+        report = run_row_index(args.points, quick=args.quick)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=1)
+        return 0
+
+    history = load_history(args.history)
+    if args.command == 'run':
+        results = run_suite(quick=args.quick)
+        history.append(make_run(results, label=args.label, quick=args.quick))
+        save_history(history, args.history)
+        print(f"Записано в {args.history} как #{len(history) - 1}")
+        if args.compare and len(history) > 1:
+            return 1 if print_comparison(history, -2, -1, args.threshold) else 0
+        return 0
+    if args.command == 'list':
+        for idx, item in enumerate(history):
+            print(run_title(idx, item))
+        return 0
+    if len(history) < 2:
+        print("Для сравнения нужно хотя бы два прогона в истории")
+        return 2
+    try:
+        history[args.base], history[args.head]
+    except IndexError:
+        print(f"В истории {len(history)} прогонов")
+        return 2
+    return 1 if print_comparison(history, args.base, args.head, args.threshold) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
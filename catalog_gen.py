@@ -0,0 +1,137 @@
+import random
+
+# --- Синтетические каталоги для нагрузочных замеров ---
+# Каталог — в том же формате, что MAIN_CARDS/STARTER_CARDS из таблиц ({'name', 'type',
+# 'color', 'cost', 'effect1', 'effect2', ..., 'copies'}), так что его можно передать в
+# simulator.load_catalog или в config['cards'] для simulate_many. Всё определяется seed
+COLORS = ('red', 'blue', 'green', 'white')
+CHAINS = {'red': 'R_Chain', 'blue': 'B_Chain', 'green': 'G_Chain', 'white': 'W_Chain'}
+
+# Вид эффекта: (шаблон, диапазон значения, стоимость в Blessing за единицу значения)
+EFFECT_KINDS = {
+    'damage': ('{{Damage {}}}', (1, 4), 0.7),
+    'poison': ('{{Poison {}}}', (1, 3), 0.9),
+    'bleed': ('{{Bleed {}}}', (1, 3), 0.8),
+    'heal': ('{{Heal {}}}', (1, 4), 0.5),
+    'heal_poison': ('{{Heal_Poison {}}}', (1, 2), 0.5),
+    'blessing': ('{{Blessing {}}}', (1, 2), 1.0),
+    'draw': ('{{Draw {}}}', (1, 2), 1.2),
+    'spy': ('{{Spy {}}}', (1, 3), 0.6),
+    'steal': ('{{Steal {}}}', (1, 2), 1.0),
+    'stun': ('{{Stun {}}}', (1, 1), 0.8),
+    'trash': ('{{Trash}}', None, 1.0),
+    'trash_this': ('{{Trash_this}}', None, -0.5),
+    'destroy': ('{{Destroy}}', None, 1.0),
+}
+# Смеси эффектов: веса видов эффектов и доля gear-карт. draw — цепочки добора,
+# gear — много gear (с защитой игрока и с собственным HP), spy — spy/steal/destroy
+EFFECT_MIXES = {
+    'basic': ({'damage': 4, 'poison': 2, 'bleed': 1, 'heal': 1, 'heal_poison': 1, 'blessing': 2}, 0.0),
+    'draw': ({'draw': 5, 'blessing': 3, 'damage': 2, 'poison': 1}, 0.05),
+    'gear': ({'damage': 3, 'poison': 2, 'heal': 2, 'blessing': 2, 'destroy': 1}, 0.4),
+    'spy': ({'spy': 3, 'steal': 3, 'destroy': 1, 'damage': 2, 'stun': 1}, 0.1),
+    'mixed': ({kind: 1 for kind in EFFECT_KINDS}, 0.15),
+}
+MAX_COST = 8
+
+
+def effect_text(rng, kind):
+    template, values, unit_cost = EFFECT_KINDS[kind]
+    if values is None:
+        return template.format(), unit_cost
+    value = rng.randint(*values)
+    return template.format(value), unit_cost * value
+
+
+def random_effects(rng, kinds, weights, count):
+    texts = []
+    power = 0
+    for kind in rng.choices(kinds, weights, k=count):
+        text, cost = effect_text(rng, kind)
+        texts.append(text)
+        power += cost
+    return texts, power
+
+
+def make_card(rng, idx, mix, copies, chain_share=0.1, or_share=0.1):
+    weights, gear_share = EFFECT_MIXES[mix]
+    kinds = list(weights)
+    weights = [weights[k] for k in kinds]
+    color = COLORS[idx % len(COLORS)]
+    first, power = random_effects(rng, kinds, weights, rng.choice((1, 1, 2)))
+    if rng.random() < chain_share:
+        first.append('{' + CHAINS[color] + '}')
+    effect1 = ' '.join(first)
+    if rng.random() < or_share:
+        alternative, alt_power = random_effects(rng, kinds, weights, 1)
+        effect1 = f"{effect1} OR {alternative[0]}"
+        power = max(power, alt_power)
+    effect2 = ''
+    if rng.random() < 0.5:
+        second, second_power = random_effects(rng, kinds, weights, 1)
+        effect2 = second[0]
+        power += second_power
+    is_gear = rng.random() < gear_share
+    if is_gear:
+        # Как в таблицах: защита игрока — в effect1, собственный HP — в effect2
+        defense = rng.randint(2, 5)
+        if rng.random() < 0.5:
+            effect1 = f"{{Def_Y_Text {defense}}} {effect1}"
+        else:
+            effect2 = f"{{Def_N_Text {defense}}} {effect2}".strip()
+        power += 0.5 * defense
+    if isinstance(copies, (tuple, list)):
+        copies = rng.randint(*copies)
+    card = {
+        'name': f'Synthetic {idx + 1:04d}',
+        'type': 'Gear' if is_gear else 'Spell',
+        'color': color,
+        'cost': max(1, min(MAX_COST, round(power))),
+        'effect1': effect1,
+        'effect1text': '',
+        'effect2': effect2,
+        'effect2text': '',
+        'copies': copies,
+    }
+    if is_gear:
+        card['is_gear'] = True
+    return card
+
+
+def make_starters(deck_size=10):
+    # Prayer/Strike в пропорции 7:3, как в обычной стартовой колоде, плюс Priestess
+    prayers = min(deck_size, max(1, round(deck_size * 0.7)))
+    return [
+        {'name': 'Prayer', 'color': 'white', 'cost': 0, 'effect1': '{Blessing 1}', 'effect1text': '',
+         'effect2': '', 'effect2text': '', 'copies': prayers, 'deck_copies': prayers},
+        {'name': 'Strike', 'color': 'red', 'cost': 0, 'effect1': '{Damage 1}', 'effect1text': '',
+         'effect2': '', 'effect2text': '', 'copies': deck_size - prayers, 'deck_copies': deck_size - prayers},
+        {'name': 'Priestess', 'color': 'white', 'cost': 2, 'effect1': '{Blessing 2}', 'effect1text': '',
+         'effect2': '{Heal 1}', 'effect2text': '', 'copies': 1},
+    ]
+
+
+def make_catalog(n_cards=30, copies=3, mix='mixed', starter_deck=10, seed=0, chain_share=0.1, or_share=0.1):
+    # -> (main_cards, starter_cards); copies — число или диапазон (lo, hi)
+    if mix not in EFFECT_MIXES:
+        raise ValueError(f"Неизвестная смесь эффектов: {mix} (доступны: {', '.join(EFFECT_MIXES)})")
+    rng = random.Random(seed)
+    main_cards = [make_card(rng, i, mix, copies, chain_share, or_share) for i in range(n_cards)]
+    return main_cards, make_starters(starter_deck)
+
+
+def make_config(n_cards=30, copies=3, mix='mixed', starter_deck=10, trade_row_size=5, hp=50, max_turns=30,
+                strategy1='red', strategy2='poison', seed=0):
+    # Конфиг прогона в формате /api/simulate (simulate_many, run_config_game) на синтетическом каталоге
+    main_cards, starter_cards = make_catalog(n_cards, copies, mix, starter_deck, seed)
+    return {
+        'strategy1': strategy1,
+        'strategy2': strategy2,
+        'hp1': hp,
+        'hp2': hp,
+        'max_turns': max_turns,
+        'trade_row_size': trade_row_size,
+        'log_options': [],
+        'cards': main_cards,
+        'starters': starter_cards,
+    }
@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+import time
+
+from simulator import catalog_hash
+
+# --- Каталог карт: локальный снимок + фоновое обновление из источника ---
+# Снимок хранится в формате cards.json ({'main': [...], 'starters': [...]}), который
+# simulator.py читает и сам. Запросы всегда получают снимок из памяти; если он старше TTL,
+# обновление из источника запускается в фоне, а до его завершения отдаётся старый снимок
+CATALOG_SNAPSHOT = os.environ.get('COB_CATALOG_SNAPSHOT', 'cards.json')
+CATALOG_TTL = float(os.environ.get('COB_CATALOG_TTL', 300))
+
+
+def make_snapshot(main_cards, starter_cards, fetched_at=None):
+    return {
+        'main': main_cards,
+        'starters': starter_cards,
+        'version': catalog_hash(main_cards, starter_cards),
+        'fetched_at': time.time() if fetched_at is None else fetched_at,
+    }
+
+
+def read_snapshot(path):
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    # Старые cards.json без версии/времени тоже годятся: версия пересчитывается по содержимому
+    return make_snapshot(data['main'], data['starters'], data.get('fetched_at', os.path.getmtime(path)))
+
+
+def write_snapshot(path, snapshot):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, ensure_ascii=False, indent=1, default=str)
+    os.replace(tmp, path)
+
+
+class CatalogService:
+    # fetch() -> (main_cards, starter_cards): загрузка из настоящего источника (таблицы, файл, локальный HTTP)
+    def __init__(self, fetch, snapshot_path=CATALOG_SNAPSHOT, ttl=CATALOG_TTL):
+        self.fetch = fetch
+        self.snapshot_path = snapshot_path
+        self.ttl = ttl
+        self.snapshot = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        if snapshot_path and os.path.exists(snapshot_path):
+            try:
+                self.snapshot = read_snapshot(snapshot_path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"[CATALOG] Не удалось прочитать снимок {snapshot_path}: {e}")
+
+    def get(self):
+        snapshot = self.snapshot
+        if snapshot is None:
+            # Снимка ещё нет — первый запрос ждёт загрузки
+            return self.refresh()
+        if time.time() - snapshot['fetched_at'] > self.ttl:
+            self.refresh_async()
+        return snapshot
+
+    def refresh(self):
+        try:
+            main_cards, starter_cards = self.fetch()
+        except Exception as e:
+            self.last_error = str(e)
+            if self.snapshot is None:
+                raise
+            print(f"[CATALOG] Обновление не удалось, остаётся версия {self.snapshot['version'][:12]}: {e}")
+            # Следующая попытка — не раньше чем через TTL
+            self.snapshot = dict(self.snapshot, fetched_at=time.time())
+            return self.snapshot
+        snapshot = make_snapshot(main_cards, starter_cards)
+        if self.snapshot is not None and self.snapshot['version'] == snapshot['version']:
+            # Содержимое не изменилось: сохраняем прежние объекты, чтобы не сбрасывать кэши каталога
+            snapshot = dict(self.snapshot, fetched_at=snapshot['fetched_at'])
+        self.snapshot = snapshot
+        self.last_error = None
+        if self.snapshot_path:
+            try:
+                write_snapshot(self.snapshot_path, snapshot)
+            except OSError as e:
+                print(f"[CATALOG] Не удалось сохранить снимок {self.snapshot_path}: {e}")
+        return snapshot
+
+    def refresh_async(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        def worker():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[CATALOG] Ошибка фонового обновления: {e}")
+            finally:
+                self._refreshing = False
+        threading.Thread(target=worker, name='catalog-refresh', daemon=True).start()
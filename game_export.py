@@ -0,0 +1,121 @@
+import importlib.util
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# --- Построчная выгрузка партий в колоночные файлы ---
+# Выгрузка — это каталог: part-00000.<формат>, part-00001.<формат>, ... и meta.json.
+# Строки копятся в памяти до batch_rows и сбрасываются одним куском, поэтому
+# миллионы партий не держатся в памяти целиком. Колонки: game, seed, winner (0 — нет
+# победителя, 1 — P1, 2 — P2), turns, p1_*/p2_* — итоговые показатели игроков,
+# p1_bought_<карта>/p2_bought_<карта> — сколько копий карты игрок купил за партию
+EXPORT_DIR = os.environ.get('COB_EXPORT_DIR', 'exports')
+EXPORT_BATCH_ROWS = int(os.environ.get('COB_EXPORT_BATCH_ROWS', 100000))
+EXPORT_FORMATS = ('npz', 'parquet', 'feather')
+META_FILE = 'meta.json'
+
+
+def check_format(fmt):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt} (доступны: {', '.join(EXPORT_FORMATS)})")
+    # parquet/feather пишет pandas через pyarrow; npz доступен всегда
+    if fmt != 'npz' and importlib.util.find_spec('pyarrow') is None:
+        raise ValueError(f"Для формата {fmt} нужен pyarrow (pip install pyarrow), либо используйте npz")
+    return fmt
+
+
+class GameExportWriter:
+    def __init__(self, path, fmt='npz', batch_rows=EXPORT_BATCH_ROWS, meta=None):
+        self.path = path
+        self.format = check_format(fmt)
+        self.batch_rows = batch_rows
+        self.meta = meta or {}
+        self.pending = []
+        self.pending_rows = 0
+        self.parts = []
+        self.rows = 0
+        self.columns = None
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, columns):
+        # columns: {имя: массив} одинаковой длины — строки одного шарда
+        if self.columns is None:
+            self.columns = list(columns)
+        self.pending.append(columns)
+        self.pending_rows += len(columns['game'])
+        if self.pending_rows >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.pending_rows:
+            return
+        columns = {name: np.concatenate([part[name] for part in self.pending]) for name in self.columns}
+        name = f'part-{len(self.parts):05d}.{self.format}'
+        file = os.path.join(self.path, name)
+        if self.format == 'npz':
+            np.savez(file, **columns)
+        elif self.format == 'parquet':
+            pd.DataFrame(columns).to_parquet(file, index=False)
+        else:
+            pd.DataFrame(columns).to_feather(file)
+        self.parts.append(name)
+        self.rows += self.pending_rows
+        self.pending = []
+        self.pending_rows = 0
+
+    def close(self, complete=True):
+        # meta.json пишется последним: выгрузка без него (или с complete=False) — прерванная
+        self.flush()
+        info = {
+            'format': self.format,
+            'rows': self.rows,
+            'parts': self.parts,
+            'columns': self.columns or [],
+            'complete': complete,
+            **self.meta,
+        }
+        with open(os.path.join(self.path, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False, indent=2, default=str)
+        return {'path': self.path, 'format': self.format, 'rows': self.rows, 'parts': len(self.parts),
+                'complete': complete}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(complete=exc_type is None)
+
+
+# --- Чтение выгрузки ---
+def read_export_meta(path):
+    with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def iter_game_export(path, columns=None):
+    # По одному DataFrame на файл-кусок: для выгрузок, которые не помещаются в память целиком
+    meta = read_export_meta(path)
+    for name in meta['parts']:
+        file = os.path.join(path, name)
+        if meta['format'] == 'npz':
+            with np.load(file) as data:
+                yield pd.DataFrame({col: data[col] for col in (columns or meta['columns'])})
+        elif meta['format'] == 'parquet':
+            yield pd.read_parquet(file, columns=columns)
+        else:
+            yield pd.read_feather(file, columns=columns)
+
+
+def read_game_export(path, columns=None):
+    frames = list(iter_game_export(path, columns))
+    if not frames:
+        return pd.DataFrame(columns=columns or read_export_meta(path)['columns'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_game_export_arrays(path, columns):
+    # Только NumPy: склеенные колонки без общего DataFrame
+    parts = [{col: frame[col].to_numpy() for col in columns} for frame in iter_game_export(path, columns)]
+    return {col: np.concatenate([part[col] for part in parts]) if parts else np.array([]) for col in columns}
@@ -1,30 +1,24 @@
+import argparse
 import random
-from app import parse_main_cards, parse_starters
+from app import CATALOG
 import simulator as sim
+import mcts
 
 # Setup card data
-sim.MAIN_CARDS = parse_main_cards()
-sim.STARTER_CARDS = parse_starters()
+snapshot = CATALOG.get()
+sim.load_catalog(snapshot['main'], snapshot['starters'])
 
 # Utilities
 def count_blessing(cards):
-    total = 0
-    for card in cards:
-        for field in ['effect1', 'effect2', 'effect1text', 'effect2text']:
-            val = getattr(card, field, None)
-            if val:
-                for eff in sim.parse_effects_from_string(val):
-                    if isinstance(eff, (list, tuple)) and eff[0] == 'blessing':
-                        total += sim.safe_int(eff[1])
-    return total
+    return sum(card.program.blessing for card in cards)
 
 
 def print_state(player):
     print(f"{player.name}: HP={player.health} Poison={player.poison} Bleed={player.bleed}")
 
 
-def play_card(card, player, opponent):
-    sim.apply_card_effects(card, player, opponent, log=True, trash_list=[])
+def play_card(card, player, opponent, log=True):
+    sim.apply_card_effects(card, player, opponent, log=log, trash_list=[])
     # Move card to discard if not trashed
     for zone in [player.hand, player.discard, player.deck, player.gear]:
         if card in zone:
@@ -103,10 +97,32 @@ def bot_turn(player, opponent, market, pattern='red'):
     player.end_turn()
 
 
-def main():
+def quiet_play(card, player, opponent):
+    play_card(card, player, opponent, log=False)
+
+
+def mcts_turn(bot, player, opponent, market, turn):
+    # Ход MCTS-бота: розыгрыши по модели этой игры (play_card), без лога эффектов в поиске
+    def on_play(card):
+        print(f"Bot plays {card.name}")
+    def on_buy(name, cost):
+        print(f"Bot buys {name.title() if name == mcts.PRIESTESS else name} (Cost {cost})")
+    bot.play_turn(player, opponent, market, turn, on_play, on_buy)
+    if bot.last_search:
+        print(f"  [MCTS] {bot.last_search['iterations']} iterations, {bot.last_search['ms']} ms, "
+              f"{bot.last_search['nodes']} nodes")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play against a bot')
+    parser.add_argument('--bot', default='red', help="Bot pattern (red, poison, random, ...) or 'mcts'")
+    parser.add_argument('--budget-ms', type=float, default=mcts.MCTS_BUDGET_MS * 5,
+                        help='MCTS time budget per decision, ms')
+    args = parser.parse_args(argv)
+    searcher = mcts.MCTSBot(budget_ms=args.budget_ms, play=quiet_play) if args.bot == 'mcts' else None
     human = sim.Player('You')
     bot = sim.Player('Bot')
-    market = sim.TradeMarket(sim.MAIN_CARDS)
+    market = sim.TradeMarket(sim.get_catalog().main_cards)
     human.market = market
     bot.market = market
     turn = 1
@@ -121,7 +137,10 @@ def main():
         if bot.health <= 0 or bot.poison >= 20:
             print("You win!")
             break
-        bot_turn(bot, human, market)
+        if searcher is not None:
+            mcts_turn(searcher, bot, human, market, turn)
+        else:
+            bot_turn(bot, human, market, args.bot)
         if human.health <= 0 or human.poison >= 20:
             print("You lost!")
             break
@@ -0,0 +1,216 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, deque
+
+# --- Фоновые задачи: очередь, статус, отмена, хранение результатов ---
+# Задачи исполняются в ограниченном пуле потоков. Сами партии задача раскладывает по
+# процессам (simulator.run_parallel), а потоки только ведут задачи. Каталог и опции лога
+# у каждого потока свои (simulator.RunState), так что задачи не мешают друг другу
+# и запросам. Синхронные прогоны (JobQueue.run, JobQueue.start) не ждут очереди:
+# они стартуют сразу в своём потоке, но учитываются в том же лимите на число игр
+JOB_WORKERS = int(os.environ.get('COB_JOB_WORKERS', 1))
+JOB_MAX_QUEUED_GAMES = int(os.environ.get('COB_JOB_MAX_QUEUED_GAMES', 2000000))
+JOB_RESULT_TTL = float(os.environ.get('COB_JOB_TTL', 3600))
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobRejected(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind, params, games, fn):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.games = games
+        self.fn = fn
+        self.status = 'queued'
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.exception = None
+        self.cancel_requested = threading.Event()
+        self._changed = threading.Condition()
+
+    def check_cancelled(self):
+        if self.cancel_requested.is_set():
+            raise JobCancelled()
+
+    def report(self, progress):
+        # Вызывается из задачи: сохраняет срез прогресса и заодно проверяет отмену
+        with self._changed:
+            self.progress = progress
+            self._changed.notify_all()
+        self.check_cancelled()
+
+    def finish(self, status, result=None, error=None, exception=None):
+        with self._changed:
+            self.result = result
+            self.error = error
+            self.exception = exception
+            self.status = status
+            self.finished = time.time()
+            self._changed.notify_all()
+
+    def follow(self):
+        # Срезы прогресса по мере появления (промежуточные могут пропускаться), до завершения задачи
+        seen = None
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self.progress is not seen or self.finished is not None)
+                progress, finished = self.progress, self.finished is not None
+            if progress is not seen:
+                seen = progress
+                yield progress
+            if finished:
+                return
+
+    def wait(self):
+        # -> результат задачи; ошибка задачи поднимается как есть, отмена — JobCancelled
+        with self._changed:
+            self._changed.wait_for(lambda: self.finished is not None)
+        if self.status == 'cancelled':
+            raise JobCancelled()
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'games': self.games,
+            'progress': self.progress,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobQueue:
+    def __init__(self, workers=JOB_WORKERS, max_queued_games=JOB_MAX_QUEUED_GAMES, result_ttl=JOB_RESULT_TTL):
+        self.workers = workers
+        self.max_queued_games = max_queued_games
+        self.result_ttl = result_ttl
+        self.jobs = OrderedDict()
+        self.pending = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._threads = []
+
+    def _start_threads(self):
+        # Потоки поднимаются лениво, при первой задаче
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._worker, name=f'job-worker-{len(self._threads) + 1}', daemon=True)
+            self._threads.append(t)
+            t.start()
+
+    def queued_games(self):
+        return sum(job.games for job in self.jobs.values() if job.status in ('queued', 'running'))
+
+    def _admit(self, kind, params, games, fn):
+        # Вызывается под _lock: задача регистрируется, если укладывается в лимит на число игр
+        self._purge()
+        queued = self.queued_games()
+        if queued + games > self.max_queued_games:
+            raise JobRejected(f"Очередь переполнена: {queued} + {games} игр > {self.max_queued_games}")
+        job = Job(kind, params, games, fn)
+        self.jobs[job.id] = job
+        return job
+
+    def submit(self, kind, params, games, fn):
+        # fn(job) -> результат; games — оценка объёма для лимита на очередь
+        with self._lock:
+            job = self._admit(kind, params, games, fn)
+            self.pending.append(job)
+            self._start_threads()
+            self._wakeup.notify()
+        return job
+
+    def start(self, kind, params, games, fn):
+        # Синхронный прогон: задача под тем же лимитом, но без очереди — сразу в своём потоке
+        with self._lock:
+            job = self._admit(kind, params, games, fn)
+            job.status = 'running'
+            job.started = time.time()
+        threading.Thread(target=self._execute, args=(job,), name=f'job-{job.id[:8]}', daemon=True).start()
+        return job
+
+    def run(self, kind, params, games, fn):
+        # Синхронный запрос: вызывающий поток ждёт результат задачи
+        job = self.start(kind, params, games, fn)
+        try:
+            return job.wait()
+        finally:
+            self.forget(job)
+
+    def forget(self, job):
+        # Синхронная задача не хранится после ответа; если ответ не дождался её, она отменяется
+        self.cancel(job.id)
+        with self._lock:
+            if job.finished is not None:
+                self.jobs.pop(job.id, None)
+
+    def get(self, job_id):
+        with self._lock:
+            self._purge()
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            self._purge()
+            return list(self.jobs.values())
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == 'queued':
+                self.pending.remove(job)
+                job.finish('cancelled')
+            elif job.status == 'running':
+                # Задача остановится на ближайшей проверке (между шардами/раундами)
+                job.cancel_requested.set()
+            return job
+
+    def _purge(self):
+        # Завершённые задачи хранятся result_ttl секунд после окончания
+        now = time.time()
+        for job_id in [j.id for j in self.jobs.values() if j.finished and now - j.finished > self.result_ttl]:
+            del self.jobs[job_id]
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while not self.pending:
+                    self._wakeup.wait()
+                job = self.pending.popleft()
+                job.status = 'running'
+                job.started = time.time()
+            self._execute(job)
+
+    def _execute(self, job):
+        try:
+            result = job.fn(job)
+            outcome = {'status': 'done', 'result': result}
+        except JobCancelled:
+            outcome = {'status': 'cancelled'}
+        except Exception as e:
+            print(f'=== ERROR in job {job.id} ===')
+            print(traceback.format_exc())
+            outcome = {'status': 'error', 'error': str(e), 'exception': e}
+        with self._lock:
+            job.finish(**outcome)
@@ -0,0 +1,439 @@
+import math
+import time
+import simulator as sim
+
+# --- MCTS-бот: порядок розыгрыша и покупки поиском по дереву ---
+# Итерация поиска: детерминизация (скрытое от бота — порядок своей колоды, рука и колода
+# соперника, колода рынка — разыгрывается заново из того, что бот знает), спуск по решениям
+# текущего хода по UCB1 с раскрытием одного нового узла, доигрывание хода и rollout ещё
+# rollout_turns ходов политикой rollout_pattern за обоих, оценка позиции в [0, 1].
+# Узлы лежат в таблице транспозиций по хэшу информационного состояния (что видит бот):
+# одна и та же позиция, достигнутая разным порядком действий, делит статистику, а таблица
+# живёт между решениями — следующий выбор начинается с уже накопленного узла.
+# Модель хода — как в simulate_game (play_card ниже); interactive_game передаёт свою.
+# В simulate_game порядок розыгрыша задаёт движок, и бот паттерна 'mcts' выбирает только покупки.
+# Бюджет по времени — только для интерактивной игры: в simulate_game бот делает фиксированное
+# число итераций на решение с генератором от seed партии, иначе исход партии зависел бы от
+# загрузки машины и не воспроизводился бы (кэш результатов, одинаковая статистика при любом workers)
+MCTS_BUDGET_MS = 100
+# Примерно столько итераций укладывается в MCTS_BUDGET_MS на каталоге из benchmarks/
+MCTS_SIM_ITERATIONS = 200
+MCTS_EXPLORATION = 0.7
+ROLLOUT_TURNS = 3
+ROLLOUT_PATTERN = 'default'
+MAX_NODES = 200000
+# Лимиты хода, как max_play_iterations / max_buy_iterations в simulate_game
+MAX_PLAYS = 30
+MAX_BUYS = 10
+# Оценка незаконченной партии: «запас жизни» с учётом bleed и poison (20 poison — поражение,
+# как 50 HP), разница запасов переводится в вероятность логистой с масштабом EVAL_SCALE
+POISON_LIFE = 2.5
+EVAL_SCALE = 8.0
+
+# Действия в дереве: имя карты (разыграть из руки / купить из ряда), PRIESTESS, END —
+# закончить покупки (как None от buy_strategy: на остаток покупаются Priestess)
+PRIESTESS = 'priestess'
+END = None
+
+
+def lost(player):
+    return player.health <= 0 or player.poison >= 20
+
+
+def life(player):
+    bleed = player.bleed * (player.bleed + 1) / 2
+    return min(player.health - bleed, POISON_LIFE * (20 - player.poison))
+
+
+def evaluate(me, opponent, loser):
+    if loser is me:
+        return 0.0
+    if loser is opponent:
+        return 1.0
+    margin = (life(me) - life(opponent)) / EVAL_SCALE
+    return 1 / (1 + math.exp(-max(-30.0, min(30.0, margin))))
+
+
+# --- Модель хода (как в simulate_game) ---
+def play_card(card, player, opponent):
+    program = card.program
+    if card.is_gear:
+        if card not in player.gear:
+            player.gear.append(card)
+        for fld in program.fields[:2]:
+            for op in fld.ops:
+                if op.opcode not in ('def_y_text', 'def_n_text'):
+                    sim.apply_effect(op.opcode, op.value, card, player, opponent, False, [])
+                    if lost(player):
+                        return
+        return
+    for fld in program.fields[:2]:
+        for op in fld.ops:
+            if op.opcode == 'draw':
+                player.draw(op.value)
+            else:
+                sim.apply_effect(op.opcode, op.value, card, player, opponent, False, [])
+            if lost(player):
+                return
+    if card.name.lower() == 'priestess':
+        player.trash(card, 'trash_this' if program.has_trash_this else 'priestess_trash')
+    if card in player.hand:
+        player.discard.append(card)
+
+
+class TurnState:
+    # Состояние хода игрока между решениями: blessing, разыгранные карты (uid), счётчики
+    __slots__ = ('total', 'spent', 'played', 'plays', 'buys', 'phase')
+
+    def __init__(self, total, spent=0, phase='play'):
+        self.total = total
+        self.spent = spent
+        self.played = set()
+        self.plays = 0
+        self.buys = 0
+        self.phase = phase
+
+    def copy(self):
+        state = TurnState(self.total, self.spent, self.phase)
+        state.played = set(self.played)
+        state.plays = self.plays
+        state.buys = self.buys
+        return state
+
+    @property
+    def budget(self):
+        return self.total - self.spent
+
+
+def playable(player, state):
+    if state.plays >= MAX_PLAYS:
+        return []
+    return [c for c in player.hand if c.uid not in state.played]
+
+
+def play_step(card, player, opponent, state, play):
+    state.played.add(card.uid)
+    state.plays += 1
+    play(card, player, opponent)
+
+
+def buy_step(choice, player, market, state):
+    # choice — ответ buy_strategy (индекс в ряду, 'priestess' или None); как цикл покупок
+    # simulate_game: None — на весь остаток покупаются Priestess, и покупки заканчиваются
+    state.buys += 1
+    priestess = sim.get_priestess()
+    if choice == 'priestess':
+        if priestess and priestess.cost <= state.budget:
+            player.discard.append(sim.Card(priestess))
+            state.spent += priestess.cost
+        else:
+            state.phase = 'done'
+    elif choice is None:
+        if priestess and priestess.cost > 0:
+            for _ in range(state.budget // priestess.cost):
+                player.discard.append(sim.Card(priestess))
+                state.spent += priestess.cost
+        state.phase = 'done'
+    else:
+        card = market.trade_row[choice]
+        state.spent += card.cost
+        market.buy_card(choice, player)
+    if state.buys >= MAX_BUYS:
+        state.phase = 'done'
+
+
+def end_turn(player):
+    # -> True, если игрок проиграл в конце хода
+    player.end_turn()
+    return lost(player) or (not player.hand and not player.deck and not player.discard)
+
+
+def rollout_turn(player, opponent, market, pattern, turn_num, play=play_card):
+    # Полный ход по политике pattern; -> проигравший или None
+    if lost(player) or player.start_turn_statuses():
+        return player
+    state = TurnState(sum(card.program.blessing for card in player.hand))
+    return finish_turn(player, opponent, market, state, pattern, turn_num, play)
+
+
+def finish_turn(player, opponent, market, state, pattern, turn_num, play=play_card):
+    while state.phase == 'play':
+        cards = playable(player, state)
+        if not cards:
+            state.phase = 'buy'
+            break
+        play_step(cards[0], player, opponent, state, play)
+        if lost(player):
+            return player
+    while state.phase == 'buy':
+        choice = sim.buy_strategy(player, market, state.total, state.spent, pattern=pattern, turn_num=turn_num)
+        buy_step(choice, player, market, state)
+    return player if end_turn(player) else None
+
+
+# --- Детерминизация: копия партии с заново разыгранной скрытой информацией ---
+def clone_card(card):
+    copy = sim.Card.__new__(sim.Card)
+    copy.type = card.type
+    copy.uid = card.uid
+    copy.zone = None
+    copy.pos = 0
+    copy.absorbed_damage = card.absorbed_damage
+    copy.uses = card.uses
+    copy.trashed_by = card.trashed_by
+    return copy
+
+
+def clone_player(player, rng, hide_hand=False):
+    copy = sim.Player.__new__(sim.Player)
+    copy.__dict__.update(player.__dict__)
+    copy.priestess_uses = dict(player.priestess_uses)
+    hand = [clone_card(c) for c in player.hand]
+    deck = [clone_card(c) for c in player.deck]
+    if hide_hand:
+        # Рука соперника не видна: перераздаём её из руки и колоды вместе
+        pool = hand + deck
+        rng.shuffle(pool)
+        hand, deck = pool[:len(hand)], pool[len(hand):]
+    copy.deck = sim.LazyDeck('deck', deck)
+    copy.deck.shuffle()
+    copy.hand = sim.Zone('hand', hand)
+    copy.discard = sim.Zone('discard', [clone_card(c) for c in player.discard])
+    copy.gear = sim.Zone('gear', [clone_card(c) for c in player.gear])
+    copy.trash_pile = sim.Zone('trash_pile', [clone_card(c) for c in player.trash_pile])
+    for zone in (copy.deck, copy.hand, copy.discard, copy.gear, copy.trash_pile):
+        zone.rng = rng
+    copy.buy_rng = rng
+    return copy
+
+
+def clone_market(market, rng):
+    copy = sim.TradeMarket.__new__(sim.TradeMarket)
+    copy.trade_deck = list(market.trade_deck)
+    rng.shuffle(copy.trade_deck)
+    copy.trade_row_size = market.trade_row_size
+    copy.trade_row = [clone_card(c) for c in market.trade_row]
+    copy.listener = None
+    copy.indexes = {}
+    return copy
+
+
+def _names(cards):
+    return tuple(sorted(c.name for c in cards))
+
+
+class Node:
+    # stats: {действие: [посещения, сумма оценок]}
+    __slots__ = ('visits', 'stats')
+
+    def __init__(self):
+        self.visits = 0
+        self.stats = {}
+
+    def select(self, actions, exploration, rng):
+        fresh = [a for a in actions if a not in self.stats]
+        if fresh:
+            action = fresh[rng.index(len(fresh))]
+            self.stats[action] = [0, 0.0]
+            return action
+        # Доступные действия зависят от детерминизации: родитель — сумма посещений доступных
+        log_n = math.log(sum(self.stats[a][0] for a in actions))
+        def ucb(a):
+            n, w = self.stats[a]
+            return w / n + exploration * math.sqrt(log_n / n)
+        return max(actions, key=ucb)
+
+    def best(self, actions):
+        return max(actions, key=lambda a: self.stats.get(a, (0, 0))[0])
+
+
+class MCTSBot:
+    def __init__(self, budget_ms=MCTS_BUDGET_MS, iterations=None, exploration=MCTS_EXPLORATION,
+                 rollout_turns=ROLLOUT_TURNS, rollout_pattern=ROLLOUT_PATTERN, play=play_card, seed=None):
+        # budget_ms — время на одно решение; iterations — вместо времени фиксированное число
+        # итераций (воспроизводимо при заданном seed)
+        self.budget_ms = budget_ms
+        self.iterations = iterations
+        self.exploration = exploration
+        self.rollout_turns = rollout_turns
+        self.rollout_pattern = rollout_pattern
+        self.play = play
+        self.rng = sim.RandomStream(seed)
+        self.table = {}
+        self.last_search = None
+
+    def reset(self):
+        self.table.clear()
+
+    # --- Состояние и действия ---
+    def key(self, me, opponent, market, state, turn_num):
+        return hash((
+            turn_num, state.phase, state.total, state.spent,
+            me.health, me.poison, me.bleed, opponent.health, opponent.poison, opponent.bleed,
+            _names(playable(me, state)) if state.phase == 'play' else (),
+            _names(me.deck) + ('|',) + _names(me.discard), _names(me.gear),
+            _names(market.trade_row), len(opponent.hand), len(opponent.deck),
+            _names(opponent.discard), _names(opponent.gear),
+        ))
+
+    def actions(self, me, market, state):
+        if state.phase == 'play':
+            return list(dict.fromkeys(c.name for c in playable(me, state)))
+        if state.phase != 'buy':
+            return []
+        budget = state.budget
+        actions = list(dict.fromkeys(c.name for c in market.trade_row if c.cost <= budget))
+        priestess = sim.get_priestess()
+        if priestess and priestess.cost <= budget:
+            actions.append(PRIESTESS)
+        actions.append(END)
+        return actions
+
+    def apply(self, action, me, opponent, market, state):
+        if state.phase == 'play':
+            card = next(c for c in playable(me, state) if c.name == action)
+            play_step(card, me, opponent, state, self.play)
+            if not playable(me, state):
+                state.phase = 'buy'
+        elif action == PRIESTESS:
+            buy_step('priestess', me, market, state)
+        elif action is END:
+            buy_step(None, me, market, state)
+        else:
+            i = next(i for i, c in enumerate(market.trade_row) if c.name == action and c.cost <= state.budget)
+            buy_step(i, me, market, state)
+
+    # --- Поиск ---
+    def search(self, player, opponent, market, state, turn_num):
+        actions = self.actions(player, market, state)
+        if len(actions) <= 1:
+            return actions[0] if actions else END
+        if len(self.table) > MAX_NODES:
+            self.table.clear()
+        root_key = self.key(player, opponent, market, state, turn_num)
+        root = self.table.get(root_key)
+        reused = root.visits if root is not None else 0
+        start = time.perf_counter()
+        deadline = start + self.budget_ms / 1000 if self.budget_ms else None
+        n = 0
+        while True:
+            if self.iterations is not None and n >= self.iterations:
+                break
+            if deadline is not None and n and time.perf_counter() >= deadline:
+                break
+            self.iterate(player, opponent, market, state, turn_num)
+            n += 1
+        root = self.table[root_key]
+        action = root.best(actions)
+        self.last_search = {
+            'iterations': n,
+            'ms': round(1000 * (time.perf_counter() - start), 2),
+            'reused_visits': reused,
+            'nodes': len(self.table),
+            'action': action,
+            'visits': {str(a): root.stats.get(a, (0, 0))[0] for a in actions},
+        }
+        return action
+
+    def iterate(self, player, opponent, market, state, turn_num):
+        rng = self.rng
+        me = clone_player(player, rng)
+        opp = clone_player(opponent, rng, hide_hand=True)
+        mk = clone_market(market, rng)
+        me.market = opp.market = mk
+        state = state.copy()
+        path = []
+        expanding = True
+        loser = None
+        # Решения текущего хода: по дереву, пока не раскрыт новый узел, дальше — политикой rollout
+        while state.phase in ('play', 'buy'):
+            if expanding:
+                actions = self.actions(me, mk, state)
+                key = self.key(me, opp, mk, state, turn_num)
+                node = self.table.get(key)
+                if node is None:
+                    node = self.table[key] = Node()
+                    expanding = False
+                action = node.select(actions, self.exploration, rng)
+                path.append((node, action))
+                self.apply(action, me, opp, mk, state)
+                if lost(me):
+                    loser = me
+                    break
+            else:
+                loser = finish_turn(me, opp, mk, state, self.rollout_pattern, turn_num, self.play)
+                break
+        if loser is None and state.phase == 'done' and end_turn(me):
+            loser = me
+        # Rollout: ход соперника, затем rollout_turns полных кругов
+        turn = turn_num
+        players = (opp, me)
+        for k in range(2 * self.rollout_turns + 1):
+            if loser is not None:
+                break
+            p, o = players[k % 2], players[1 - k % 2]
+            if k % 2 == 1:
+                turn += 1
+            p.current_turn = turn
+            loser = rollout_turn(p, o, mk, self.rollout_pattern, turn, self.play)
+        value = evaluate(me, opp, loser)
+        for node, action in path:
+            node.visits += 1
+            stat = node.stats[action]
+            stat[0] += 1
+            stat[1] += value
+        return value
+
+    # --- Решения ---
+    def choose_play(self, player, opponent, market, state, turn_num):
+        # -> карта из руки для розыгрыша или None, если разыгрывать нечего
+        if state.phase != 'play':
+            return None
+        if not playable(player, state):
+            state.phase = 'buy'
+            return None
+        name = self.search(player, opponent, market, state, turn_num)
+        return next(c for c in playable(player, state) if c.name == name)
+
+    def choose_buy(self, player, market, total_blessing, spent_blessing, turn_num, state=None, opponent=None):
+        # Ответ в формате buy_strategy: индекс в ряду рынка, 'priestess' или None
+        if state is None:
+            state = TurnState(total_blessing, spent_blessing, phase='buy')
+        action = self.search(player, opponent or player.opponent, market, state, turn_num)
+        if action == PRIESTESS:
+            return 'priestess'
+        if action is END:
+            return None
+        return next(i for i, c in enumerate(market.trade_row) if c.name == action and c.cost <= state.budget)
+
+    def play_turn(self, player, opponent, market, turn_num, on_play=None, on_buy=None):
+        # Весь ход бота в реальной партии; -> проигравший или None
+        if lost(player) or player.start_turn_statuses():
+            return player
+        state = TurnState(sum(card.program.blessing for card in player.hand))
+        while True:
+            card = self.choose_play(player, opponent, market, state, turn_num)
+            if card is None:
+                break
+            play_step(card, player, opponent, state, self.play)
+            if on_play is not None:
+                on_play(card)
+            if lost(player):
+                return player
+        while state.phase == 'buy':
+            choice = self.choose_buy(player, market, state.total, state.spent, turn_num, state, opponent)
+            bought = market.trade_row[choice].name if isinstance(choice, int) else choice
+            before = state.spent
+            buy_step(choice, player, market, state)
+            if on_buy is not None and state.spent > before:
+                on_buy(bought or PRIESTESS, state.spent - before)
+        return player if end_turn(player) else None
+
+
+def player_bot(player):
+    # Бот паттерна 'mcts' в simulate_game: свой на каждого игрока партии, дерево живёт всю партию
+    bot = getattr(player, 'mcts_bot', None)
+    if bot is None:
+        bot = player.mcts_bot = MCTSBot(budget_ms=None, iterations=MCTS_SIM_ITERATIONS,
+                                        seed=player.buy_rng.rng.getrandbits(64))
+    return bot
@@ -0,0 +1,289 @@
+# --- Компактный реплей партии: simulate_game(..., collect_replay=True) ---
+# Вместо снимков зон на каждом ходу — заголовок и поток событий.
+# Заголовок: types — словарь типов карт (effects — шаги effect1 и effect2 в порядке применения), cards — тип каждого экземпляра (id карты в реплее —
+# индекс в cards), setup — начальная раскладка (зоны обоих игроков, статусы, ряд рынка).
+# События — плоские массивы; игрок (0/1) указан только там, где это не игрок текущего хода:
+#   ['turn', ход, игрок, blessing]     — начало хода игрока
+#   ['status', игрок, hp, poison, bleed] — статус изменился (пишется на границах ходов)
+#   ['draw', карта, ...]               — колода -> рука
+#   ['play', карта, шаг, ...]          — карта разыграна и применила эффекты (индексы в effects
+#                                        её типа); gear сразу ложится на стол, остальные
+#                                        уходят из руки в сброс после своих эффектов
+#   ['effect', шаг, ...]               — продолжение эффектов разыгранной карты после добора
+#   ['buy', карта]                     — из ряда рынка (или новая Priestess) в сброс
+#   ['market', карта, ...]             — новые карты в ряду рынка
+#   ['trash', карта, причина]
+#   ['move', игрок, зона, карта, ...]  — прочие переносы; зона None — карта ушла из игры
+#   ['shuffle', игрок]                 — сброс замешан в колоду
+#   ['end', потрачено blessing]        — конец хода: рука в сброс, добор — событием draw
+#   ['lost', игрок, причина]
+# Любое состояние восстанавливается проигрыванием событий (replay_state)
+REPLAY_VERSION = 1
+ZONES = ('deck', 'hand', 'discard', 'gear', 'trash')
+PLAYER_ZONES = (('deck', 'deck'), ('hand', 'hand'), ('discard', 'discard'), ('gear', 'gear'), ('trash', 'trash_pile'))
+
+
+def card_type_effects(ctype):
+    # Шаги эффектов в том порядке, в каком их применяет simulate_game
+    return [(op.opcode, op.raw) for fld in ctype.program.fields[:2] for op in fld.ops]
+
+
+def card_type_info(ctype, effects):
+    return {
+        'name': ctype.name,
+        'color': ctype.color,
+        'cost': ctype.cost,
+        'is_gear': ctype.is_gear,
+        'effects': [list(step) for step in effects],
+    }
+
+
+class ZoneListener:
+    # Вешается на Zone.listener: зона сообщает о картах, пришедших в неё
+    __slots__ = ('recorder', 'player', 'zone')
+
+    def __init__(self, recorder, player, zone):
+        self.recorder = recorder
+        self.player = player
+        self.zone = zone
+
+    def moved(self, card):
+        self.recorder.moved(self.player, self.zone, card)
+
+    def destroyed(self, card):
+        self.recorder.moved(self.player, None, card)
+
+    def reshuffled(self, cards):
+        self.recorder.reshuffled(self.player, cards)
+
+
+class ReplayRecorder:
+    def __init__(self, players, market):
+        self.types = []
+        self.type_ids = {}
+        self.type_effects = []
+        self.cards = []
+        self.card_ids = {}
+        self.where = {}
+        self.market = set()
+        self.events = []
+        self.players = players
+        self.active = None
+        self.played = None
+        self.step = 0
+        self.in_end = False
+        self.statuses = [self.status_of(p) for p in players]
+        setup_players = []
+        for idx, player in enumerate(players):
+            state = {'name': player.name, 'status': self.statuses[idx]}
+            for key, attr in PLAYER_ZONES:
+                zone = getattr(player, attr)
+                zone.listener = ZoneListener(self, idx, key)
+                state[key] = [self.card_id(c) for c in zone]
+                for cid in state[key]:
+                    self.where[cid] = (idx, key)
+            setup_players.append(state)
+        market.listener = self
+        row = [self.card_id(c) for c in market.trade_row]
+        self.market.update(row)
+        self.setup = {'players': setup_players, 'market': row}
+
+    @staticmethod
+    def status_of(player):
+        return [player.health, player.poison, player.bleed]
+
+    def card_id(self, card):
+        cid = self.card_ids.get(card.uid)
+        if cid is None:
+            tid = self.type_ids.get(card.type)
+            if tid is None:
+                tid = self.type_ids[card.type] = len(self.types)
+                self.type_effects.append(card_type_effects(card.type))
+                self.types.append(card_type_info(card.type, self.type_effects[tid]))
+            cid = self.card_ids[card.uid] = len(self.cards)
+            self.cards.append(tid)
+        return cid
+
+    def batch(self, head, cid):
+        # Подряд идущие однотипные переносы пишутся одним событием
+        events = self.events
+        if events and events[-1][:len(head)] == head:
+            events[-1].append(cid)
+        else:
+            events.append(head + [cid])
+
+    # --- События из зон и рынка ---
+    def moved(self, player, zone, card):
+        known = card.uid in self.card_ids
+        cid = self.card_id(card)
+        src = self.where.get(cid)
+        dst = None if zone is None else (player, zone)
+        self.where[cid] = dst
+        active = player == self.active
+        if cid in self.market or not known:
+            self.market.discard(cid)
+            if active and zone == 'discard':
+                self.events.append(['buy', cid])
+                return
+        elif src == dst:
+            # Карта вернулась в ту же зону (spy кладёт базовые карты обратно на колоду)
+            return
+        elif active and cid == self.played and src == (player, 'hand') and zone in ('discard', 'gear'):
+            # Перенос разыгранной карты уже описан событием play
+            return
+        elif active and zone == 'hand' and src == (player, 'deck'):
+            self.batch(['draw'], cid)
+            return
+        elif active and zone == 'discard' and self.in_end and src == (player, 'hand'):
+            # Сброс руки в конце хода описан событием end
+            return
+        elif active and zone == 'trash':
+            self.events.append(['trash', cid, card.trashed_by])
+            return
+        self.batch(['move', player, zone], cid)
+
+    def reshuffled(self, player, cards):
+        for card in cards:
+            self.where[self.card_id(card)] = (player, 'deck')
+        self.events.append(['shuffle', player])
+
+    def laid_out(self, card):
+        cid = self.card_id(card)
+        self.market.add(cid)
+        self.batch(['market'], cid)
+
+    # --- События партии ---
+    def turn(self, turn, player, blessing):
+        self.active = player
+        self.played = None
+        self.in_end = False
+        self.status()
+        self.events.append(['turn', turn, player, blessing])
+
+    def status(self):
+        for idx, player in enumerate(self.players):
+            status = self.status_of(player)
+            if status != self.statuses[idx]:
+                self.statuses[idx] = status
+                self.events.append(['status', idx] + status)
+
+    def play(self, card):
+        self.played = self.card_id(card)
+        self.step = 0
+        self.events.append(['play', self.played])
+
+    def effect(self, name, value):
+        # Шаги идут по порядку; пропущенные (draw, def_*_text) просто не попадают в событие
+        self.step = self.type_effects[self.cards[self.played]].index((name, value), self.step) + 1
+        if self.events[-1][0] in ('play', 'effect'):
+            self.events[-1].append(self.step - 1)
+        else:
+            self.events.append(['effect', self.step - 1])
+
+    def end(self, spent):
+        # Вызывается до player.end_turn(): сброс руки в конце хода покрывается событием end
+        self.status()
+        self.played = None
+        self.in_end = True
+        self.events.append(['end', spent])
+
+    def lost(self, player, reason):
+        self.in_end = False
+        self.status()
+        self.events.append(['lost', player, reason])
+
+    def finish(self, winner, turns):
+        return {
+            'version': REPLAY_VERSION,
+            'types': self.types,
+            'cards': self.cards,
+            'setup': self.setup,
+            'events': self.events,
+            'winner': winner,
+            'turns': turns,
+        }
+
+
+# --- Восстановление состояния ---
+SETTLE_EVENTS = ('turn', 'play', 'buy', 'end', 'lost')
+
+
+def replay_state(replay, turn=None, player=None):
+    # Состояние в конце хода turn (оба игрока сходили) или, если задан player, в начале хода
+    # этого игрока на ходу turn. turn=None — конец партии. Карты в зонах — в порядке id
+    setup = replay['setup']
+    types = replay['types']
+    cards = replay['cards']
+    where = {}
+    for idx, state in enumerate(setup['players']):
+        for key in ZONES:
+            for cid in state[key]:
+                where[cid] = (idx, key)
+    market = list(setup['market'])
+    statuses = [list(state['status']) for state in setup['players']]
+    current = None
+    active = None
+    played = None
+    for event in replay['events']:
+        kind = event[0]
+        if played is not None and kind in SETTLE_EVENTS:
+            # Эффекты разыгранной карты закончились: если её не затрешили, она в сбросе
+            if where.get(played) == (active, 'hand'):
+                where[played] = (active, 'discard')
+            played = None
+        if kind == 'turn':
+            t, p = event[1], event[2]
+            if turn is not None and (t > turn or (player is not None and t == turn and p >= player)):
+                if player is not None and t == turn and p == player:
+                    current = event
+                break
+            current = event
+            active = p
+        elif kind == 'status':
+            statuses[event[1]] = event[2:]
+        elif kind == 'draw':
+            for cid in event[1:]:
+                where[cid] = (active, 'hand')
+        elif kind == 'play':
+            if types[cards[event[1]]]['is_gear']:
+                where[event[1]] = (active, 'gear')
+            else:
+                played = event[1]
+        elif kind == 'buy':
+            if event[1] in market:
+                market.remove(event[1])
+            where[event[1]] = (active, 'discard')
+        elif kind == 'market':
+            market.extend(event[1:])
+        elif kind == 'trash':
+            where[event[1]] = (active, 'trash')
+        elif kind == 'move':
+            for cid in event[3:]:
+                if cid in market:
+                    market.remove(cid)
+                where[cid] = None if event[2] is None else (event[1], event[2])
+        elif kind == 'shuffle':
+            for cid, loc in where.items():
+                if loc == (event[1], 'discard'):
+                    where[cid] = (event[1], 'deck')
+        elif kind == 'end':
+            for cid, loc in where.items():
+                if loc == (active, 'hand'):
+                    where[cid] = (active, 'discard')
+    if played is not None and where.get(played) == (active, 'hand'):
+        where[played] = (active, 'discard')
+    players = []
+    for idx, state in enumerate(setup['players']):
+        hp, poison, bleed = statuses[idx]
+        players.append({'name': state['name'], 'hp': hp, 'poison': poison, 'bleed': bleed,
+                        **{key: [] for key in ZONES}})
+    for cid in sorted(where):
+        loc = where[cid]
+        if loc is not None:
+            players[loc[0]][loc[1]].append(types[cards[cid]]['name'])
+    return {
+        'turn': None if current is None else current[1],
+        'player': None if current is None else current[2],
+        'players': players,
+        'market': [types[cards[cid]]['name'] for cid in market],
+    }
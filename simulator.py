@@ -1,14 +1,76 @@
 import json
+import math
+import numpy as np
 import random
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, namedtuple, deque, OrderedDict
+from itertools import count, chain
+from bisect import bisect_left, bisect_right, insort
+from operator import attrgetter
 import re
 import sys
 import os
+import atexit
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from replay import ReplayRecorder
+from statistics import NormalDist
 
-# --- Глобальные переменные для Flask ---
+# --- Каталог по умолчанию (cards.json); каталог прогона — в RunState ---
 MAIN_CARDS = None
 STARTER_CARDS = None
 
+# --- Генератор случайных чисел движка ---
+# Вся случайность партии (тасовки, случайные покупки) идёт через RNG, а не через
+# глобальный random: партию воспроизводит seed, переданный в simulate_game.
+# У каждого потока свой генератор, чтобы параллельные запросы и фоновые задачи
+# не сбивали seed друг другу
+# Случайные индексы для колоды берутся пачками из генератора NumPy, засеянного от rng:
+# результат по-прежнему определяется только seed партии
+RNG_BATCH = 256
+
+class RandomStream:
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self._reset_batch()
+    def _reset_batch(self):
+        self.gen = np.random.default_rng(self.rng.getrandbits(64))
+        self.batch = []
+    def seed(self, a=None):
+        self.rng.seed(a)
+        self._reset_batch()
+    def refill(self):
+        # Следующая пачка равномерных чисел из [0, 1); берутся с конца списка
+        self.batch = self.gen.random(RNG_BATCH).tolist()
+        return self.batch
+    def index(self, n):
+        # Равновероятный индекс в [0, n)
+        batch = self.batch or self.refill()
+        return int(batch.pop() * n)
+    def shuffle(self, x):
+        self.rng.shuffle(x)
+    def choice(self, seq):
+        return self.rng.choice(seq)
+
+class ThreadRNG(RandomStream, threading.local):
+    pass
+
+RNG = ThreadRNG()
+
+# Режим общих случайных чисел (rng_streams в simulate_game): колода рынка, колода и случайные
+# покупки каждого игрока тянут числа из своих потоков, засеянных от seed партии. Тогда
+# решение одного игрока не сдвигает тасовки другого и рынка, и два варианта стратегии на
+# одном seed получают одинаковые колоды, пока их собственные решения не разошлись
+RNG_STREAMS = ('market', 'P1', 'P2', 'P1:buy', 'P2:buy')
+
+def game_streams(seed):
+    return {key: RandomStream(f"{seed}:{key}") for key in RNG_STREAMS}
+
+def game_seed(seed, index):
+    # seed партии с номером index в прогоне с master seed
+    return f"{seed}:{index}"
+
 # Включаем отладку приоритетов покупки
 DEBUG_BUY_STRATEGY = True
 
@@ -22,19 +84,87 @@ class AnsiColor:
     YELLOW = '\033[93m'
     RESET = '\033[0m'
 
-ACTIVE_LOG_OPTIONS = set()
+# --- Состояние прогона: каталог, опции лога и writer ---
+# Своё у каждого потока: prepare_run и log_run меняют только состояние своего потока,
+# поэтому запросы Flask и фоновые задачи идут параллельно, не подменяя каталог и лог
+# друг другу. Поток, где каталог не ставили, играет на каталоге по умолчанию
+class RunState(threading.local):
+    catalog = None
+    log_options = frozenset()
+    # "Тихий" режим: debug_log сразу выходит, ни одна строка лога не строится
+    silent = False
+    writer = None
+
+RUN = RunState()
+
+# --- Буферизованная запись в лог-файл: один writer на прогон ---
+class LogWriter:
+    def __init__(self, path, buffer_lines=1000):
+        self.path = path
+        self.buffer_lines = buffer_lines
+        self.lines = []
+    def write(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= self.buffer_lines:
+            self.flush()
+    def flush(self):
+        if not self.lines:
+            return
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(self.lines) + '\n')
+        except Exception as e:
+            pass
+        self.lines = []
+
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+def get_log_writer():
+    # writer прогона (log_run) или общий writer процесса для логов вне прогона
+    if RUN.writer is not None:
+        return RUN.writer
+    global _log_writer
+    with _log_writer_lock:
+        if _log_writer is None:
+            _log_writer = LogWriter(DEBUG_LOG_FILE)
+            atexit.register(_log_writer.flush)
+    return _log_writer
+
+def log_enabled(log_type=None):
+    # Проверка до форматирования: будет ли сообщение такого типа записано
+    if RUN.silent:
+        return False
+    return not log_type or log_type in RUN.log_options
+
+@contextmanager
+def log_run(path=None, silent=False):
+    # Прогон (серия партий) со своим буферизованным writer'ом; silent=True — без логов вообще
+    run = RUN
+    prev_writer, prev_silent = run.writer, run.silent
+    if prev_writer is not None:
+        prev_writer.flush()
+    writer = run.writer = LogWriter(path or DEBUG_LOG_FILE)
+    run.silent = silent or prev_silent
+    try:
+        yield writer
+    finally:
+        writer.flush()
+        run.writer, run.silent = prev_writer, prev_silent
 
-def debug_log(msg, log_type=None, color=None):
-    if log_type and log_type not in ACTIVE_LOG_OPTIONS:
+def debug_log(msg, *args, log_type=None, color=None):
+    # msg — строка, строка формата для args или callable, который строит строку лениво
+    run = RUN
+    if run.silent or (log_type and log_type not in run.log_options):
         return
+    if callable(msg):
+        msg = msg()
+    elif args:
+        msg = msg.format(*args)
     if color:
         msg = f"{color}{msg}{AnsiColor.RESET}"
     print(msg)
-    try:
-        with open(DEBUG_LOG_FILE, 'a', encoding='utf-8') as f:
-            f.write(str(msg)+'\n')
-    except Exception as e:
-        pass
+    get_log_writer().write(str(msg))
 
 try:
     # Если запускается как отдельный скрипт
@@ -48,7 +178,10 @@ except FileNotFoundError:
     pass
 
 # --- Классы ---
-class Card:
+# Неизменяемый тип карты: один объект на карту каталога, общий для всех её копий
+class CardType:
+    __slots__ = ('name', 'effect1', 'effect2', 'effect1text', 'effect2text', 'cost', 'color',
+                 'program', 'is_gear', 'defends', 'defense', 'hp')
     def __init__(self, name, effect1, effect2, cost, color, effect1text='', effect2text=''):
         self.name = name
         self.effect1 = effect1
@@ -57,69 +190,331 @@ class Card:
         self.color = color
         self.effect1text = effect1text
         self.effect2text = effect2text
+        # Gear и прочие свойства берём из скомпилированной программы эффектов
+        self.program = compile_effect_program(effect1, effect2, effect1text, effect2text)
+        self.defends = self.program.defends
+        self.defense = self.program.defense
+        self.hp = self.program.hp
+        self.is_gear = self.program.is_gear
+    def __repr__(self):
+        return f"{self.name} (Cost: {self.cost}, Color: {self.color}, Effects: {self.effect1} / {self.effect2})"
+
+def _type_attr(name):
+    # attrgetter работает как fget и быстрее lambda
+    return property(attrgetter('type.' + name))
+
+_card_uids = count()
+
+# Экземпляр карты в игре: только изменяемое состояние + ссылка на CardType.
+# uid — целочисленный id экземпляра, zone/pos — индекс расположения (в какой зоне и на какой позиции)
+class Card:
+    __slots__ = ('type', 'uid', 'zone', 'pos', 'absorbed_damage', 'uses', 'trashed_by')
+    name = _type_attr('name')
+    effect1 = _type_attr('effect1')
+    effect2 = _type_attr('effect2')
+    effect1text = _type_attr('effect1text')
+    effect2text = _type_attr('effect2text')
+    cost = _type_attr('cost')
+    color = _type_attr('color')
+    program = _type_attr('program')
+    is_gear = _type_attr('is_gear')
+    defends = _type_attr('defends')
+    defense = _type_attr('defense')
+    hp = _type_attr('hp')
+    def __init__(self, card_type):
+        self.type = card_type
+        self.uid = next(_card_uids)
+        self.zone = None
+        self.pos = 0
         self.absorbed_damage = 0
-        self.defends = False
-        self.defense = 0
-        self.hp = 0
-        self.is_gear = False
         self.uses = 0  # для трэша Priestess
-        # Gear определяется по эффектам (теперь ищем во всех effect-полях)
-        for eff in [effect1, effect2, effect1text, effect2text]:
-            if eff:
-                m = re.search(r'\{Def_Y_Text (\d+)\}', eff)
-                if m:
-                    self.defends = True
-                    self.defense = int(m.group(1))
-                    self.absorbed_damage = 0
-                    self.is_gear = True
-                m2 = re.search(r'\{Def_N_Text (\d+)\}', eff)
-                if m2:
-                    self.defends = False
-                    self.defense = int(m2.group(1))
-                    self.hp = int(m2.group(1))
-                    self.is_gear = True
+        self.trashed_by = None
     def __repr__(self):
-        return f"{self.name} (Cost: {self.cost}, Color: {self.color}, Effects: {self.effects})"
+        return repr(self.type)
+
+# --- Зона игрока (колода, рука, сброс, gear, трэш) ---
+# Массив карт с "дырками" вместо удалённых: порядок сохраняется, а проверка
+# принадлежности, удаление и перенос работают за O(1) через card.zone/card.pos.
+# listener — наблюдатель за переносами (replay.ZoneListener при записи реплея), обычно None
+class Zone:
+    __slots__ = ('name', 'cards', 'size', 'listener', 'rng')
+    def __init__(self, name, cards=()):
+        self.name = name
+        self.cards = []
+        self.size = 0
+        self.listener = None
+        self.rng = RNG
+        self.extend(cards)
+    def __len__(self):
+        return self.size
+    def __bool__(self):
+        return self.size > 0
+    def __contains__(self, card):
+        return getattr(card, 'zone', None) is self
+    def __iter__(self):
+        if self.size == len(self.cards):
+            return iter(self.cards)
+        return (c for c in self.cards if c is not None)
+    def __getitem__(self, idx):
+        self._compact()
+        return self.cards[idx]
+    def __add__(self, other):
+        return list(self) + list(other)
+    def __radd__(self, other):
+        return list(other) + list(self)
+    def __repr__(self):
+        return f"Zone({self.name}, {list(self)})"
+    def append(self, card):
+        # Перенос: карта уходит из своей текущей зоны
+        if card.zone is not None:
+            card.zone.remove(card)
+        card.zone = self
+        card.pos = len(self.cards)
+        self.cards.append(card)
+        self.size += 1
+        if self.listener is not None:
+            self.listener.moved(card)
+    def extend(self, cards):
+        for card in cards:
+            self.append(card)
+    def remove(self, card):
+        if card.zone is not self:
+            raise ValueError(f"{card!r} not in zone {self.name}")
+        self.cards[card.pos] = None
+        card.zone = None
+        self.size -= 1
+        if len(self.cards) > 2 * self.size + 8:
+            self._compact()
+    def destroy(self, card):
+        # Карта уходит из игры совсем (destroy)
+        self.remove(card)
+        if self.listener is not None:
+            self.listener.destroyed(card)
+    def pop(self):
+        # Верх колоды — конец массива
+        if not self.size:
+            raise IndexError(f"pop from empty zone {self.name}")
+        cards = self.cards
+        card = cards.pop()
+        while card is None:
+            card = cards.pop()
+        card.zone = None
+        self.size -= 1
+        return card
+    def take_all(self, other):
+        # Переносит все карты из other в конец этой зоны, сохраняя порядок
+        for card in list(other):
+            self.append(card)
+    def shuffle(self):
+        self._compact()
+        self.rng.shuffle(self.cards)
+        for i, card in enumerate(self.cards):
+            card.pos = i
+    def _compact(self):
+        if self.size != len(self.cards):
+            self.cards = [c for c in self.cards if c is not None]
+            for i, card in enumerate(self.cards):
+                card.pos = i
+
+# --- Колода с ленивым перемешиванием ---
+# cards — неупорядоченная часть колоды (всё, что перемешано), stack — карты с известным
+# порядком поверх неё (положенные сверху, например вернувшиеся после spy). pop берёт верх
+# stack, а если он пуст — равновероятную карту из cards (шаг Фишера-Йетса с обменом
+# на последнюю). Порядок перемешанной части никто не видит до добора, поэтому добор
+# распределён так же, как после полного shuffle, а само перемешивание не нужно
+class LazyDeck(Zone):
+    __slots__ = ('stack',)
+    def __init__(self, name, cards=()):
+        self.stack = []
+        super().__init__(name, cards)
+    def __iter__(self):
+        return chain(self.cards, self.stack)
+    def __getitem__(self, idx):
+        return list(self)[idx]
+    def append(self, card):
+        # Карта кладётся на верх колоды
+        if card.zone is not None:
+            card.zone.remove(card)
+        card.zone = self
+        card.pos = -1
+        self.stack.append(card)
+        self.size += 1
+        if self.listener is not None:
+            self.listener.moved(card)
+    def remove(self, card):
+        if card.zone is not self:
+            raise ValueError(f"{card!r} not in zone {self.name}")
+        if card.pos >= 0:
+            last = self.cards.pop()
+            if last is not card:
+                self.cards[card.pos] = last
+                last.pos = card.pos
+        else:
+            self.stack.remove(card)
+        card.zone = None
+        self.size -= 1
+    def pop(self):
+        if self.stack:
+            card = self.stack.pop()
+        elif self.cards:
+            cards = self.cards
+            rng = self.rng
+            batch = rng.batch or rng.refill()
+            i = int(batch.pop() * len(cards))
+            card = cards[i]
+            last = cards.pop()
+            if last is not card:
+                cards[i] = last
+                last.pos = i
+        else:
+            raise IndexError(f"pop from empty zone {self.name}")
+        card.zone = None
+        self.size -= 1
+        return card
+    def shuffle(self):
+        # Вся колода становится неупорядоченной: stack просто переходит в cards
+        for card in self.stack:
+            card.pos = len(self.cards)
+            self.cards.append(card)
+        self.stack = []
+    def reshuffle_from(self, other):
+        # take_all(other) + shuffle() одним проходом: карты сразу ложатся в неупорядоченную часть
+        if self.listener is not None:
+            self.listener.reshuffled(list(other))
+        self.shuffle()
+        cards = self.cards
+        for card in other:
+            card.zone = self
+            card.pos = len(cards)
+            cards.append(card)
+        self.size += other.size
+        other.cards = []
+        other.size = 0
+    def _compact(self):
+        pass
+
+# --- Таблица типов карт ---
+_CARD_TYPES = {}
+
+def card_type(card, cost=None):
+    # CardType для dict-описания карты; одинаковые описания дают один и тот же объект
+    if cost is None:
+        cost = card.get('cost', 0)
+    key = (card['name'], card.get('effect1') or '', card.get('effect2') or '', cost, card.get('color', ''),
+           card.get('effect1text') or '', card.get('effect2text') or '')
+    ctype = _CARD_TYPES.get(key)
+    if ctype is None:
+        ctype = CardType(key[0], key[1], key[2], cost, key[4], key[5], key[6])
+        _CARD_TYPES[key] = ctype
+    return ctype
+
+def catalog_hash(main_cards, starter_cards):
+    content = json.dumps([main_cards, starter_cards], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+# Стартовая колода: столько копий Prayer и Strike; поле deck_copies стартовой карты задаёт
+# другое число (синтетические каталоги catalog_gen.py), в таблицах его нет
+STARTING_DECK_COPIES = {'prayer': 7, 'strike': 3}
+
+class CardCatalog:
+    # Всё, что нужно для старта партии, собранное один раз на каталог
+    def __init__(self, main_cards, starter_cards, version=None):
+        self.main_cards = main_cards
+        self.starter_cards = starter_cards
+        self.market_deck = tuple(ctype for card in main_cards for ctype in [card_type(card)] * card['copies'])
+        starting_deck = []
+        self.priestess = None
+        for card in starter_cards:
+            key = card['name'].lower()
+            if key in STARTING_DECK_COPIES:
+                starting_deck += [card_type(card, cost=0)] * card.get('deck_copies', STARTING_DECK_COPIES[key])
+            elif card['name'].lower() == 'priestess' and self.priestess is None:
+                # Используем все эффекты из стартовой карты Priestess
+                self.priestess = card_type(card, cost=card.get('cost', 2))
+        self.starting_deck = tuple(starting_deck)
+        # Имена карт каталога (основные, затем стартовые) — индексы векторов статистики
+        self.card_names = tuple(dict.fromkeys(card['name'] for card in list(main_cards) + list(starter_cards)))
+        self.card_index = {name: i for i, name in enumerate(self.card_names)}
+        # Версия каталога — хэш содержимого карт (ключ кэша результатов)
+        self.version = version or catalog_hash(main_cards, starter_cards)
+
+_CATALOG = None
+
+def default_catalog():
+    # Каталог по умолчанию пересобирается, только если MAIN_CARDS/STARTER_CARDS заменили
+    global _CATALOG
+    catalog = _CATALOG
+    if catalog is None or catalog.main_cards is not MAIN_CARDS or catalog.starter_cards is not STARTER_CARDS:
+        catalog = _CATALOG = CardCatalog(MAIN_CARDS or [], STARTER_CARDS or [])
+    return catalog
+
+def get_catalog():
+    # Каталог прогона в текущем потоке (prepare_run, load_catalog, use_catalog)
+    catalog = RUN.catalog
+    return default_catalog() if catalog is None else catalog
+
+def use_catalog(catalog):
+    # Делает catalog каталогом потока без пересборки (каталог уже собран, например variant_catalog)
+    RUN.catalog = catalog
+
+# --- Варианты каталога для балансных прогонов ---
+# changes: {имя карты: {'cost': N, 'copies': N, 'effects': {'Damage': N}}}. Вариант берёт
+# dict и CardType неизменённых карт как есть; у изменённых карт эффекты компилируются через
+# кэш программ, так что разбирается только действительно новый текст. Версия варианта —
+# хэш версии базы и changes, без сериализации всего каталога
+_VARIANT_CATALOGS = {}
+
+def card_variant(card, change):
+    card = dict(card)
+    for key in ('cost', 'copies'):
+        if key in change:
+            card[key] = int(change[key])
+    for name, value in (change.get('effects') or {}).items():
+        pattern = re.compile(r'\{(' + re.escape(name) + r')\s+[\w-]+\}', re.IGNORECASE)
+        for field in EFFECT_FIELDS:
+            if card.get(field):
+                card[field] = pattern.sub(lambda m: f"{{{m.group(1)} {int(value)}}}", card[field])
+    return card
+
+def variant_catalog(base, changes):
+    content = json.dumps(changes, sort_keys=True, ensure_ascii=False, default=str)
+    version = hashlib.sha256(f"{base.version}:{content}".encode('utf-8')).hexdigest()
+    catalog = _VARIANT_CATALOGS.get(version)
+    if catalog is None:
+        unknown = set(changes) - set(card['name'] for card in base.main_cards)
+        if unknown:
+            raise ValueError(f"Нет в каталоге: {', '.join(sorted(unknown))}")
+        main_cards = [card_variant(card, changes[card['name']]) if card['name'] in changes else card
+                      for card in base.main_cards]
+        if len(_VARIANT_CATALOGS) >= 256:
+            _VARIANT_CATALOGS.clear()
+        catalog = _VARIANT_CATALOGS[version] = CardCatalog(main_cards, base.starter_cards, version=version)
+    return catalog
 
 # --- Генерация стартовой колоды ---
 def create_starting_deck():
-    deck = []
-    for card in STARTER_CARDS:
-        if card['name'].lower() == 'prayer':
-            deck += [Card(card['name'], card['effect1'], card['effect2'], 0, card['color'], card.get('effect1text',''), card.get('effect2text','')) for _ in range(7)]
-        elif card['name'].lower() == 'strike':
-            deck += [Card(card['name'], card['effect1'], card['effect2'], 0, card['color'], card.get('effect1text',''), card.get('effect2text','')) for _ in range(3)]
-    random.shuffle(deck)
-    return deck
+    # Перемешивать не нужно: колода игрока (LazyDeck) перемешивается лениво при доборе
+    return [Card(ctype) for ctype in get_catalog().starting_deck]
 
 # --- Priestess ---
 def get_priestess():
-    for card in STARTER_CARDS:
-        if card['name'].lower() == 'priestess':
-            # Используем все эффекты из стартовой карты Priestess
-            return Card(
-                card['name'],
-                card.get('effect1', ''),
-                card.get('effect2', ''),
-                card.get('cost', 2),
-                card.get('color', ''),
-                card.get('effect1text', ''),
-                card.get('effect2text', '')
-            )
-    return None
+    return get_catalog().priestess
 
 # --- Игрок ---
 class Player:
-    def __init__(self, name):
+    def __init__(self, name, rng=None, buy_rng=None):
         self.name = name
-        self.deck = create_starting_deck()
-        self.hand = []
-        self.discard = []
+        self.deck = LazyDeck('deck', create_starting_deck())
+        # Потоки случайности: добор из колоды и случайные покупки (по умолчанию — общий RNG)
+        self.deck.rng = rng or RNG
+        self.buy_rng = buy_rng or RNG
+        self.hand = Zone('hand')
+        self.discard = Zone('discard')
         self.health = 50
         self.poison = 0
         self.bleed = 0
-        self.gear = []
-        self.trash_pile = []
+        self.gear = Zone('gear')
+        self.trash_pile = Zone('trash_pile')
         self.gear_saved_damage = 0
         self.spy_discarded = 0
         self.gear_destroyed = 0
@@ -132,22 +527,30 @@ class Player:
         self.total_heal_received = 0
         self.total_poison_heal_received = 0
         self.total_bleed_heal_received = 0
-        random.shuffle(self.deck)
+        self.deck.shuffle()
         self.draw(5)
     def draw(self, n):
+        # Возвращает добранные карты
+        drawn = []
         for _ in range(n):
             if not self.deck:
-                self.deck = self.discard
-                self.discard = []
-                random.shuffle(self.deck)
+                self.deck.reshuffle_from(self.discard)
             if self.deck:
-                self.hand.append(self.deck.pop())
+                card = self.deck.pop()
+                self.hand.append(card)
+                drawn.append(card)
             else:
                 break
+        return drawn
+    def trash(self, card, reason):
+        # Перенос карты игрока в трэш из любой его зоны; False, если карты у игрока нет
+        if card.zone not in (self.hand, self.discard, self.deck, self.gear):
+            return False
+        card.trashed_by = reason
+        self.trash_pile.append(card)
+        return True
     def end_turn(self):
-        for card in self.hand:
-            self.discard.append(card)
-        self.hand = []
+        self.discard.take_all(self.hand)
         self.draw(5)
         # --- После конца хода: gear absorbed_damage статистика и сброс ---
         for gear in self.gear:
@@ -165,14 +568,13 @@ class Player:
         dmg = safe_int(dmg)
         # 1. Gear с защитой игрока (defends=True)
         for gear in list(self.gear):
-            if getattr(gear, 'defends', False) and gear.defense > 0:
+            if gear.defends and gear.defense > 0:
                 absorb = min(dmg, gear.defense - gear.absorbed_damage)
                 gear.absorbed_damage += absorb
                 self.gear_saved_damage += absorb
                 dmg -= absorb
                 # --- Новая логика: если gear полностью поглотил урона defense за этот ход, gear уходит в discard ---
                 if gear.absorbed_damage >= gear.defense:
-                    self.gear.remove(gear)
                     self.discard.append(gear)  # gear идёт в discard
                 if dmg <= 0:
                     return
@@ -186,21 +588,111 @@ class Player:
         self.poison = max(0, self.poison - amount)
 
 # --- Рынок ---
+# Индекс ряда рынка для одной стратегии: карты, которые она покупает, лежат по корзинам
+# стоимости, в корзине — по (ранг, uid). uid растёт в порядке выкладки, а ряд этот порядок
+# сохраняет (купленная карта уходит, новая встаёт в конец), поэтому при равном ранге
+# выигрывает левая карта — как при линейном проходе по ряду
+class RowIndex:
+    __slots__ = ('rank', 'buckets', 'costs')
+    def __init__(self, rank, cards):
+        self.rank = rank
+        self.buckets = {}
+        self.costs = []
+        for card in cards:
+            self.add(card)
+    def add(self, card):
+        rank = self.rank(card.type)
+        if rank is None:
+            return
+        bucket = self.buckets.get(card.cost)
+        if bucket is None:
+            bucket = self.buckets[card.cost] = []
+            insort(self.costs, card.cost)
+        insort(bucket, (rank, card.uid, card))
+    def remove(self, card):
+        rank = self.rank(card.type)
+        bucket = self.buckets.get(card.cost)
+        if rank is None or not bucket:
+            return
+        i = bisect_left(bucket, (rank, card.uid))
+        if i < len(bucket) and bucket[i][2] is card:
+            del bucket[i]
+            if not bucket:
+                del self.buckets[card.cost]
+                self.costs.remove(card.cost)
+    def best(self, budget):
+        # Лучшая карта со стоимостью <= budget: минимум голов корзин с подходящей стоимостью
+        best = None
+        for cost in self.costs[:bisect_right(self.costs, budget)]:
+            head = self.buckets[cost][0]
+            if best is None or head[:2] < best[:2]:
+                best = head
+        return None if best is None else best[2]
+
+# Ранги встроенных паттернов: цветные берут первую карту своего цвета, иначе — первую доступную
+def _any_rank(ctype):
+    return 0
+
+def _color_rank(color):
+    return lambda ctype: 0 if ctype.color == color else None
+
+PATTERN_RANKS = {color: _color_rank(color) for color in ('red', 'blue', 'green', 'white')}
+PATTERN_RANKS['any'] = _any_rank
+
+_uid = attrgetter('uid')
+
+# На коротком ряду линейный проход дешевле поддержки индексов. Замер `benchmark.py row-index`
+# (партии red vs poison на синтетическом каталоге из 2560 карт): до ~24 карт индекс медленнее,
+# на 24-40 — в пределах шума, с 48 стабильно быстрее (x1.1-1.2, на 256 картах — x1.9)
+ROW_INDEX_MIN_SIZE = 48
+
 class TradeMarket:
-    def __init__(self, all_cards, trade_row_size=5):
-        self.trade_deck = []
-        for card in all_cards:
-            self.trade_deck += [Card(card['name'], card['effect1'], card['effect2'], card['cost'], card['color'], card.get('effect1text',''), card.get('effect2text','')) for _ in range(card['copies'])]
-        random.shuffle(self.trade_deck)
+    def __init__(self, all_cards, trade_row_size=5, rng=None):
+        # В колоде рынка лежат типы карт: экземпляр создаётся, только когда карта выходит в ряд
+        catalog = get_catalog()
+        if all_cards is catalog.main_cards:
+            self.trade_deck = list(catalog.market_deck)
+        else:
+            self.trade_deck = list(CardCatalog(all_cards, []).market_deck)
+        (rng or RNG).shuffle(self.trade_deck)
         self.trade_row_size = trade_row_size
         self.trade_row = []
+        self.listener = None
+        # RowIndex по ключу стратегии (зона пользовательской стратегии или имя паттерна);
+        # создаются при первом запросе и дальше обновляются на каждой покупке и выкладке
+        self.indexes = {}
         self.refill_trade_row()
     def refill_trade_row(self):
         while len(self.trade_row) < self.trade_row_size and self.trade_deck:
-            self.trade_row.append(self.trade_deck.pop())
+            card = Card(self.trade_deck.pop())
+            self.trade_row.append(card)
+            if self.listener is not None:
+                self.listener.laid_out(card)
+            for index in self.indexes.values():
+                index.add(card)
+    def best_card(self, key, rank, budget):
+        # Индекс в trade_row лучшей карты по рангу rank со стоимостью <= budget, либо None
+        if self.trade_row_size < ROW_INDEX_MIN_SIZE:
+            best = best_rank = None
+            for i, card in enumerate(self.trade_row):
+                if card.cost <= budget:
+                    r = rank(card.type)
+                    if r is not None and (best is None or r < best_rank):
+                        best, best_rank = i, r
+            return best
+        index = self.indexes.get(key)
+        if index is None:
+            index = self.indexes[key] = RowIndex(rank, self.trade_row)
+        card = index.best(budget)
+        if card is None:
+            return None
+        # Ряд упорядочен по uid (см. RowIndex), поэтому позиция карты — бинарный поиск
+        return bisect_left(self.trade_row, card.uid, key=_uid)
     def buy_card(self, card_index, player):
         if 0 <= card_index < len(self.trade_row):
             card = self.trade_row.pop(card_index)
+            for index in self.indexes.values():
+                index.remove(card)
             player.discard.append(card)
             self.refill_trade_row()  # ГАРАНТИРОВАННО пополняем рынок после покупки
             return card
@@ -210,140 +702,206 @@ class TradeMarket:
         return dict(Counter([c.name for c in self.trade_deck]))
 
 # --- Стратегии ---
-def buy_strategy(player, market, total_blessing, spent_blessing, pattern="default", user_strategy=None, turn_num=1, log_if=None):
-    get_card_priority_func = globals().get('get_card_priority_func', None)
-    if user_strategy and get_card_priority_func:
-        priority_func, is_enabled = get_card_priority_func(user_strategy)
-        max_cost = user_strategy.get('max_cost', 20)
-        # --- Новый блок: разделяем effect_priority_zone по 'priestess' ---
-        effect_priority = user_strategy.get('effect_priority', [])
-        if isinstance(effect_priority, dict):
-            zone_key = str(turn_num if turn_num <= 4 else 2 if turn_num <= 8 else 3)
-            effect_priority_zone = effect_priority.get(zone_key, [])
-            log_if('card_filter', f"[DEBUG-PRIO] zone_key: {zone_key}, effect_priority dict keys: {list(effect_priority.keys())}")
-        else:
-            effect_priority_zone = effect_priority
-        log_if('card_filter', f"[DEBUG-PRIO] effect_priority_zone: {effect_priority_zone}")
-        effect_priority_zone_lc = [e.lower() for e in effect_priority_zone]
-        if 'priestess' in effect_priority_zone_lc:
-            idx_priestess = effect_priority_zone_lc.index('priestess')
-            effect_priority_main = [e for e in effect_priority_zone[:idx_priestess]]
-            has_priestess = True
-        else:
-            effect_priority_main = effect_priority_zone
-            has_priestess = False
-        log_if('card_filter', f"[DEBUG-PRIO] effect_priority_main: {effect_priority_main}")
-        # --- Вспомогательная функция для разворачивания вложенных эффектов ---
-        def flatten_effects(effects):
-            flat = []
-            for eff in effects:
-                if isinstance(eff, list):
-                    flat.extend(flatten_effects(eff))
-                elif isinstance(eff, tuple) and len(eff) > 0:
-                    flat.append(eff[0])
-                elif isinstance(eff, str):
-                    flat.append(eff)
-            return flat
-        # --- Фильтруем карты только по эффектам до priestess ---
-        def card_has_priority_effect(card):
-            effects = []
-            for field in ['effect1', 'effect2', 'effect1text', 'effect2text']:
-                val = getattr(card, field, None)
-                if val:
-                    effects += parse_effects_from_string(val)
-            prio_effects = [e.strip().lower() for e in effect_priority_main]
-            # --- Спец. обработка gear ---
-            if 'gear' in prio_effects and getattr(card, 'is_gear', False):
-                log_if('card_filter', f"[DEBUG-CHECK] {card.name}: is_gear=True, ищем в={prio_effects}, результат=True")
-                return True
-            effect_names = [e.strip().lower() for e in flatten_effects(effects)]
-            result = any(eff in prio_effects for eff in effect_names)
-            log_if('card_filter', f"[DEBUG-CHECK] {card.name}: эффекты={effect_names}, ищем в={prio_effects}, результат={result}")
-            for eff in effects:
-                log_if('card_filter', f"[DEBUG-CHECK-RAW] {card.name}: raw_eff={eff}")
-            return result
-        # --- DEBUG: Выводим все карты рынка с индексом, эффектами и результатом фильтрации ---
-        for idx, card in enumerate(market.trade_row):
-            effects = []
-            for field in ['effect1', 'effect2', 'effect1text', 'effect2text']:
-                val = getattr(card, field, None)
-                if val:
-                    effects += parse_effects_from_string(val)
-            # Преобразуем эффекты в строки (только имена)
-            effect_names = []
-            for eff in effects:
-                if isinstance(eff, (list, tuple)) and len(eff) > 0:
-                    eff_name = eff[0]
-                else:
-                    eff_name = eff
-                if isinstance(eff_name, str):
-                    effect_names.append(eff_name.strip().lower())
-            prio_effects = [e.strip().lower() for e in effect_priority_main]
-            # Проверяем, есть ли совпадение
-            has_prio = any(eff in prio_effects for eff in effect_names)
-            log_if('card_filter', f"[DEBUG] [{idx}] {card.name}: эффекты={effect_names}, ищем в={prio_effects}, подходит={has_prio}")
-        # --- Конец подробного лога ---
-        filtered = [(i, c) for i, c in enumerate(market.trade_row) if c.cost <= (total_blessing - spent_blessing) and c.cost <= max_cost and getattr(c, 'name', None) and is_enabled(c) and card_has_priority_effect(c)]
-        # --- DEBUG: Выводим все доступные для покупки карты ---
-        if log_if:
-            log_if('card_filter', f"[DEBUG] filtered (после фильтрации): {[c.name for i, c in filtered]}")
-            log_if('card_filter', f"[DEBUG] effect_priority_zone: {user_strategy.get('effect_priority', [])}")
+# Пользовательская стратегия компилируется один раз: приоритеты карт, фильтры покупки
+# и по каждой зоне effect_priority — таблица рангов по типу карты (CardType). Покупка
+# сводится к просмотру таблицы и проверке, хватает ли blessing.
+# Скомпилированные стратегии кэшируются по каноническому хэшу содержимого (и по объекту,
+# чтобы не хэшировать JSON на каждой покупке)
+_COMPILED_STRATEGIES = {}
+_STRATEGY_BY_ID = {}
+
+def strategy_hash(user_strategy):
+    content = json.dumps(user_strategy, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def buy_zone_key(turn_num):
+    # Ходы 1-4 ищут зоны '1'..'4', 5-8 — '2', дальше — '3' (так исторически считает buy_strategy)
+    return str(turn_num if turn_num <= 4 else 2 if turn_num <= 8 else 3)
+
+def play_zone_key(turn_num):
+    # Выбор OR-альтернатив при розыгрыше: ходы 1-4 — '1', 5-8 — '2', дальше — '3'
+    return '1' if turn_num <= 4 else '2' if turn_num <= 8 else '3'
+
+class StrategyZone:
+    # Часть effect_priority одной зоны: эффекты до 'priestess' фильтруют и ранжируют покупки
+    def __init__(self, strategy, key, effects):
+        self.strategy = strategy
+        self.key = key
+        self.effects = effects
+        lowered = [e.lower() for e in effects]
+        self.has_priestess = 'priestess' in lowered
+        self.main = effects[:lowered.index('priestess')] if self.has_priestess else effects
+        self.prio_effects = [e.strip().lower() for e in self.main]
+        self.prio_set = frozenset(self.prio_effects)
+        # Индекс считается по списку вариантов написания [e, e.lower(), e.upper(), e.capitalize()]
+        self.effect_rank = {}
+        for idx, variant in enumerate(v for e in self.main for v in (e, e.lower(), e.upper(), e.capitalize())):
+            self.effect_rank.setdefault(variant, idx)
+        self.ranks = {}
+
+    def matches(self, ctype):
+        if 'gear' in self.prio_set and ctype.is_gear:
+            return True
+        return any(eff in self.prio_set for eff in ctype.program.effect_names)
+
+    def rank(self, ctype):
+        # Ранг покупки типа карты (меньше — раньше) или None, если стратегия его не покупает.
+        # Зависит только от типа карты, поэтому считается один раз
+        if ctype in self.ranks:
+            return self.ranks[ctype]
+        rank = None
+        if (ctype.name and ctype.cost <= self.strategy.max_cost
+                and self.strategy.is_enabled_name(ctype.name) and self.matches(ctype)):
+            rank = min((self.effect_rank.get(name, 1000) for name in ctype.program.top_names), default=1000)
+        self.ranks[ctype] = rank
+        return rank
+
+class CompiledStrategy:
+    def __init__(self, user_strategy, key):
+        self.key = key
+        # Приоритеты карт: {card_name: (priority, enabled)}
+        self.card_priority = {}
+        for color, arr in user_strategy.get('cards', {}).items():
+            for idx, obj in enumerate(arr):
+                self.card_priority[obj['name'].strip().lower()] = (idx, obj.get('enabled', True))
+        self.max_cost = user_strategy.get('max_cost', 20)
+        self.priestess_buy_if_2 = user_strategy.get('priestess_buy_if_2')
+        self.effect_priority = user_strategy.get('effect_priority', [])
+        self.zones = {}
+        self.play_ranks = {}
+
+    def is_enabled_name(self, name):
+        return self.card_priority.get(name.strip().lower(), (None, True))[1]
+
+    def is_enabled(self, card):
+        name = card.name if hasattr(card, 'name') else card['name']
+        return self.is_enabled_name(name)
+
+    def priority(self, card):
+        name = card.name.strip().lower() if hasattr(card, 'name') else card['name'].strip().lower()
+        if name in self.card_priority:
+            prio, enabled = self.card_priority[name]
+            return (0 if enabled else 10000, prio)
+        return (10000, 9999)
+
+    def zone_effects(self, key):
+        if isinstance(self.effect_priority, dict):
+            return self.effect_priority.get(key, [])
+        return self.effect_priority
+
+    def buy_zone(self, turn_num):
+        key = buy_zone_key(turn_num)
+        zone = self.zones.get(key)
+        if zone is None:
+            zone = self.zones[key] = StrategyZone(self, key, list(self.zone_effects(key)))
+        return zone
+
+    def play_rank(self, turn_num):
+        # {эффект: индекс в effect_priority зоны} для выбора OR-альтернатив
+        key = play_zone_key(turn_num)
+        rank = self.play_ranks.get(key)
+        if rank is None:
+            rank = {}
+            for idx, e in enumerate(self.zone_effects(key)):
+                rank.setdefault(e.lower(), idx)
+            self.play_ranks[key] = rank
+        return rank
+
+    def choose_buy(self, market, budget, turn_num, log_if=None):
+        # -> индекс карты в market.trade_row, 'priestess' или None
+        zone = self.buy_zone(turn_num)
+        trade_row = market.trade_row
+        if log_if is not None and log_enabled('card_filter'):
+            self.log_zone(zone, trade_row, budget, log_if)
+        if not self.priestess_buy_if_2:
+            i = market.best_card(zone, zone.rank, budget)
+            if i is not None:
+                return i
+            return 'priestess' if self.priestess_fallback(zone, budget) else None
+        # priestess_buy_if_2 смотрит на весь отфильтрованный ряд — линейный проход
+        filtered = []
+        for i, c in enumerate(trade_row):
+            if c.cost <= budget:
+                rank = zone.rank(c.type)
+                if rank is not None:
+                    filtered.append((rank, i, c))
         if not filtered:
-            # Если нет подходящих карт, и есть 'priestess' в приоритете — покупаем Priestess, если хватает денег
-            if has_priestess:
-                priestess = get_priestess()
-                if priestess and priestess.cost <= (total_blessing - spent_blessing):
-                    return 'priestess'
-            return None
-        # --- Сортируем по индексу эффекта (чем меньше, тем выше приоритет) ---
-        def effect_score(card):
-            effects = []
-            for field in ['effect1', 'effect2', 'effect1text', 'effect2text']:
-                val = getattr(card, field, None)
-                if val:
-                    effects += parse_effects_from_string(val)
-            def all_case_variants(e):
-                return [e, e.lower(), e.upper(), e.capitalize()]
-            effect_priority_variants = []
-            for e in effect_priority_main:
-                effect_priority_variants.extend(all_case_variants(e))
-            min_idx = 1000
-            min_eff = None
-            for eff in effects:
-                if not eff:
-                    continue
-                if isinstance(eff, (list, tuple)) and len(eff) > 0:
-                    eff_name = eff[0]
-                else:
-                    eff_name = eff
-                for idx, prio in enumerate(effect_priority_variants):
-                    if eff_name == prio:
-                        if idx < min_idx:
-                            min_idx = idx
-                            min_eff = eff_name
-                        break
-            return min_idx
-        filtered.sort(key=lambda x: effect_score(x[1]))
-        priestess_buy_if_2 = user_strategy.get('priestess_buy_if_2')
-        if priestess_buy_if_2:
-            for i, c in filtered:
+            return 'priestess' if self.priestess_fallback(zone, budget) else None
+        filtered.sort(key=lambda x: x[0])
+        if all(c.cost > 2 or c.name.lower() == 'priestess' for rank, i, c in filtered):
+            for rank, i, c in filtered:
                 if c.name.lower() == 'priestess' and c.cost == 2:
-                    if all(x[1].cost > 2 or x[1].name.lower() == 'priestess' for x in filtered):
-                        return i
-        return filtered[0][0]
-    affordable = [(i, c) for i, c in enumerate(market.trade_row) if c.cost <= (total_blessing - spent_blessing)]
-    if pattern in ["red", "blue", "green", "white"]:
-        for i, card in affordable:
-            if card.color == pattern:
-                return i
-    if pattern == "poison":
-        for i, card in affordable:
-            if card.color == "green":
-                return i
-        return affordable[0][0] if affordable else None
+                    return i
+        return filtered[0][1]
+
+    def priestess_fallback(self, zone, budget):
+        # Нет подходящих карт, но 'priestess' есть в приоритете — покупаем Priestess, если хватает денег
+        if zone.has_priestess:
+            priestess = get_priestess()
+            return bool(priestess and priestess.cost <= budget)
+        return False
+
+    def log_zone(self, zone, trade_row, budget, log_if):
+        if isinstance(self.effect_priority, dict):
+            log_if('card_filter', lambda: f"[DEBUG-PRIO] zone_key: {zone.key}, effect_priority dict keys: {list(self.effect_priority.keys())}")
+        log_if('card_filter', lambda: f"[DEBUG-PRIO] effect_priority_zone: {zone.effects}")
+        log_if('card_filter', lambda: f"[DEBUG-PRIO] effect_priority_main: {zone.main}")
+        for idx, card in enumerate(trade_row):
+            effect_names = card.program.effect_names
+            has_prio = any(eff in zone.prio_set for eff in effect_names)
+            log_if('card_filter', lambda: f"[DEBUG] [{idx}] {card.name}: эффекты={list(effect_names)}, ищем в={zone.prio_effects}, подходит={has_prio}")
+        for card in trade_row:
+            if card.cost <= budget and card.cost <= self.max_cost and card.name and self.is_enabled(card):
+                for fld in card.program.fields:
+                    for eff in fld.parsed:
+                        log_if('card_filter', lambda: f"[DEBUG-CHECK-RAW] {card.name}: raw_eff={eff}")
+        filtered = [c.name for c in trade_row if c.cost <= budget and zone.rank(c.type) is not None]
+        log_if('card_filter', lambda: f"[DEBUG] filtered (после фильтрации): {filtered}")
+        log_if('card_filter', lambda: f"[DEBUG] effect_priority_zone: {self.effect_priority}")
+
+def compile_strategy(user_strategy):
+    if not user_strategy:
+        return None
+    cached = _STRATEGY_BY_ID.get(id(user_strategy))
+    if cached is not None and cached[0] is user_strategy:
+        return cached[1]
+    key = strategy_hash(user_strategy)
+    compiled = _COMPILED_STRATEGIES.get(key)
+    if compiled is None:
+        if len(_COMPILED_STRATEGIES) >= 64:
+            _COMPILED_STRATEGIES.clear()
+        compiled = _COMPILED_STRATEGIES[key] = CompiledStrategy(user_strategy, key)
+    if len(_STRATEGY_BY_ID) >= 64:
+        _STRATEGY_BY_ID.clear()
+    _STRATEGY_BY_ID[id(user_strategy)] = (user_strategy, compiled)
+    return compiled
+
+def get_card_priority_func(user_strategy):
+    compiled = compile_strategy(user_strategy)
+    if compiled is None:
+        return None
+    return compiled.priority, compiled.is_enabled
+
+def buy_strategy(player, market, total_blessing, spent_blessing, pattern="default", user_strategy=None, turn_num=1, log_if=None):
+    budget = total_blessing - spent_blessing
+    if user_strategy:
+        return compile_strategy(user_strategy).choose_buy(market, budget, turn_num, log_if)
+    if not isinstance(pattern, str):
+        # Объект-бот (mcts.MCTSBot и подобные) решает покупку сам
+        return pattern.choose_buy(player, market, total_blessing, spent_blessing, turn_num)
+    if pattern == "mcts":
+        import mcts
+        return mcts.player_bot(player).choose_buy(player, market, total_blessing, spent_blessing, turn_num)
     if pattern == "random":
-        return random.choice(affordable)[0] if affordable else None
-    return affordable[0][0] if affordable else None
+        affordable = [(i, c) for i, c in enumerate(market.trade_row) if c.cost <= budget]
+        return player.buy_rng.choice(affordable)[0] if affordable else None
+    # Цветные паттерны и poison (= green) сначала ищут свой цвет, остальные — первую доступную карту
+    color = 'green' if pattern == 'poison' else pattern
+    if color in PATTERN_RANKS:
+        i = market.best_card(color, PATTERN_RANKS[color], budget)
+        if i is not None:
+            return i
+    return market.best_card('any', _any_rank, budget)
 
 # --- Вспомогательная функция для парсинга эффектов из строки ---
 def parse_effects_from_string(s):
@@ -369,6 +927,109 @@ def parse_effects_from_string(s):
         result.append((name, value))
     return result
 
+# --- Скомпилированные программы эффектов ---
+# Текст эффектов карты разбирается один раз (при загрузке каталога) и кэшируется
+# по содержимому полей effect1/effect2/effect1text/effect2text. Движок, buy_strategy
+# и interactive_game работают только с программой и больше не вызывают парсер.
+EFFECT_FIELDS = ('effect1', 'effect2', 'effect1text', 'effect2text')
+CHAIN_COLORS = {'w_chain': 'white', 'b_chain': 'blue', 'r_chain': 'red', 'g_chain': 'green'}
+
+# opcode — имя эффекта ('nop' для составной части, которую движок пропускает),
+# value — значение, уже приведённое к int, raw — исходное значение (для логов),
+# chain — цвет для *_chain эффектов
+EffectOp = namedtuple('EffectOp', ['opcode', 'value', 'raw', 'chain'])
+# kind: 'plain' — список эффектов, 'seq' — две части (TO) применяются по порядку,
+# 'or' — выбор альтернативы по приоритету. ops — шаги в том виде, в каком их
+# исполняет simulate_game, branches — части составного эффекта
+EffectField = namedtuple('EffectField', ['text', 'kind', 'ops', 'branches', 'parsed'])
+EffectProgram = namedtuple('EffectProgram', [
+    'fields',          # EffectField для каждого из EFFECT_FIELDS
+    'blessing',        # сумма {Blessing N} по всем полям
+    'is_gear', 'defends', 'defense', 'hp',
+    'effect_names',    # все имена эффектов (включая вложенные), в нижнем регистре
+    'top_names',       # имена эффектов верхнего уровня (для effect_score)
+    'has_trash_this',  # в тексте есть {Trash_this
+])
+
+_EFFECT_PROGRAMS = {}
+
+def _compile_op(eff):
+    name, raw = eff
+    return EffectOp(name, safe_int(raw), raw, CHAIN_COLORS.get(name))
+
+def _compile_field(text):
+    parsed = parse_effects_from_string(text)
+    if parsed and isinstance(parsed[0], list):
+        # OR/TO: в simulate_game часть из двух элементов распаковывается как (name, value)
+        # и ничего не делает — сохраняем такой шаг как 'nop', чтобы не менять поведение
+        ops = tuple(EffectOp('nop', 0, part, None) for part in parsed if len(part) == 2)
+        branches = tuple(tuple(_compile_op(e) for e in part if isinstance(e, tuple)) for part in parsed)
+        kind = 'seq' if len(parsed) == 2 else 'or'
+        return EffectField(text, kind, ops, branches, parsed)
+    return EffectField(text, 'plain', tuple(_compile_op(e) for e in parsed), (), parsed)
+
+def _flatten_names(effects):
+    flat = []
+    for eff in effects:
+        if isinstance(eff, list):
+            flat.extend(_flatten_names(eff))
+        elif isinstance(eff, tuple) and len(eff) > 0:
+            flat.append(eff[0])
+    return flat
+
+def compile_effect_program(effect1='', effect2='', effect1text='', effect2text=''):
+    key = (effect1 or '', effect2 or '', effect1text or '', effect2text or '')
+    program = _EFFECT_PROGRAMS.get(key)
+    if program is not None:
+        return program
+    fields = tuple(_compile_field(text) for text in key)
+    blessing = 0
+    effect_names = []
+    top_names = []
+    for fld in fields:
+        for eff in fld.parsed:
+            if isinstance(eff, tuple):
+                top_names.append(eff[0])
+                if eff[0] == 'blessing':
+                    blessing += safe_int(eff[1])
+        effect_names.extend(_flatten_names(fld.parsed))
+    # Gear определяется по эффектам (ищем во всех effect-полях)
+    is_gear = defends = False
+    defense = hp = 0
+    for text in key:
+        if text:
+            m = re.search(r'\{Def_Y_Text (\d+)\}', text)
+            if m:
+                defends = True
+                defense = int(m.group(1))
+                is_gear = True
+            m2 = re.search(r'\{Def_N_Text (\d+)\}', text)
+            if m2:
+                defends = False
+                defense = int(m2.group(1))
+                hp = int(m2.group(1))
+                is_gear = True
+    has_trash_this = any('{trash_this' in text.lower() for text in key if text)
+    program = EffectProgram(fields, blessing, is_gear, defends, defense, hp,
+                            tuple(effect_names), tuple(top_names), has_trash_this)
+    _EFFECT_PROGRAMS[key] = program
+    return program
+
+def card_program(card):
+    # Программа для dict-описания карты из каталога
+    return compile_effect_program(*(card.get(field, '') for field in EFFECT_FIELDS))
+
+def compile_catalog(main_cards, starter_cards):
+    for card in list(main_cards or []) + list(starter_cards or []):
+        card_program(card)
+
+def load_catalog(main_cards, starter_cards):
+    # Устанавливает каталог текущего потока и сразу компилирует эффекты всех карт
+    compile_catalog(main_cards, starter_cards)
+    catalog = RUN.catalog
+    if catalog is None or catalog.main_cards is not main_cards or catalog.starter_cards is not starter_cards:
+        RUN.catalog = CardCatalog(main_cards or [], starter_cards or [])
+
 # --- Вспомогательная функция для безопасного преобразования value к int ---
 def safe_int(val):
     try:
@@ -380,144 +1041,41 @@ def safe_int(val):
 def apply_card_effects(card, player, opponent, log, trash_list):
     # --- Получаем effect_priority для зоны ---
     strat = getattr(player, 'user_strategy', None)
-    turn_num = getattr(player, 'current_turn', 1)
-    if strat:
-        if turn_num <= 4:
-            zone = 1
-        elif turn_num <= 8:
-            zone = 2
-        else:
-            zone = 3
-        effect_priority = strat.get('effect_priority', [])
-        if isinstance(effect_priority, dict):
-            effect_priority_zone = effect_priority.get(str(zone), [])
-        else:
-            effect_priority_zone = effect_priority
-        effect_priority_zone = [e.lower() for e in effect_priority_zone]
-    else:
-        effect_priority_zone = []
-    # --- Применяем ВСЕ эффекты из всех effect-полей ---
-    for field in ['effect1', 'effect2', 'effect1text', 'effect2text']:
-        val = getattr(card, field, None)
-        if val:
-            effs = parse_effects_from_string(val)
-            # TO-структура: применить обе части по порядку
-            if effs and isinstance(effs, list) and len(effs) == 2 and all(isinstance(e, list) for e in effs):
-                # TO: сначала первая часть, потом вторая
-                for eff in effs[0]:
-                    if not isinstance(eff, (list, tuple)) or len(eff) != 2:
-                        continue
-                    name, value = eff
-                    if name == 'to':
-                        continue
-                    # --- Немедленный трэш для trash_this ---
-                    if name == 'trash_this':
-                        for zone in [player.hand, getattr(player, 'played_this_turn', []), player.discard, player.deck, player.gear]:
-                            if card in zone:
-                                zone.remove(card)
-                                card.trashed_by = 'trash_this'
-                                player.trash_pile.append(card)
-                                break
-                        continue
-                    if name in ['w_chain', 'b_chain', 'r_chain', 'g_chain']:
-                        color = name[0]
-                        color_map = {'w': 'white', 'b': 'blue', 'r': 'red', 'g': 'green'}
-                        color_name = color_map.get(color, None)
-                        if color_name:
-                            count = sum(1 for c in player.hand+getattr(player, 'played_this_turn', []) if getattr(c, 'color', '').lower() == color_name)
-                            if count < 2:
-                                continue
-                    apply_effect(name, value, card, player, opponent, log, trash_list)
-                for eff in effs[1]:
-                    if not isinstance(eff, (list, tuple)) or len(eff) != 2:
-                        continue
-                    name, value = eff
-                    if name == 'to':
-                        continue
-                    # --- Немедленный трэш для trash_this ---
-                    if name == 'trash_this':
-                        for zone in [player.hand, getattr(player, 'played_this_turn', []), player.discard, player.deck, player.gear]:
-                            if card in zone:
-                                zone.remove(card)
-                                card.trashed_by = 'trash_this'
-                                player.trash_pile.append(card)
-                                break
-                        continue
-                    if name in ['w_chain', 'b_chain', 'r_chain', 'g_chain']:
-                        color = name[0]
-                        color_map = {'w': 'white', 'b': 'blue', 'r': 'red', 'g': 'green'}
-                        color_name = color_map.get(color, None)
-                        if color_name:
-                            count = sum(1 for c in player.hand+getattr(player, 'played_this_turn', []) if getattr(c, 'color', '').lower() == color_name)
-                            if count < 2:
-                                continue
-                    apply_effect(name, value, card, player, opponent, log, trash_list)
+    play_rank = compile_strategy(strat).play_rank(getattr(player, 'current_turn', 1)) if strat else {}
+    def run_ops(ops):
+        for op in ops:
+            name = op.opcode
+            if name == 'to':
                 continue
-            # OR-структура: выбрать альтернативу по приоритету
-            if effs and isinstance(effs[0], list):
-                # Выбор альтернативы по приоритету
-                best_idx = 1000
-                best_alt = effs[0]
-                found = False
-                for alt in effs:
-                    for eff in alt:
-                        if eff[0] in effect_priority_zone:
-                            idx = effect_priority_zone.index(eff[0])
-                            if idx < best_idx:
-                                best_idx = idx
-                                best_alt = alt
-                                found = True
-                # Если ни один не найден по приоритету — берём первый вариант
-                chosen = best_alt if found else effs[0]
-                for eff in chosen:
-                    if not isinstance(eff, (list, tuple)) or len(eff) != 2:
-                        continue
-                    name, value = eff
-                    if name == 'to':
-                        continue
-                    # --- Немедленный трэш для trash_this ---
-                    if name == 'trash_this':
-                        for zone in [player.hand, getattr(player, 'played_this_turn', []), player.discard, player.deck, player.gear]:
-                            if card in zone:
-                                zone.remove(card)
-                                card.trashed_by = 'trash_this'
-                                player.trash_pile.append(card)
-                                break
-                        continue
-                    if name in ['w_chain', 'b_chain', 'r_chain', 'g_chain']:
-                        color = name[0]  # w, b, r, g
-                        color_map = {'w': 'white', 'b': 'blue', 'r': 'red', 'g': 'green'}
-                        color_name = color_map.get(color, None)
-                        if color_name:
-                            count = sum(1 for c in player.hand+getattr(player, 'played_this_turn', []) if getattr(c, 'color', '').lower() == color_name)
-                            if count < 2:
-                                continue
-                    apply_effect(name, value, card, player, opponent, log, trash_list)
-            else:
-                for eff in effs:
-                    if not isinstance(eff, (list, tuple)) or len(eff) != 2:
-                        continue
-                    name, value = eff
-                    if name == 'to':
-                        continue
-                    # --- Немедленный трэш для trash_this ---
-                    if name == 'trash_this':
-                        for zone in [player.hand, getattr(player, 'played_this_turn', []), player.discard, player.deck, player.gear]:
-                            if card in zone:
-                                zone.remove(card)
-                                card.trashed_by = 'trash_this'
-                                player.trash_pile.append(card)
-                                break
-                        continue
-                    if name in ['w_chain', 'b_chain', 'r_chain', 'g_chain']:
-                        color = name[0]
-                        color_map = {'w': 'white', 'b': 'blue', 'r': 'red', 'g': 'green'}
-                        color_name = color_map.get(color, None)
-                        if color_name:
-                            count = sum(1 for c in player.hand+getattr(player, 'played_this_turn', []) if getattr(c, 'color', '').lower() == color_name)
-                            if count < 2:
-                                continue
-                    apply_effect(name, value, card, player, opponent, log, trash_list)
+            # --- Немедленный трэш для trash_this ---
+            if name == 'trash_this':
+                player.trash(card, 'trash_this')
+                continue
+            if op.chain:
+                count = sum(1 for c in player.hand+getattr(player, 'played_this_turn', []) if getattr(c, 'color', '').lower() == op.chain)
+                if count < 2:
+                    continue
+            apply_effect(name, op.value, card, player, opponent, log, trash_list)
+    # --- Применяем ВСЕ эффекты из всех effect-полей ---
+    for fld in card.program.fields:
+        # TO-структура: применить обе части по порядку
+        if fld.kind == 'seq':
+            run_ops(fld.branches[0])
+            run_ops(fld.branches[1])
+        # OR-структура: выбрать альтернативу по приоритету
+        elif fld.kind == 'or':
+            best_idx = 1000
+            chosen = fld.branches[0]
+            for alt in fld.branches:
+                for op in alt:
+                    idx = play_rank.get(op.opcode)
+                    if idx is not None and idx < best_idx:
+                        best_idx = idx
+                        chosen = alt
+            # Если ни один не найден по приоритету — берём первый вариант
+            run_ops(chosen)
+        else:
+            run_ops(fld.ops)
     # Priestess trash logic (имитация {Trash_this})
     if card.name.lower() == 'priestess':
         strat = getattr(player, 'user_strategy', None)
@@ -533,14 +1091,8 @@ def apply_card_effects(card, player, opponent, log, trash_list):
             # for zname, zone in [('hand', player.hand), ('played_this_turn', getattr(player, 'played_this_turn', [])), ('discard', player.discard), ('deck', player.deck), ('gear', player.gear)]:
             #     for c in zone:
             #         print(f"  {zname}: {c.name} id={id(c)}")
-            # Трэшим текущую Priestess из всех зон (аналогично trash_this)
-            for zone in [player.hand, getattr(player, 'played_this_turn', []), player.discard, player.deck, player.gear]:
-                if card in zone:
-                    zone.remove(card)
-                    card.trashed_by = 'trash_this'
-                    player.trash_pile.append(card)
-                    # print(f"DEBUG: Priestess id={id(card)} затрешена из {zone}")
-                    break
+            # Трэшим текущую Priestess из любой зоны (аналогично trash_this)
+            player.trash(card, 'trash_this')
 
 def apply_effect(name, value, card, player, opponent, log, trash_list):
     value = safe_int(value)
@@ -548,63 +1100,56 @@ def apply_effect(name, value, card, player, opponent, log, trash_list):
         opponent.apply_damage(value)
         player.total_damage_dealt += value
         if log:
-            debug_log(f"  {card.name} наносит {value} урона!", log_type="effects")
+            debug_log(lambda: f"  {card.name} наносит {value} урона!", log_type="effects")
     elif name == 'heal':
         player.heal(value)
         player.total_heal_received += value
         if log:
-            debug_log(f"  {card.name} лечит на {value}!", log_type="effects")
+            debug_log(lambda: f"  {card.name} лечит на {value}!", log_type="effects")
     elif name == 'heal_bleed':
         player.heal_bleed(value)
         player.total_bleed_heal_received += value
         if log:
-            debug_log(f"  {card.name} снимает bleed на {value}!", log_type="effects")
+            debug_log(lambda: f"  {card.name} снимает bleed на {value}!", log_type="effects")
     elif name == 'heal_poison':
         player.heal_poison(value)
         player.total_poison_heal_received += value
         if log:
-            debug_log(f"  {card.name} снимает poison на {value}!", log_type="effects")
+            debug_log(lambda: f"  {card.name} снимает poison на {value}!", log_type="effects")
     elif name == 'bleed':
         opponent.bleed += value
         player.total_bleed_dealt += value
         if log:
-            debug_log(f"  {card.name} даёт {value} bleed!", log_type="effects")
+            debug_log(lambda: f"  {card.name} даёт {value} bleed!", log_type="effects")
     elif name == 'poison':
         opponent.poison += value
         player.total_poison_dealt += value
         if log:
-            debug_log(f"  {card.name} даёт {value} яда!", log_type="effects")
+            debug_log(lambda: f"  {card.name} даёт {value} яда!", log_type="effects")
     elif name == 'trash':
         def is_starter(c):
             return c.name.lower() in ['strike', 'prayer']
         # Сброс
-        discard_starters = [c for c in player.discard if is_starter(c)]
-        if discard_starters:
-            c = discard_starters[0]
-            player.discard.remove(c)
-            c.trashed_by = 'trash'
-            player.trash_pile.append(c)
+        c = next((c for c in player.discard if is_starter(c)), None)
+        if c is not None:
+            player.trash(c, 'trash')
             return None  # из сброса — не влияет на hand_queue
         # Рука
-        hand_starters = [c for c in player.hand if is_starter(c)]
-        if hand_starters:
-            c = hand_starters[0]
-            player.hand.remove(c)
-            c.trashed_by = 'trash'
-            player.trash_pile.append(c)  # Теперь карта из руки тоже попадает в трэш
+        c = next((c for c in player.hand if is_starter(c)), None)
+        if c is not None:
+            player.trash(c, 'trash')  # Теперь карта из руки тоже попадает в трэш
             return c  # вернуть удалённую карту из руки
         return None
     elif name == 'draw':
         player.draw(value)
         if log:
-            debug_log(f"  {card.name} добирает {value} карт(ы)!", log_type="effects")
+            debug_log(lambda: f"  {card.name} добирает {value} карт(ы)!", log_type="effects")
     elif name == 'stun':
         to_discard = sorted(opponent.hand, key=lambda c: c.cost)[:value]
         for c in to_discard:
-            opponent.hand.remove(c)
             opponent.discard.append(c)
             if log:
-                debug_log(f"  [Stun] {opponent.name} сбрасывает карту: {c.name}", log_type="effects")
+                debug_log(lambda: f"  [Stun] {opponent.name} сбрасывает карту: {c.name}", log_type="effects")
     elif name == 'spy':
         # Смотрим верхние value карт колоды оппонента
         to_check = []
@@ -621,78 +1166,162 @@ def apply_effect(name, value, card, player, opponent, log, trash_list):
                 opponent.discard.append(c)
                 opponent.spy_discarded += 1
                 if log:
-                    debug_log(f"  [Spy] {c.name} сброшена!", log_type="effects")
+                    debug_log(lambda: f"  [Spy] {c.name} сброшена!", log_type="effects")
         # Базовые возвращаем на колоду (в том же порядке)
         opponent.deck.extend(reversed(to_return))
         if log:
-            debug_log(f"  [Spy] Базовые карты возвращены на колоду: {[c.name for c in to_return]}", log_type="effects")
+            debug_log(lambda: f"  [Spy] Базовые карты возвращены на колоду: {[c.name for c in to_return]}", log_type="effects")
     elif name == 'steal':
         for _ in range(value):
             if opponent.deck:
                 stolen = opponent.deck.pop()
                 player.discard.append(stolen)
                 if log:
-                    debug_log(f"  [Steal] Украдена карта: {stolen.name}", log_type="effects")
+                    debug_log(lambda: f"  [Steal] Украдена карта: {stolen.name}", log_type="effects")
     elif name == 'destroy':
         # Уничтожить первую gear-карту оппонента
-        destroyed = None
-        for g in opponent.gear:
-            destroyed = g
-            break
+        destroyed = next(iter(opponent.gear), None)
         if destroyed:
-            opponent.gear.remove(destroyed)
+            opponent.gear.destroy(destroyed)
             opponent.gear_destroyed += 1
             if log:
-                debug_log(f"  [Destroy] Уничтожена gear-карта: {destroyed.name}", log_type="effects")
+                debug_log(lambda: f"  [Destroy] Уничтожена gear-карта: {destroyed.name}", log_type="effects")
+
+# --- Профиль партии: время и число вызовов по фазам ---
+# simulate_game(profile=PhaseProfile()) копит замеры фаз хода; без profile замеров нет вовсе
+# (эффекты и выбор покупки вызываются напрямую, на границах фаз — одна проверка на None).
+# Фазы: setup, status, blessing, play, buy, end_turn; вложенные, через '/':
+# play/<опкод> — вызовы apply_effect, buy/buy_strategy — выбор покупки
+class PhaseProfile:
+    def __init__(self):
+        self.games = 0
+        self.calls = defaultdict(int)
+        self.time = defaultdict(float)
+    def lap(self, phase, start):
+        # Засчитывает фазе время от start; возвращает момент конца для следующей фазы
+        now = time.perf_counter()
+        self.calls[phase] += 1
+        self.time[phase] += now - start
+        return now
+    def timed(self, phase, func):
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            self.lap(phase, start)
+            return result
+        return call
+    def timed_effect(self, func):
+        def call(name, *args):
+            start = time.perf_counter()
+            result = func(name, *args)
+            self.lap('play/' + name, start)
+            return result
+        return call
+    def merge(self, other):
+        self.games += other.games
+        for phase, n in other.calls.items():
+            self.calls[phase] += n
+            self.time[phase] += other.time[phase]
+        return self
+    def report(self):
+        # Доли — от суммы фаз верхнего уровня; вложенные фазы входят в своих родителей
+        total = sum(t for phase, t in self.time.items() if '/' not in phase)
+        phases = {}
+        for phase in sorted(self.time, key=lambda p: -self.time[p]):
+            t, n = self.time[phase], self.calls[phase]
+            phases[phase] = {
+                'calls': n,
+                'total_ms': round(t * 1000, 3),
+                'avg_us': round(t * 1e6 / n, 3) if n else 0,
+                'share': round(100 * t / total, 2) if total else 0,
+            }
+        return {
+            'games': self.games,
+            'total_ms': round(total * 1000, 3),
+            'per_game_ms': round(total * 1000 / self.games, 4) if self.games else 0,
+            'phases': phases,
+        }
 
 # --- Симуляция одной партии ---
-def simulate_game(pattern1, pattern2, log=False, max_turns=30, first_player=0, custom_hp=None, collect_log=False, user_strategy1=None, user_strategy2=None, print_market_deck=False, log_options=None):
+def simulate_game(pattern1, pattern2, log=False, max_turns=30, first_player=0, custom_hp=None, collect_log=False, user_strategy1=None, user_strategy2=None, print_market_deck=False, log_options=None, seed=None, trade_row_size=5, collect_replay=False, profile=None, rng_streams=False):
+    if profile is not None:
+        t = time.perf_counter()
+        run_effect = profile.timed_effect(apply_effect)
+        choose_buy = profile.timed('buy/buy_strategy', buy_strategy)
+    else:
+        run_effect = apply_effect
+        choose_buy = buy_strategy
+    if seed is not None:
+        RNG.seed(seed)
     if log_options is None:
         log_options = ['effects', 'hand', 'deck', 'discard', 'trash', 'hp', 'poison', 'bleed', 'buys', 'all_effects', 'debug', 'card_filter']
     def log_if(option, msg, color=None):
-        if log_options is None or option in log_options:
+        if option in log_options and log_enabled(option):
             debug_log(msg, log_type=option, color=color)
-    player1 = Player("P1")
-    player2 = Player("P2")
-    market = TradeMarket(MAIN_CARDS)
+    # Типизированные сообщения пишутся, только если включён хоть один тип лога:
+    # плотные блоки логов ниже целиком пропускаются одной проверкой
+    log_active = log_enabled() and bool(RUN.log_options)
+    main_cards = get_catalog().main_cards
+    if rng_streams:
+        streams = game_streams(seed if seed is not None else RNG.rng.getrandbits(64))
+        player1 = Player("P1", streams['P1'], streams['P1:buy'])
+        player2 = Player("P2", streams['P2'], streams['P2:buy'])
+        market = TradeMarket(main_cards, trade_row_size, streams['market'])
+    else:
+        player1 = Player("P1")
+        player2 = Player("P2")
+        market = TradeMarket(main_cards, trade_row_size)
     player1.market = market
     player2.market = market
+    # Соперник нужен ботам, которые ищут покупку по модели партии (паттерн 'mcts')
+    player1.opponent = player2
+    player2.opponent = player1
     priestess = get_priestess()
     players = [player1, player2]
     patterns = [pattern1, pattern2]
     if print_market_deck:
-        debug_log(f"[MARKET] Состав колоды рынка в начале игры: {market.get_market_deck_summary()}", log_type="market")
+        debug_log(lambda: f"[MARKET] Состав колоды рынка в начале игры: {market.get_market_deck_summary()}", log_type="market")
     if custom_hp is not None:
         for p in [player1, player2]:
             if p.name == "P1":
                 p.health = custom_hp[0]
             else:
                 p.health = custom_hp[1]
+    # Компактный реплей (replay.py): события переносов карт пишут сами зоны и рынок
+    replay = ReplayRecorder(players, market) if collect_replay else None
     hp_history = []
     poison_history = []
     winner = None
     detailed_log = [] if collect_log else None
+    if profile is not None:
+        profile.lap('setup', t)
     for turn in range(max_turns):
         turn_log = [] if collect_log else None
         if log:
-            debug_log(f"\n=== Ход {turn+1} ===", log_type="debug", color=AnsiColor.GREEN)
+            debug_log(lambda: f"\n=== Ход {turn+1} ===", log_type="debug", color=AnsiColor.GREEN)
 
         for idx, player in enumerate(players):
             opponent = players[1 - idx]
             color = AnsiColor.GREEN if idx == 0 else AnsiColor.BLUE
-            debug_log(f"\n=== Ход {turn+1} (P{idx+1}) ===", log_type="debug", color=color)
+            debug_log(lambda: f"\n=== Ход {turn+1} (P{idx+1}) ===", log_type="debug", color=color)
             # --- Проверка на проигрыш до начала хода ---
             if player.health <= 0 or player.poison >= 20:
                 winner = opponent.name
                 if log:
-                    debug_log(f"Игрок {idx+1} проиграл (до начала хода)!", log_type="player", color=color)
+                    debug_log(lambda: f"Игрок {idx+1} проиграл (до начала хода)!", log_type="player", color=color)
                 if collect_log:
                     if turn_log is not None:
                         turn_log.append({'player': player.name, 'lost': True, 'reason': 'start_turn'})
+                if replay:
+                    replay.lost(idx, 'start_turn')
                 break
+            if profile is not None:
+                t = time.perf_counter()
             lost = player.start_turn_statuses()
+            if profile is not None:
+                t = profile.lap('status', t)
             if log:
-                debug_log(f"Игрок {idx+1}: HP={player.health}, Poison={player.poison}, Bleed={player.bleed}, Hand={[c.name for c in player.hand]}", log_type="player", color=color)
+                debug_log(lambda: f"Игрок {idx+1}: HP={player.health}, Poison={player.poison}, Bleed={player.bleed}, Hand={[c.name for c in player.hand]}", log_type="player", color=color)
             if collect_log:
                 turn_log.append({
                     'player': player.name,
@@ -709,149 +1338,152 @@ def simulate_game(pattern1, pattern2, log=False, max_turns=30, first_player=0, c
             if lost:
                 winner = opponent.name
                 if log:
-                    debug_log(f"Игрок {idx+1} проиграл!", log_type="player", color=color)
+                    debug_log(lambda: f"Игрок {idx+1} проиграл!", log_type="player", color=color)
                 if collect_log:
                     turn_log.append({'player': player.name, 'lost': True, 'reason': 'start_turn_statuses'})
+                if replay:
+                    replay.lost(idx, 'start_turn_statuses')
                 break
             # --- Новый подсчёт Blessing по всей руке ---
-            total_blessing = 0
-            for card in player.hand:
-                for field in ['effect1', 'effect2', 'effect1text', 'effect2text']:
-                    val = getattr(card, field, None)
-                    if val:
-                        for eff in parse_effects_from_string(val):
-                            if isinstance(eff, (list, tuple)) and len(eff) == 2 and eff[0] == 'blessing':
-                                try:
-                                    blessing_val = int(eff[1]) if eff[1] is not None else 0
-                                except (TypeError, ValueError):
-                                    blessing_val = 0
-                                total_blessing += blessing_val
+            total_blessing = sum(card.program.blessing for card in player.hand)
+            if profile is not None:
+                t = profile.lap('blessing', t)
             if collect_log:
                 # Добавляем информацию о blessing в последний элемент turn_log
                 if turn_log and len(turn_log) > 0:
                     turn_log[-1]['total_blessing'] = total_blessing
+            if replay:
+                replay.turn(turn+1, idx, total_blessing)
             trash_list = []
             played = set()
-            hand_queue = list(player.hand)
+            # Очередь розыгрыша: deque + множество uid карт, которые в ней реально стоят
+            # (удалённые из очереди карты пропускаются лениво)
+            hand_queue = deque(player.hand)
+            queued = set(c.uid for c in hand_queue)
             played_this_turn = []
             played_ids = set()
             effects_this_turn = []
             # --- DEBUG: выводим стартовое состояние ---
-            log_if('debug', f"[DEBUG] {player.name} старт хода: hand={[c.name for c in player.hand]}, deck={[c.name for c in player.deck]}, discard={[c.name for c in player.discard]}", color)
-            log_if('player', f"[PLAYER] {player.name} (начало): HP={player.health}, Poison={player.poison}, Bleed={player.bleed}", color)
-            log_if('hand', f"Hand({len(player.hand)}): {[c.name for c in player.hand]}", color)
-            log_if('deck', f"Deck({len(player.deck)}): {[c.name for c in player.deck]}", color)
-            log_if('discard', f"Discard({len(player.discard)}): {[c.name for c in player.discard]}", color)
-            log_if('gear', f"Gear({len(player.gear)}): {[c.name for c in player.gear]}", color)
-            log_if('trash', f"Trash({len(player.trash_pile)}): {[c.name for c in player.trash_pile]}", color)
-            log_if('hp', f"HP: {player.health}", color)
-            log_if('poison', f"Poison: {player.poison}", color)
-            log_if('bleed', f"Bleed: {player.bleed}", color)
-            debug_log(f"         Hand({len(player.hand)}): {[c.name for c in player.hand]}", log_type="debug", color=color)
-            debug_log(f"         Deck({len(player.deck)}): {[c.name for c in player.deck]}", log_type="debug", color=color)
-            debug_log(f"         Discard({len(player.discard)}): {[c.name for c in player.discard]}", log_type="debug", color=color)
-            debug_log(f"         Gear({len(player.gear)}): {[c.name for c in player.gear]}", log_type="debug", color=color)
-            debug_log(f"         Trash({len(player.trash_pile)}): {[c.name for c in player.trash_pile]}", log_type="debug", color=color)
+            if log_active:
+                log_if('debug', lambda: f"[DEBUG] {player.name} старт хода: hand={[c.name for c in player.hand]}, deck={[c.name for c in player.deck]}, discard={[c.name for c in player.discard]}", color)
+                log_if('player', lambda: f"[PLAYER] {player.name} (начало): HP={player.health}, Poison={player.poison}, Bleed={player.bleed}", color)
+                log_if('hand', lambda: f"Hand({len(player.hand)}): {[c.name for c in player.hand]}", color)
+                log_if('deck', lambda: f"Deck({len(player.deck)}): {[c.name for c in player.deck]}", color)
+                log_if('discard', lambda: f"Discard({len(player.discard)}): {[c.name for c in player.discard]}", color)
+                log_if('gear', lambda: f"Gear({len(player.gear)}): {[c.name for c in player.gear]}", color)
+                log_if('trash', lambda: f"Trash({len(player.trash_pile)}): {[c.name for c in player.trash_pile]}", color)
+                log_if('hp', lambda: f"HP: {player.health}", color)
+                log_if('poison', lambda: f"Poison: {player.poison}", color)
+                log_if('bleed', lambda: f"Bleed: {player.bleed}", color)
+                debug_log(lambda: f"         Hand({len(player.hand)}): {[c.name for c in player.hand]}", log_type="debug", color=color)
+                debug_log(lambda: f"         Deck({len(player.deck)}): {[c.name for c in player.deck]}", log_type="debug", color=color)
+                debug_log(lambda: f"         Discard({len(player.discard)}): {[c.name for c in player.discard]}", log_type="debug", color=color)
+                debug_log(lambda: f"         Gear({len(player.gear)}): {[c.name for c in player.gear]}", log_type="debug", color=color)
+                debug_log(lambda: f"         Trash({len(player.trash_pile)}): {[c.name for c in player.trash_pile]}", log_type="debug", color=color)
             max_play_iterations = 30
             play_iterations = 0
-            while hand_queue:
+            while True:
+                while hand_queue and hand_queue[0].uid not in queued:
+                    hand_queue.popleft()
+                if not hand_queue:
+                    break
                 play_iterations += 1
                 if play_iterations > max_play_iterations:
-                    debug_log(f"[DEBUG] Превышен лимит разыгрывания карт за ход! hand_queue={[c.name for c in hand_queue]}, played_this_turn={[c.name for c in played_this_turn]}", log_type="debug", color=color)
+                    debug_log(lambda: f"[DEBUG] Превышен лимит разыгрывания карт за ход! hand_queue={[c.name for c in hand_queue if c.uid in queued]}, played_this_turn={[c.name for c in played_this_turn]}", log_type="debug", color=color)
                     break
-                card = hand_queue.pop(0)
-                # --- Проверка: карта должна быть в руке и не разыграна ранее (по id!) ---
+                card = hand_queue.popleft()
+                queued.discard(card.uid)
+                # --- Проверка: карта должна быть в руке и не разыграна ранее (по uid!) ---
                 if card not in player.hand:
-                    debug_log(f"[ERROR] Карта {card.name} не в руке, но пытается разыграться! Пропуск.", log_type="error", color=color)
+                    debug_log(lambda: f"[ERROR] Карта {card.name} не в руке, но пытается разыграться! Пропуск.", log_type="error", color=color)
                     continue
-                if id(card) in played_ids:
-                    debug_log(f"[ERROR] Карта {card.name} (id={id(card)}) уже разыграна в этом ходу! Пропуск.", log_type="error", color=color)
+                if card.uid in played_ids:
+                    debug_log(lambda: f"[ERROR] Карта {card.name} (uid={card.uid}) уже разыграна в этом ходу! Пропуск.", log_type="error", color=color)
                     continue
                 # --- DEBUG: какие эффекты будут применяться ---
-                effs_to_apply = []
-                for field in ['effect1', 'effect2', 'effect1text', 'effect2text']:
-                    val = getattr(card, field, None)
-                    if val:
-                        parsed = parse_effects_from_string(val)
-                        debug_log(f"[DEBUG] Разыгрывается {card.name}: {field}='{val}' -> {parsed}", log_type="debug", color=color)
-                        effs_to_apply += parsed
-                debug_log(f"[DEBUG] Разыгрывается карта {card.name}, эффекты к применению: {effs_to_apply}", log_type="debug", color=color)
-                if not effs_to_apply:
-                    debug_log(f"[DEBUG] У карты {card.name} нет применимых эффектов!", log_type="debug", color=color)
+                program = card.program
+                if log_active:
+                    effs_to_apply = []
+                    for field, fld in zip(EFFECT_FIELDS, program.fields):
+                        if fld.text:
+                            debug_log(lambda: f"[DEBUG] Разыгрывается {card.name}: {field}='{fld.text}' -> {fld.parsed}", log_type="debug", color=color)
+                            effs_to_apply += fld.parsed
+                    debug_log(lambda: f"[DEBUG] Разыгрывается карта {card.name}, эффекты к применению: {effs_to_apply}", log_type="debug", color=color)
+                    if not effs_to_apply:
+                        debug_log(lambda: f"[DEBUG] У карты {card.name} нет применимых эффектов!", log_type="debug", color=color)
                 # --- GEAR: если карта gear, кладём на стол, эффекты применяем, но не уходит в discard ---
-                if getattr(card, 'is_gear', False):
-                    if not any(g is card for g in player.gear):
+                if replay:
+                    replay.play(card)
+                if card.is_gear:
+                    # Перенос из руки на стол
+                    if card not in player.gear:
                         player.gear.append(card)
-                    for eff in parse_effects_from_string(card.effect1):
-                        if not isinstance(eff, (list, tuple)) or len(eff) != 2:
-                            continue
-                        name, value = eff
+                    for op in program.fields[0].ops:
+                        name = op.opcode
                         if name not in ['def_y_text', 'def_n_text']:
-                            apply_effect(name, value, card, player, opponent, log, trash_list)
+                            run_effect(name, op.value, card, player, opponent, log, trash_list)
                             if collect_log:
-                                effects_this_turn.append({'card': card.name, 'effect': name, 'value': value, 'target': opponent.name})
+                                effects_this_turn.append({'card': card.name, 'effect': name, 'value': op.raw, 'target': opponent.name})
+                            if replay:
+                                replay.effect(name, op.raw)
                             if player.health <= 0 or player.poison >= 20:
                                 winner = opponent.name
                                 if log:
-                                    debug_log(f"Игрок {idx+1} проиграл (после эффекта gear)!", log_type="player", color=color)
+                                    debug_log(lambda: f"Игрок {idx+1} проиграл (после эффекта gear)!", log_type="player", color=color)
                                 break
-                    for eff in parse_effects_from_string(card.effect2):
-                        if not isinstance(eff, (list, tuple)) or len(eff) != 2:
-                            continue
-                        name, value = eff
+                    for op in program.fields[1].ops:
+                        name = op.opcode
                         if name not in ['def_y_text', 'def_n_text']:
-                            apply_effect(name, value, card, player, opponent, log, trash_list)
+                            run_effect(name, op.value, card, player, opponent, log, trash_list)
                             if collect_log:
-                                effects_this_turn.append({'card': card.name, 'effect': name, 'value': value, 'target': opponent.name})
+                                effects_this_turn.append({'card': card.name, 'effect': name, 'value': op.raw, 'target': opponent.name})
+                            if replay:
+                                replay.effect(name, op.raw)
                             if player.health <= 0 or player.poison >= 20:
                                 winner = opponent.name
                                 if log:
-                                    debug_log(f"Игрок {idx+1} проиграл (после эффекта gear)!", log_type="player", color=color)
+                                    debug_log(lambda: f"Игрок {idx+1} проиграл (после эффекта gear)!", log_type="player", color=color)
                                 break
                     played_this_turn.append(card)
-                    played_ids.add(id(card))
-                    # Удаляем gear из руки
-                    if card in player.hand:
-                        player.hand.remove(card)
+                    played_ids.add(card.uid)
                     if winner:
                         break
                     continue
                 # --- Обычная карта ---
                 def draw_hook(n):
                     n = safe_int(n)
-                    before = set(id(c) for c in player.hand)
-                    player.draw(n)
                     # Добавлять только реально новые карты
-                    new_cards = [c for c in player.hand if id(c) not in before and c not in played_this_turn and c not in hand_queue]
+                    new_cards = [c for c in player.draw(n) if c.uid not in played_ids and c.uid not in queued]
                     hand_queue.extend(new_cards)
+                    queued.update(c.uid for c in new_cards)
                     if log and new_cards:
-                        debug_log(f"  Добрано карт: {[c.name for c in new_cards]}", log_type="effects", color=color)
+                        debug_log(lambda: f"  Добрано карт: {[c.name for c in new_cards]}", log_type="effects", color=color)
                 def apply_card_effects_with_draw(card, player, opponent, log, trash_list):
                     removed_from_hand = []
-                    for eff in parse_effects_from_string(card.effect1):
-                        if not isinstance(eff, (list, tuple)) or len(eff) != 2:
-                            continue
-                        name, value = eff
+                    for op in card.program.fields[0].ops:
+                        name = op.opcode
                         if name == 'draw':
-                            draw_hook(value)
+                            draw_hook(op.value)
                         else:
-                            res = apply_effect(name, value, card, player, opponent, log, trash_list)
+                            res = run_effect(name, op.value, card, player, opponent, log, trash_list)
                             if collect_log:
-                                effects_this_turn.append({'card': card.name, 'effect': name, 'value': value, 'target': opponent.name})
+                                effects_this_turn.append({'card': card.name, 'effect': name, 'value': op.raw, 'target': opponent.name})
+                            if replay:
+                                replay.effect(name, op.raw)
                             if name == 'trash' and res is not None:
                                 removed_from_hand.append(res)
                             if player.health <= 0 or player.poison >= 20:
                                 return removed_from_hand, True
-                    for eff in parse_effects_from_string(card.effect2):
-                        if not isinstance(eff, (list, tuple)) or len(eff) != 2:
-                            continue
-                        name, value = eff
+                    for op in card.program.fields[1].ops:
+                        name = op.opcode
                         if name == 'draw':
-                            draw_hook(value)
+                            draw_hook(op.value)
                         else:
-                            res = apply_effect(name, value, card, player, opponent, log, trash_list)
+                            res = run_effect(name, op.value, card, player, opponent, log, trash_list)
                             if collect_log:
-                                effects_this_turn.append({'card': card.name, 'effect': name, 'value': value, 'target': opponent.name})
+                                effects_this_turn.append({'card': card.name, 'effect': name, 'value': op.raw, 'target': opponent.name})
+                            if replay:
+                                replay.effect(name, op.raw)
                             if name == 'trash' and res is not None:
                                 removed_from_hand.append(res)
                             if player.health <= 0 or player.poison >= 20:
@@ -859,55 +1491,37 @@ def simulate_game(pattern1, pattern2, log=False, max_turns=30, first_player=0, c
                     # --- УПРОЩЁННО: если это Priestess, всегда уходит в трэш после применения эффектов ---
                     if getattr(card, 'name', '').lower() == 'priestess':
                         # Проверяем, есть ли у карты эффект trash_this
-                        has_trash_this = False
-                        for field in ['effect1', 'effect2', 'effect1text', 'effect2text']:
-                            val = getattr(card, field, None)
-                            if val and '{trash_this' in val.lower():
-                                has_trash_this = True
-                                break
-                        for zone in [player.hand, getattr(player, 'played_this_turn', []), player.discard, player.deck, player.gear]:
-                            if card in zone:
-                                zone.remove(card)
-                                card.trashed_by = 'trash_this' if has_trash_this else 'priestess_trash'
-                                player.trash_pile.append(card)
-                                break
+                        has_trash_this = card.program.has_trash_this
+                        player.trash(card, 'trash_this' if has_trash_this else 'priestess_trash')
                     return removed_from_hand, False
                 removed, lost_now = apply_card_effects_with_draw(card, player, opponent, log, trash_list)
                 for rem_card in removed:
-                    hand_queue = [c for c in hand_queue if c != rem_card]
+                    queued.discard(rem_card.uid)
                 played_this_turn.append(card)
-                played_ids.add(id(card))
-                # Удаляем карту из руки и кладём в discard ТОЛЬКО если она ещё не была затрешена
+                played_ids.add(card.uid)
+                # Кладём карту из руки в discard ТОЛЬКО если она ещё не была затрешена
                 if card in player.hand:
-                    player.hand.remove(card)
-                    # Если карта уже в трэше, не кладём в discard
-                    if card not in player.trash_pile:
-                        player.discard.append(card)
+                    player.discard.append(card)
                 if lost_now:
                     winner = opponent.name
                     if log:
-                        debug_log(f"Игрок {idx+1} проиграл (после эффекта)!", log_type="player", color=color)
+                        debug_log(lambda: f"Игрок {idx+1} проиграл (после эффекта)!", log_type="player", color=color)
                     break
             # --- Диагностика: карта разыграна более одного раза ---
-            card_ids = [id(c) for c in played_this_turn]
-            if len(card_ids) != len(set(card_ids)):
-                debug_log(f"[ERROR] Одна и та же карта разыграна более одного раза за ход! {[c.name for c in played_this_turn]}", log_type="error", color=color)
+            if len(played_this_turn) != len(played_ids):
+                debug_log(lambda: f"[ERROR] Одна и та же карта разыграна более одного раза за ход! {[c.name for c in played_this_turn]}", log_type="error", color=color)
             if winner:
+                if profile is not None:
+                    profile.lap('play', t)
                 if collect_log:
                     turn_log.append({'player': player.name, 'lost': True, 'reason': 'effect'})
+                if replay:
+                    replay.lost(idx, 'effect')
                 break
             # Trash_this: удаляем карты из руки
             for card in trash_list:
-                found = False
-                zone_name = None
-                for zone, zname in zip([player.hand, player.discard, player.deck, played_this_turn, player.gear], ['hand', 'discard', 'deck', 'played_this_turn', 'gear']):
-                    if card in zone:
-                        zone.remove(card)
-                        card.trashed_by = 'trash_this'
-                        player.trash_pile.append(card)
-                        found = True
-                        zone_name = zname
-                        break
+                zone_name = card.zone.name if card.zone is not None else None
+                found = player.trash(card, 'trash_this')
                 if collect_log:
                     if not hasattr(card, 'name'):
                         cname = str(card)
@@ -919,6 +1533,8 @@ def simulate_game(pattern1, pattern2, log=False, max_turns=30, first_player=0, c
                     else:
                         detailed_log[-1]['actions'][-1].setdefault('trash_log', []).append(
                             {'card': cname, 'result': 'not found', 'zone': None})
+            if profile is not None:
+                t = profile.lap('play', t)
             # --- Покупка карт ---
             spent_blessing = 0
             bought_cards = []
@@ -929,23 +1545,23 @@ def simulate_game(pattern1, pattern2, log=False, max_turns=30, first_player=0, c
             while True:
                 buy_iterations += 1
                 if buy_iterations > max_buy_iterations:
-                    debug_log(f"[DEBUG] Превышен лимит покупок за ход! bought_cards={bought_cards}", log_type="debug", color=AnsiColor.YELLOW)
+                    debug_log(lambda: f"[DEBUG] Превышен лимит покупок за ход! bought_cards={bought_cards}", log_type="debug", color=AnsiColor.YELLOW)
                     break
-                if log or True:
-                    debug_log(f"  Blessing на ход: {total_blessing}, потрачено: {spent_blessing}", log_type="buys", color=AnsiColor.YELLOW)
-                    debug_log(f"  Доступные для покупки: {[c.name for c in market.trade_row if c.cost <= (total_blessing - spent_blessing)]}", log_type="buys", color=AnsiColor.YELLOW)
-                    debug_log(f"[DEBUG] market.trade_row после refill: {[f'{c.name}({c.cost})' for c in market.trade_row]}", log_type="debug", color=AnsiColor.YELLOW)
-                i = buy_strategy(player, market, total_blessing, spent_blessing, pattern=patterns[idx], user_strategy=[user_strategy1, user_strategy2][idx], turn_num=turn+1, log_if=log_if)
+                if log_active:
+                    debug_log(lambda: f"  Blessing на ход: {total_blessing}, потрачено: {spent_blessing}", log_type="buys", color=AnsiColor.YELLOW)
+                    debug_log(lambda: f"  Доступные для покупки: {[c.name for c in market.trade_row if c.cost <= (total_blessing - spent_blessing)]}", log_type="buys", color=AnsiColor.YELLOW)
+                    debug_log(lambda: f"[DEBUG] market.trade_row после refill: {[f'{c.name}({c.cost})' for c in market.trade_row]}", log_type="debug", color=AnsiColor.YELLOW)
+                i = choose_buy(player, market, total_blessing, spent_blessing, pattern=patterns[idx], user_strategy=[user_strategy1, user_strategy2][idx], turn_num=turn+1, log_if=log_if)
                 if i == 'priestess':
                     # Явная покупка Priestess по стратегии или если только она разрешена
                     if priestess and priestess.cost <= (total_blessing - spent_blessing):
                         if collect_log:
                             buy_steps.append({'before': total_blessing - spent_blessing, 'card': 'Priestess', 'cost': priestess.cost, 'after': total_blessing - spent_blessing - priestess.cost})
-                        player.discard.append(Card(priestess.name, priestess.effect1, priestess.effect2, priestess.cost, priestess.color, priestess.effect1text, priestess.effect2text))
+                        player.discard.append(Card(priestess))
                         spent_blessing += priestess.cost
                         bought_cards.append('Priestess')
-                        if log or True:
-                            debug_log(f"  Куплена карта: Priestess", log_type="buys", color=AnsiColor.YELLOW)
+                        if log_active:
+                            debug_log(lambda: f"  Куплена карта: Priestess", log_type="buys", color=AnsiColor.YELLOW)
                         if collect_log:
                             market_cards = [];
                             name_count = {};
@@ -976,11 +1592,11 @@ def simulate_game(pattern1, pattern2, log=False, max_turns=30, first_player=0, c
                         for _ in range(max_priestess):
                             if collect_log:
                                 buy_steps.append({'before': total_blessing - spent_blessing, 'card': 'Priestess', 'cost': priestess.cost, 'after': total_blessing - spent_blessing - priestess.cost})
-                            player.discard.append(Card(priestess.name, priestess.effect1, priestess.effect2, priestess.cost, priestess.color, priestess.effect1text, priestess.effect2text))
+                            player.discard.append(Card(priestess))
                             spent_blessing += priestess.cost
                             bought_cards.append('Priestess')
-                            if log or True:
-                                debug_log(f"  Куплена карта: Priestess (bulk)", log_type="buys", color=AnsiColor.YELLOW)
+                            if log_active:
+                                debug_log(lambda: f"  Куплена карта: Priestess (bulk)", log_type="buys", color=AnsiColor.YELLOW)
                             if collect_log:
                                 market_cards = [];
                                 name_count = {};
@@ -1005,8 +1621,8 @@ def simulate_game(pattern1, pattern2, log=False, max_turns=30, first_player=0, c
                 spent_blessing += card.cost
                 market.buy_card(i, player)
                 bought_cards.append(card.name)
-                if log or True:
-                    debug_log(f"  Куплена карта: {card.name}", log_type="buys", color=AnsiColor.YELLOW)
+                if log_active:
+                    debug_log(lambda: f"  Куплена карта: {card.name}", log_type="buys", color=AnsiColor.YELLOW)
                 if collect_log:
                     # Считаем количество одинаковых карт
                     market_cards = []
@@ -1026,23 +1642,33 @@ def simulate_game(pattern1, pattern2, log=False, max_turns=30, first_player=0, c
                             name_count[c.name] = 0  # чтобы не дублировать
                     market_state.append({'market': market_cards, 'buy': card.name})
             if log:
-                debug_log(f"  Суммарно потрачено Blessing: {spent_blessing} из {total_blessing}", color=color)
+                debug_log(lambda: f"  Суммарно потрачено Blessing: {spent_blessing} из {total_blessing}", color=color)
+            if profile is not None:
+                t = profile.lap('buy', t)
+            if replay:
+                replay.end(spent_blessing)
             player.end_turn()
+            if profile is not None:
+                profile.lap('end_turn', t)
             # --- Проверка на проигрыш после конца хода ---
             if player.health <= 0 or player.poison >= 20:
                 winner = opponent.name
                 if log:
-                    debug_log(f"Игрок {idx+1} проиграл (после конца хода)!", log_type="player", color=color)
+                    debug_log(lambda: f"Игрок {idx+1} проиграл (после конца хода)!", log_type="player", color=color)
                 if collect_log:
                     turn_log.append({'player': player.name, 'lost': True, 'reason': 'end_turn'})
+                if replay:
+                    replay.lost(idx, 'end_turn')
                 break
             # --- Новое условие: проигрыш, если нет ни одной карты ---
             if not player.hand and not player.deck and not player.discard:
                 winner = opponent.name
                 if log:
-                    debug_log(f"{player.name} проиграл: у него не осталось карт!", log_type="player", color=color)
+                    debug_log(lambda: f"{player.name} проиграл: у него не осталось карт!", log_type="player", color=color)
                 if collect_log:
                     turn_log.append({'player': player.name, 'lost': True, 'reason': 'no_cards'})
+                if replay:
+                    replay.lost(idx, 'no_cards')
                 break
             if collect_log:
                 turn_log.append({
@@ -1093,6 +1719,8 @@ def simulate_game(pattern1, pattern2, log=False, max_turns=30, first_player=0, c
         }
     gear_stats1 = gear_stats(player1)
     gear_stats2 = gear_stats(player2)
+    if profile is not None:
+        profile.games += 1
     return {
         'hp_history': hp_history,
         'poison_history': poison_history,
@@ -1126,43 +1754,1179 @@ def simulate_game(pattern1, pattern2, log=False, max_turns=30, first_player=0, c
         'gear_stats1': gear_stats1,
         'gear_stats2': gear_stats2,
         'detailed_log': detailed_log,
+        'replay': replay.finish(winner, turn+1) if replay else None,
+    }
+
+
+# --- Массовая симуляция: сводка партии и накопительная статистика ---
+# config — те же параметры, что принимает /api/simulate:
+# strategy1/2, user_strategy1/2, hp1/2, enabled_cards, log_options, max_turns
+# и, опционально, cards/starters для загрузки каталога
+GAME_METRICS = ('damage_dealt', 'poison_dealt', 'bleed_dealt', 'heal_received',
+                'poison_heal_received', 'bleed_heal_received', 'trash', 'trash_this')
+GEAR_STAT_KEYS = ('played', 'destroyed', 'trashed', 'on_table')
+# Раскладка массивов SimAggregate. Поля игрока до damage приходят из сводки партии одним
+# вектором (player_summary()['scalars']), остальные вычисляются при добавлении партии
+GAME_FIELDS = ('games', 'turns', 'turns_sq', 'decided', 'winner_hp', 'winner_poison', 'hp_diff')
+PLAYER_FIELDS = ('hp_end', 'poison_end', 'bleed_end', 'gear_saved_damage', 'spy_discarded',
+                 'gear_destroyed') + GAME_METRICS + ('damage', 'wins', 'poison_wins')
+PLAYER_SUMMARY_FIELDS = PLAYER_FIELDS.index('damage')
+CARD_FIELDS = ('card_value', 'trashed', 'gear_absorbed', 'gear_seen', 'winner_cards', 'loser_cards')
+PRIESTESS_FIELDS = ('bought', 'trashed', 'as_gear', 'absorbed')
+_G = {name: i for i, name in enumerate(GAME_FIELDS)}
+_P = {name: i for i, name in enumerate(PLAYER_FIELDS)}
+_C = {name: i for i, name in enumerate(CARD_FIELDS)}
+
+def _card_counts(cards, index, size, weights=None):
+    ids = [index[c.name] for c in cards]
+    if not ids:
+        return np.zeros(size, dtype=np.int64)
+    return np.bincount(ids, weights=weights, minlength=size).astype(np.int64)
+
+def player_summary(player, index, size):
+    own = player.deck + player.discard + player.hand
+    gear = [c for c in own if c.is_gear]
+    priestess = (
+        sum(1 for c in own if c.name.lower() == 'priestess'),
+        sum(1 for c in player.trash_pile if c.name.lower() == 'priestess'),
+        sum(1 for c in player.gear if c.name.lower() == 'priestess'),
+        sum(c.absorbed_damage for c in own + player.gear if c.name.lower() == 'priestess'),
+    )
+    scalars = [player.health, player.poison, player.bleed, player.gear_saved_damage,
+               player.spy_discarded, player.gear_destroyed]
+    return {
+        'health': player.health,
+        'poison': player.poison,
+        'scalars': scalars,
+        'cards': _card_counts(own, index, size),
+        'trash': _card_counts(player.trash_pile, index, size),
+        'gear_seen': _card_counts(gear, index, size),
+        'absorbed': _card_counts(gear, index, size, [c.absorbed_damage for c in gear]),
+        'priestess': priestess,
+    }
+
+def summarize_game(res):
+    # Сводка партии в векторах по id карт каталога; Player-объекты после неё не нужны
+    catalog = get_catalog()
+    index, size = catalog.card_index, len(catalog.card_names)
+    players = (player_summary(res['player1'], index, size), player_summary(res['player2'], index, size))
+    gear = np.zeros((2, len(GEAR_STAT_KEYS), size), dtype=np.int64)
+    for idx, ps in enumerate(players):
+        ps['scalars'] += [res[key + str(idx + 1)] for key in GAME_METRICS]
+        for k, key in enumerate(GEAR_STAT_KEYS):
+            for name, n in res['gear_stats' + str(idx + 1)].get(key, {}).items():
+                gear[idx, k, index[name]] += n
+    return {'winner': res['winner'], 'turns': res['turns'], 'players': players, 'gear_stats': gear}
+
+class SimAggregate:
+    # Накопительная статистика прогона на массивах NumPy: скаляры партии, скаляры по игрокам
+    # и векторы счётчиков по id карт. Агрегаты складываются (merge) в любом порядке шардов,
+    # сериализуются в JSON (to_dict/from_dict) и дают поля ответа /api/simulate (finalize)
+    def __init__(self, config=None, card_names=None):
+        config = config or {}
+        if card_names is None:
+            card_names = get_catalog().card_names
+        self.card_names = tuple(card_names)
+        self.card_index = {name: i for i, name in enumerate(self.card_names)}
+        size = len(self.card_names)
+        self.hp = (config.get('hp1', 40), config.get('hp2', 50))
+        self.totals = np.zeros(len(GAME_FIELDS), dtype=np.int64)
+        self.player = np.zeros((2, len(PLAYER_FIELDS)), dtype=np.int64)
+        self.cards = np.zeros((len(CARD_FIELDS), size), dtype=np.int64)
+        self.gear = np.zeros((2, len(GEAR_STAT_KEYS), size), dtype=np.int64)
+        self.priestess = np.zeros((2, len(PRIESTESS_FIELDS)), dtype=np.int64)
+        # PhaseProfile шардов при config['profile']; в кэш результатов не попадает
+        self.profile = None
+        enabled = config.get('enabled_cards')
+        enabled = None if enabled is None else set(name.strip().lower() for name in enabled)
+        starter_names = set(card['name'] for card in get_catalog().starter_cards)
+        strategies = (config.get('user_strategy1'), config.get('user_strategy2'))
+        self.allowed = np.array([[self._allowed(name, enabled, starter_names, strat) for name in self.card_names]
+                                 for strat in strategies], dtype=np.int64).reshape(2, size)
+
+    # Карта учитывается в статистике, если это не стартовая карта, она включена в прогон
+    # и не отключена в пользовательской стратегии
+    @staticmethod
+    def _allowed(name, enabled, starter_names, strat):
+        if name in starter_names:
+            return False
+        key = name.strip().lower()
+        if enabled is not None and key not in enabled:
+            return False
+        if strat and 'cards' in strat:
+            for color, arr in strat['cards'].items():
+                match = next((obj for obj in arr if obj['name'].strip().lower() == key), None)
+                if match is not None:
+                    return match.get('enabled', True)
+        return True
+
+    @property
+    def games(self):
+        return int(self.totals[_G['games']])
+
+    @property
+    def turns(self):
+        return int(self.totals[_G['turns']])
+
+    @property
+    def turns_sq(self):
+        return int(self.totals[_G['turns_sq']])
+
+    @property
+    def wins(self):
+        return int(self.player[0, _P['wins']]), int(self.player[1, _P['wins']])
+
+    def add_game(self, summary):
+        players = summary['players']
+        turns = summary['turns']
+        totals, player, cards = self.totals, self.player, self.cards
+        totals[_G['games']] += 1
+        totals[_G['turns']] += turns
+        totals[_G['turns_sq']] += turns * turns
+        for idx, ps in enumerate(players):
+            player[idx, :PLAYER_SUMMARY_FIELDS] += ps['scalars']
+            player[1 - idx, _P['damage']] += self.hp[idx] - ps['health']
+            cards[_C['card_value']] += ps['cards'] * self.allowed[idx]
+            cards[_C['trashed']] += ps['trash'] * self.allowed[idx]
+            cards[_C['gear_absorbed']] += ps['absorbed']
+            cards[_C['gear_seen']] += ps['gear_seen']
+            self.priestess[idx] = ps['priestess']
+        winner_idx = {'P1': 0, 'P2': 1}.get(summary['winner'])
+        if winner_idx is not None:
+            winner, loser = players[winner_idx], players[1 - winner_idx]
+            player[winner_idx, _P['wins']] += 1
+            if loser['poison'] >= 20:
+                player[winner_idx, _P['poison_wins']] += 1
+            # Как и раньше: победитель фильтруется по стратегии P1, проигравший — по стратегии P2
+            cards[_C['winner_cards']] += winner['cards'] * self.allowed[0]
+            cards[_C['loser_cards']] += loser['cards'] * self.allowed[1]
+            totals[_G['decided']] += 1
+            totals[_G['winner_hp']] += winner['health']
+            totals[_G['winner_poison']] += winner['poison']
+            totals[_G['hp_diff']] += winner['health'] - loser['health']
+        self.gear += summary['gear_stats']
+
+    # Слияние частичных агрегатов (шардов, кусков кэша); Priestess берётся из более поздней части
+    def merge(self, other):
+        if other.card_names != self.card_names:
+            raise ValueError("Нельзя сложить статистику разных каталогов")
+        self.totals += other.totals
+        self.player += other.player
+        self.cards += other.cards
+        self.gear += other.gear
+        if other.games:
+            self.priestess[:] = other.priestess
+        if other.profile is not None:
+            if self.profile is None:
+                self.profile = PhaseProfile()
+            self.profile.merge(other.profile)
+        return self
+
+    def to_dict(self):
+        return {
+            'card_names': list(self.card_names),
+            'totals': dict(zip(GAME_FIELDS, self.totals.tolist())),
+            'player': {name: self.player[:, i].tolist() for i, name in enumerate(PLAYER_FIELDS)},
+            'cards': {name: self.cards[i].tolist() for i, name in enumerate(CARD_FIELDS)},
+            'gear': {key: self.gear[:, k].tolist() for k, key in enumerate(GEAR_STAT_KEYS)},
+            'priestess': {name: self.priestess[:, i].tolist() for i, name in enumerate(PRIESTESS_FIELDS)},
+        }
+
+    @classmethod
+    def from_dict(cls, data, config=None):
+        agg = cls(config, card_names=data['card_names'])
+        agg.totals[:] = [data['totals'][name] for name in GAME_FIELDS]
+        for i, name in enumerate(PLAYER_FIELDS):
+            agg.player[:, i] = data['player'][name]
+        for i, name in enumerate(CARD_FIELDS):
+            agg.cards[i] = data['cards'][name]
+        for k, key in enumerate(GEAR_STAT_KEYS):
+            agg.gear[:, k] = data['gear'][key]
+        for i, name in enumerate(PRIESTESS_FIELDS):
+            agg.priestess[:, i] = data['priestess'][name]
+        return agg
+
+    def _ranked(self, values, limit=None, present=None):
+        # (имя, значение) по убыванию значения; при равенстве — в порядке каталога
+        ids = np.flatnonzero(values if present is None else present)
+        ids = sorted(ids, key=lambda i: -values[i])[:limit]
+        return [(self.card_names[i], int(values[i])) for i in ids]
+
+    # Лёгкий срез для потоковой выдачи: проценты побед, ходы и текущий топ карт
+    def progress(self, total):
+        n = self.games
+        wins = self.wins
+        return {
+            'games': n,
+            'total': total,
+            'P1_win_percent': round(100 * wins[0] / n, 2) if n else 0,
+            'P2_win_percent': round(100 * wins[1] / n, 2) if n else 0,
+            'avg_turns': round(self.turns / n, 2) if n else 0,
+            'top_cards': self._ranked(self.cards[_C['card_value']], 10),
+        }
+
+    def finalize(self):
+        n = self.games
+        totals = dict(zip(GAME_FIELDS, self.totals.tolist()))
+        p1 = dict(zip(PLAYER_FIELDS, self.player[0].tolist()))
+        p2 = dict(zip(PLAYER_FIELDS, self.player[1].tolist()))
+        decided = totals['decided']
+        def avg(total, count=n):
+            return round(total / count, 2) if count else 0
+        stats = {
+            'P1_win': p1['wins'],
+            'P2_win': p2['wins'],
+            'P1_win_percent': round(100 * p1['wins'] / n, 2) if n else 0,
+            'P2_win_percent': round(100 * p2['wins'] / n, 2) if n else 0,
+            'avg_turns': avg(totals['turns']),
+            'avg_hp1': avg(p1['hp_end']),
+            'avg_hp2': avg(p2['hp_end']),
+            'avg_poison1': avg(p1['poison_end']),
+            'avg_poison2': avg(p2['poison_end']),
+            'avg_bleed1': avg(p1['bleed_end']),
+            'avg_bleed2': avg(p2['bleed_end']),
+            'avg_damage': avg(p1['damage'] + p2['damage']),
+            'avg_damage1': avg(p1['damage']),
+            'avg_damage2': avg(p2['damage']),
+            'gear_saved_damage': [avg(p1['gear_saved_damage']), avg(p2['gear_saved_damage'])],
+            'gear_saved_damage_total': [p1['gear_saved_damage'], p2['gear_saved_damage']],
+            'trashed_cards': self._ranked(self.cards[_C['trashed']]),
+            'top_cards': self._ranked(self.cards[_C['card_value']], 10),
+            'gear_absorbed': self._ranked(self.cards[_C['gear_absorbed']], present=self.cards[_C['gear_seen']]),
+            'top_winner_cards': self._ranked(self.cards[_C['winner_cards']], 10),
+            'top_loser_cards': self._ranked(self.cards[_C['loser_cards']], 10),
+            'avg_winner_hp': avg(totals['winner_hp'], decided),
+            'avg_winner_poison': avg(totals['winner_poison'], decided),
+            'avg_hp_diff': avg(totals['hp_diff'], decided),
+            'spy_discarded': [p1['spy_discarded'], p2['spy_discarded']],
+            'gear_destroyed': [p1['gear_destroyed'], p2['gear_destroyed']],
+            'poison_win1': p1['poison_wins'],
+            'poison_win2': p2['poison_wins'],
+            # Priestess — по последней сыгранной партии
+            'priestess_stats1': dict(zip(PRIESTESS_FIELDS, self.priestess[0].tolist())),
+            'priestess_stats2': dict(zip(PRIESTESS_FIELDS, self.priestess[1].tolist())),
+        }
+        for key in GAME_METRICS:
+            stats['avg_' + key + '1'] = avg(p1[key])
+            stats['avg_' + key + '2'] = avg(p2[key])
+        for k, key in enumerate(GEAR_STAT_KEYS):
+            for idx in (0, 1):
+                values = self.gear[idx, k]
+                stats['gear_' + key + str(idx + 1)] = {self.card_names[i]: int(values[i]) for i in np.flatnonzero(values)}
+        if self.profile is not None:
+            stats['profile'] = self.profile.report()
+        return stats
+
+# --- Строки партий для построчной выгрузки (game_export.GameExportWriter) ---
+EXPORT_PLAYER_FIELDS = PLAYER_FIELDS[:PLAYER_SUMMARY_FIELDS] + tuple('gear_cards_' + key for key in GEAR_STAT_KEYS)
+EXPORT_WINNER_CODES = {'P1': 1, 'P2': 2}
+
+class GameRows:
+    # Колонки выгрузки для партий одного шарда: скаляры партии и игроков плюс покупки по картам.
+    # Купленные карты — все карты игрока (колода, рука, сброс, gear на столе, трэш), кроме
+    # стартовой колоды
+    def __init__(self, seed):
+        catalog = get_catalog()
+        starters = set(ctype.name for ctype in catalog.starting_deck)
+        self.seed = seed
+        self.index, self.size = catalog.card_index, len(catalog.card_names)
+        self.bought_names = [name for name in catalog.card_names if name not in starters]
+        self.bought_ids = np.array([self.index[name] for name in self.bought_names], dtype=np.intp)
+        self.rows = []
+        self.bought = []
+
+    def add(self, i, res, summary):
+        row = [i, EXPORT_WINNER_CODES.get(res['winner'], 0), res['turns']]
+        bought = []
+        for idx, ps in enumerate(summary['players']):
+            row += ps['scalars']
+            row += summary['gear_stats'][idx].sum(axis=1).tolist()
+            on_table = _card_counts(res['player' + str(idx + 1)].gear, self.index, self.size)
+            bought.append((ps['cards'] + ps['trash'] + on_table)[self.bought_ids])
+        self.rows.append(row)
+        self.bought.append(bought)
+
+    def columns(self):
+        n_fields = len(EXPORT_PLAYER_FIELDS)
+        rows = np.array(self.rows, dtype=np.int64).reshape(-1, 3 + 2 * n_fields)
+        bought = np.array(self.bought, dtype=np.int32).reshape(-1, 2, len(self.bought_names))
+        columns = {
+            'game': rows[:, 0],
+            'seed': np.array([game_seed(self.seed, i) for i in rows[:, 0]], dtype=str),
+            'winner': rows[:, 1].astype(np.int8),
+            'turns': rows[:, 2].astype(np.int32),
+        }
+        for idx in (0, 1):
+            for k, field in enumerate(EXPORT_PLAYER_FIELDS):
+                columns[f'p{idx + 1}_{field}'] = rows[:, 3 + idx * n_fields + k].astype(np.int32)
+        for idx in (0, 1):
+            for k, name in enumerate(self.bought_names):
+                columns[f'p{idx + 1}_bought_{name}'] = bought[:, idx, k]
+        return columns
+
+def prepare_run(config):
+    # Каталог и опции лога прогона — в состояние текущего потока (RUN); другие потоки
+    # и процессы пула получают их явно (ShardPool)
+    if config.get('cards') is not None:
+        load_catalog(config['cards'], config.get('starters', get_catalog().starter_cards))
+    if 'log_options' in config:
+        RUN.log_options = frozenset(config['log_options'] or [])
+
+def run_config_game(config, collect_log=False, seed=None, collect_replay=False, profile=None):
+    return simulate_game(
+        config.get('strategy1', 'red'), config.get('strategy2', 'poison'),
+        log=False, max_turns=config.get('max_turns', 30), trade_row_size=config.get('trade_row_size', 5),
+        custom_hp=(config.get('hp1', 40), config.get('hp2', 50)),
+        collect_log=collect_log, collect_replay=collect_replay,
+        user_strategy1=config.get('user_strategy1'), user_strategy2=config.get('user_strategy2'),
+        log_options=config.get('log_options'), seed=seed, profile=profile,
+        rng_streams=config.get('rng_streams', False))
+
+
+# --- Параллельный прогон: шарды фиксированного размера в пуле процессов ---
+# Партия с номером i всегда играется с game_seed(seed, i), шарды — это просто диапазоны
+# номеров партий, а частичные агрегаты сливаются в порядке шардов.
+# Поэтому результат для данного seed одинаков при любом workers
+SHARD_GAMES = 250
+
+def default_workers():
+    return os.cpu_count() or 1
+
+def plan_shards(start, end):
+    return [(i, min(i + SHARD_GAMES, end)) for i in range(start, end, SHARD_GAMES)]
+
+def _init_worker(main_cards, starter_cards, log_options):
+    load_catalog(main_cards, starter_cards)
+    RUN.log_options = frozenset(log_options)
+
+class ShardPool:
+    # Пул процессов на один прогон верхнего уровня (турнир, подбор стратегии, прогон до точности...):
+    # все его вызовы iter_shards играют в одних и тех же процессах. Каталог и опции лога берутся
+    # при создании и уходят в процессы один раз (initializer); сами процессы поднимаются при первом
+    # шарде, так что прогон, целиком взятый из кэша, пул не создаёт
+    def __init__(self, workers=None):
+        self.workers = workers or default_workers()
+        catalog = get_catalog()
+        self.init_args = (catalog.main_cards, catalog.starter_cards, tuple(RUN.log_options))
+        self.executor = None
+    def submit(self, task):
+        if self.executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                initargs=self.init_args)
+        return self.executor.submit(_run_shard, task)
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        self.close()
+
+def run_shard(config, seed, start, end, rows=False):
+    # -> (агрегат шарда, колонки GameRows или None); config['catalog_changes'] — шард играется
+    # на варианте каталога потока (variant_catalog), после шарда каталог возвращается
+    changes = config.get('catalog_changes')
+    if changes:
+        base = get_catalog()
+        use_catalog(variant_catalog(base, changes))
+        try:
+            return _play_shard(config, seed, start, end, rows)
+        finally:
+            use_catalog(base)
+    return _play_shard(config, seed, start, end, rows)
+
+def _play_shard(config, seed, start, end, rows):
+    agg = SimAggregate(config)
+    table = GameRows(seed) if rows else None
+    profile = agg.profile = PhaseProfile() if config.get('profile') else None
+    with log_run(silent=config.get('silent', True)):
+        for i in range(start, end):
+            res = run_config_game(config, seed=game_seed(seed, i), profile=profile)
+            summary = summarize_game(res)
+            agg.add_game(summary)
+            if table is not None:
+                table.add(i, res, summary)
+    return agg, None if table is None else table.columns()
+
+def _run_shard(task):
+    return run_shard(*task)
+
+def iter_shards(configs, n_games, seed, workers=None, start=0, export=None, pool=None):
+    # Отдаёт (индекс конфига, агрегат шарда) в порядке шардов по мере готовности.
+    # Партии с номерами [start, n_games) для каждого конфига; задача шарда — (конфиг, seed,
+    # диапазон партий). pool — ShardPool прогона верхнего уровня; без него пул создаётся
+    # на этот вызов. С export строки партий каждого шарда уходят в export.write до того,
+    # как шард отдан вызывающему
+    configs = [dict((k, v) for k, v in config.items() if k not in ('cards', 'starters')) for config in configs]
+    rows = export is not None
+    tasks = [(idx, (configs[idx], seed, lo, hi, rows)) for idx in range(len(configs))
+             for lo, hi in plan_shards(start, n_games)]
+    if pool is None and min(workers or default_workers(), len(tasks)) > 1:
+        with ShardPool(workers) as pool:
+            yield from iter_shards(configs, n_games, seed, start=start, export=export, pool=pool)
+        return
+    if pool is not None and min(pool.workers, len(tasks)) > 1:
+        futures = [(idx, pool.submit(task)) for idx, task in tasks]
+        try:
+            for idx, future in futures:
+                agg, columns = future.result()
+                if columns is not None:
+                    export.write(columns)
+                yield idx, agg
+        finally:
+            # Прерванный прогон (например, клиент закрыл поток) не доигрывает оставшиеся шарды
+            for idx, future in futures:
+                future.cancel()
+    else:
+        for idx, task in tasks:
+            agg, columns = run_shard(*task)
+            if columns is not None:
+                export.write(columns)
+            yield idx, agg
+
+def run_parallel(configs, n_games, seed=None, workers=None, start=0, export=None, pool=None):
+    if seed is None:
+        seed = random.getrandbits(64)
+    aggregates = [SimAggregate(config) for config in configs]
+    for idx, agg in iter_shards(configs, n_games, seed, workers=workers, start=start, export=export, pool=pool):
+        aggregates[idx].merge(agg)
+    return aggregates
+
+
+# --- Кэш результатов: агрегаты по диапазонам номеров партий ---
+# Ключ — хэш всего, от чего зависит исход партий при данном seed. Значение — список
+# кусков (start, end, SimAggregate), покрывающих партии [0, end) подряд.
+# RESULT_CACHE_VERSION нужно поднимать при изменениях движка, меняющих исходы партий
+RESULT_CACHE_VERSION = 5
+RESULT_CACHE_DIR = os.environ.get('COB_RESULT_CACHE', '.sim_cache')
+
+def result_cache_key(config, seed):
+    enabled = config.get('enabled_cards')
+    payload = {
+        'version': RESULT_CACHE_VERSION,
+        'catalog': get_catalog().version,
+        'seed': str(seed),
+        'strategy1': config.get('strategy1', 'red'),
+        'strategy2': config.get('strategy2', 'poison'),
+        'user_strategy1': config.get('user_strategy1'),
+        'user_strategy2': config.get('user_strategy2'),
+        'enabled_cards': None if enabled is None else sorted(name.strip().lower() for name in enabled),
+        'hp1': config.get('hp1', 40),
+        'hp2': config.get('hp2', 50),
+        'max_turns': config.get('max_turns', 30),
+        'trade_row_size': config.get('trade_row_size', 5),
     }
+    if config.get('rng_streams'):
+        payload['rng_streams'] = True
+    if config.get('catalog_changes'):
+        payload['catalog_changes'] = config['catalog_changes']
+    content = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+class ResultCache:
+    # LRU в памяти поверх JSON-файлов на диске (path=None — только память).
+    # Куски хранятся как (start, end, SimAggregate.to_dict()). Общий для потоков процесса:
+    # load и store идут под lock
+    def __init__(self, path=RESULT_CACHE_DIR, max_entries=128):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+    def _file(self, key):
+        return os.path.join(self.path, key + '.json')
+    def _remember(self, key, chunks):
+        self.entries[key] = chunks
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    def load(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            chunks = []
+            if self.path and os.path.exists(self._file(key)):
+                try:
+                    with open(self._file(key), encoding='utf-8') as f:
+                        chunks = [(start, end, SimAggregate.from_dict(part)) for start, end, part in json.load(f)]
+                except (OSError, ValueError, KeyError, TypeError):
+                    chunks = []
+            self._remember(key, chunks)
+            return chunks
+    def store(self, key, chunks):
+        with self.lock:
+            self._remember(key, chunks)
+            if not self.path:
+                return
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                tmp = self._file(key) + '.tmp'
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump([(start, end, part.to_dict()) for start, end, part in chunks], f)
+                os.replace(tmp, self._file(key))
+            except OSError as e:
+                print(f"[CACHE] Не удалось сохранить {key}: {e}")
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+RESULT_CACHE = ResultCache()
+
+def resolve_cache(cache, seed):
+    # cache: True — общий RESULT_CACHE, False — без кэша, либо свой ResultCache.
+    # Без seed кэшировать нечего: каждый прогон — новая выборка
+    if seed is None or not cache:
+        return None
+    return cache if isinstance(cache, ResultCache) else RESULT_CACHE
+
+def iter_aggregate(config, n_games, seed, workers=None, cache=None, export=None, pool=None):
+    # Накопительный агрегат: сначала после кэшированных партий [0, covered), затем после
+    # каждого доигранного шарда. Новый кусок попадает в кэш, только если прогон дошёл до конца.
+    # Выгрузке нужны строки всех партий, а профилю — замеры всех партий, поэтому
+    # с export или config['profile'] кэш не используется
+    if export is not None or config.get('profile'):
+        cache = None
+    agg = SimAggregate(config)
+    chunks = []
+    covered = 0
+    if cache is not None:
+        key = result_cache_key(config, seed)
+        chunks = cache.load(key)
+        for start, end, part in chunks:
+            if end > n_games:
+                break
+            agg.merge(part)
+            covered = end
+    yield agg
+    if covered >= n_games:
+        return
+    new = SimAggregate(config)
+    for idx, part in iter_shards([config], n_games, seed, workers=workers, start=covered, export=export, pool=pool):
+        new.merge(part)
+        agg.merge(part)
+        yield agg
+    if cache is not None and (not chunks or chunks[-1][1] == covered):
+        cache.store(key, chunks + [(covered, n_games, new)])
+
+def cached_aggregate(config, n_games, seed, workers=None, cache=None, pool=None):
+    # Берёт из кэша уже сыгранные партии [0, covered) и доигрывает только [covered, n_games)
+    for agg in iter_aggregate(config, n_games, seed, workers=workers, cache=cache or RESULT_CACHE, pool=pool):
+        pass
+    return agg
+
+def simulate_many(config, n_games, seed=None, workers=None, cache=True, export=None):
+    # С заданным seed результат воспроизводим и кэшируется; без seed — каждый раз новая выборка.
+    # export — GameExportWriter: строки всех партий пишутся в него по мере прогона
+    prepare_run(config)
+    cache = resolve_cache(cache, seed)
+    if seed is None:
+        seed = random.getrandbits(64)
+    for agg in iter_aggregate(config, n_games, seed, workers=workers, cache=cache, export=export):
+        pass
+    return agg.finalize()
+
+def simulate_stream(config, n_games, seed=None, workers=None, cache=True, every_games=None, every_ms=500,
+                    export=None):
+    # Поток для /api/simulate?stream: промежуточные срезы не чаще чем раз в every_ms
+    # или every_games партий (что наступит раньше), в конце — полная статистика
+    prepare_run(config)
+    cache = resolve_cache(cache, seed)
+    if seed is None:
+        seed = random.getrandbits(64)
+    last_games = 0
+    last_time = time.monotonic()
+    for agg in iter_aggregate(config, n_games, seed, workers=workers, cache=cache, export=export):
+        now = time.monotonic()
+        due = (now - last_time) * 1000 >= every_ms or (every_games and agg.games - last_games >= every_games)
+        if due and 0 < agg.games < n_games:
+            last_games, last_time = agg.games, now
+            yield {'type': 'progress', **agg.progress(n_games)}
+    yield {'type': 'result', 'stats': agg.finalize()}
+
+
+# --- Прогон до заданной точности вместо фиксированного числа партий ---
+# Ширины интервалов — в тех же единицах, что и статистика: процентные пункты для
+# P1_win_percent (интервал Уилсона) и ходы для avg_turns (нормальное приближение)
+def win_rate_interval(wins, n, confidence=0.95):
+    if not n:
+        return 0.0, 100.0
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    p = wins / n
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return 100 * max(0.0, center - half), 100 * min(1.0, center + half)
+
+def mean_interval(total, total_sq, n, confidence=0.95):
+    if n < 2:
+        return float('-inf'), float('inf')
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    mean = total / n
+    var = max(0.0, (total_sq - n * mean * mean) / (n - 1))
+    half = z * math.sqrt(var / n)
+    return mean - half, mean + half
+
+def precision_report(agg, win_ci_width, turns_ci_width=None, confidence=0.95):
+    win_lo, win_hi = win_rate_interval(agg.wins[0], agg.games, confidence)
+    turns_lo, turns_hi = mean_interval(agg.turns, agg.turns_sq, agg.games, confidence)
+    reached = win_hi - win_lo <= win_ci_width
+    if turns_ci_width is not None:
+        reached = reached and turns_hi - turns_lo <= turns_ci_width
+    return {
+        'games': agg.games,
+        'confidence': confidence,
+        'P1_win_percent_ci': [round(win_lo, 2), round(win_hi, 2)],
+        'P1_win_percent_ci_width': round(win_hi - win_lo, 2),
+        'avg_turns_ci': [round(turns_lo, 2), round(turns_hi, 2)] if agg.games > 1 else None,
+        'avg_turns_ci_width': round(turns_hi - turns_lo, 2) if agg.games > 1 else None,
+        'target_ci_width': win_ci_width,
+        'target_turns_ci_width': turns_ci_width,
+        'reached': reached,
+    }
+
+def simulate_to_precision(config, win_ci_width, turns_ci_width=None, max_games=100000, batch=1000,
+                          confidence=0.95, seed=None, workers=None, cache=True, progress=None, export=None):
+    # Играет пачками; после каждой оценивает, сколько партий нужно до цели (ширина ~ 1/sqrt(n)),
+    # и доигрывает до этой оценки, но не больше max_games. progress(report) — после каждой пачки
+    prepare_run(config)
+    cache = resolve_cache(cache, seed)
+    if seed is None:
+        seed = random.getrandbits(64)
+    with ShardPool(workers) as pool:
+        return _simulate_to_precision(config, win_ci_width, turns_ci_width, max_games, batch, confidence,
+                                      seed, cache, progress, export, pool)
+
+def _simulate_to_precision(config, win_ci_width, turns_ci_width, max_games, batch, confidence, seed, cache,
+                           progress, export, pool):
+    agg = SimAggregate(config)
+    while True:
+        report = precision_report(agg, win_ci_width, turns_ci_width, confidence)
+        if report['reached'] or agg.games >= max_games:
+            break
+        if progress is not None and agg.games:
+            progress(report)
+        target = agg.games + batch
+        if agg.games:
+            ratio = report['P1_win_percent_ci_width'] / win_ci_width
+            if turns_ci_width is not None and report['avg_turns_ci_width']:
+                ratio = max(ratio, report['avg_turns_ci_width'] / turns_ci_width)
+            target = max(target, math.ceil(agg.games * ratio * ratio * 1.05))
+        target = min(max_games, -(-target // SHARD_GAMES) * SHARD_GAMES)
+        if cache is not None and export is None and not config.get('profile'):
+            agg = cached_aggregate(config, target, seed, cache=cache, pool=pool)
+        else:
+            agg.merge(run_parallel([config], target, seed=seed, start=agg.games, export=export, pool=pool)[0])
+    stats = agg.finalize()
+    stats['precision'] = report
+    return stats
+
+
+# --- Парное сравнение двух вариантов (общие случайные числа) ---
+# Варианты A и B играют на одном месте против одного соперника на одних и тех же seed партий
+# в режиме rng_streams, так что стартовые колоды, порядок колоды рынка и тасовки соперника
+# совпадают, пока решения вариантов не развели партии. Разница метрик считается по парам
+# партий: шум, общий для пары, сокращается, и интервал уже, чем у двух независимых прогонов
+PAIRED_METRICS = ('score', 'turns', 'hp_end', 'opponent_hp_end', 'damage_dealt', 'poison_dealt')
+
+def paired_config(config, variant, seat):
+    # variant — имя паттерна или user_strategy; seat — место варианта (1 или 2)
+    config = dict(config, rng_streams=True)
+    if isinstance(variant, str):
+        config[f'strategy{seat}'] = variant
+        config[f'user_strategy{seat}'] = None
+    else:
+        config[f'user_strategy{seat}'] = variant
+    return config
+
+class PairedColumns:
+    # Приёмник колонок GameRows (как export в iter_shards): метрики варианта по номерам партий
+    def __init__(self, seat):
+        self.me = f'p{seat}_'
+        self.opp = f'p{3 - seat}_'
+        self.seat = seat
+        self.parts = []
+
+    def write(self, columns):
+        winner = columns['winner']
+        self.parts.append({
+            'game': columns['game'],
+            'score': np.where(winner == self.seat, 100.0, np.where(winner == 0, 50.0, 0.0)),
+            'turns': columns['turns'],
+            'hp_end': columns[self.me + 'hp_end'],
+            'opponent_hp_end': columns[self.opp + 'hp_end'],
+            'damage_dealt': columns[self.me + 'damage_dealt'],
+            'poison_dealt': columns[self.me + 'poison_dealt'],
+        })
+
+    def values(self):
+        game = np.concatenate([part['game'] for part in self.parts])
+        order = np.argsort(game, kind='stable')
+        return {key: np.concatenate([part[key] for part in self.parts]).astype(np.float64)[order]
+                for key in PAIRED_METRICS}
+
+def paired_report(a, b, confidence=0.95):
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    n = len(a['score'])
+    metrics = {}
+    for key in PAIRED_METRICS:
+        diff = a[key] - b[key]
+        mean = float(diff.mean()) if n else 0.0
+        if n > 1:
+            half = z * math.sqrt(float(diff.var(ddof=1)) / n)
+            # Ширина интервала, если бы A и B играли на независимых seed
+            unpaired = 2 * z * math.sqrt((float(a[key].var(ddof=1)) + float(b[key].var(ddof=1))) / n)
+        else:
+            half = unpaired = float('inf')
+        metrics[key] = {
+            'a': round(float(a[key].mean()), 3) if n else 0,
+            'b': round(float(b[key].mean()), 3) if n else 0,
+            'diff': round(mean, 3),
+            'diff_ci': [round(mean - half, 3), round(mean + half, 3)] if n > 1 else None,
+            'ci_width': round(2 * half, 3) if n > 1 else None,
+            'unpaired_ci_width': round(unpaired, 3) if n > 1 else None,
+            # Во сколько раз больше партий нужно независимым прогонам для той же точности
+            'games_ratio': round((unpaired / (2 * half)) ** 2, 2) if n > 1 and half > 0 else None,
+        }
+    return {
+        'games': n,
+        'confidence': confidence,
+        'same_outcome': int((a['score'] == b['score']).sum()),
+        'metrics': metrics,
+    }
+
+def compare_paired(config, variant_a, variant_b, seat=1, n_games=1000, target_ci_width=None, max_games=100000,
+                   batch=1000, confidence=0.95, seed=None, workers=None, progress=None):
+    # Фиксированное n_games или, если задан target_ci_width, доигрывание пачками до ширины
+    # интервала разницы score (в процентных пунктах) не больше target_ci_width
+    prepare_run(config)
+    if seed is None:
+        seed = random.getrandbits(64)
+    configs = [paired_config(config, variant_a, seat), paired_config(config, variant_b, seat)]
+    sinks = [PairedColumns(seat), PairedColumns(seat)]
+    games = 0
+    target = n_games if target_ci_width is None else min(max_games, batch)
+    # A и B играют на одном пуле процессов
+    with ShardPool(workers) as pool:
+        while True:
+            if target_ci_width is not None:
+                target = min(max_games, -(-target // SHARD_GAMES) * SHARD_GAMES)
+            for cfg, sink in zip(configs, sinks):
+                run_parallel([cfg], target, seed=seed, start=games, export=sink, pool=pool)
+            games = target
+            report = paired_report(sinks[0].values(), sinks[1].values(), confidence)
+            if target_ci_width is None:
+                break
+            width = report['metrics']['score']['ci_width']
+            reached = width is not None and width <= target_ci_width
+            report['target_ci_width'] = target_ci_width
+            report['reached'] = reached
+            if reached or games >= max_games:
+                break
+            if progress is not None:
+                progress(report)
+            ratio = width / target_ci_width if width and math.isfinite(width) else 2
+            target = max(games + batch, math.ceil(games * ratio * ratio * 1.05))
+    report['seat'] = seat
+    report['seed'] = seed
+    return report
 
 
 # --- Массовый анализ ---
-def run_tournament(patterns, num_games=100, max_turns=30):
+def run_tournament(patterns, num_games=100, max_turns=30, seed=None, workers=None):
+    pairs = [(pat1, pat2) for pat1 in patterns for pat2 in patterns]
+    # hp не задаются — как у Player по умолчанию
+    configs = [{'strategy1': pat1, 'strategy2': pat2, 'max_turns': max_turns, 'hp1': 50, 'hp2': 50}
+               for pat1, pat2 in pairs]
+    aggregates = run_parallel(configs, num_games, seed=seed, workers=workers)
     results = {}
-    for pat1 in patterns:
-        for pat2 in patterns:
-            win1 = win2 = 0
-            turns_list = []
-            for _ in range(num_games):
-                res = simulate_game(pat1, pat2, log=False, max_turns=max_turns)
-                turns_list.append(res['turns'])
-                if res['winner'] == 'P1':
-                    win1 += 1
-                elif res['winner'] == 'P2':
-                    win2 += 1
-            avg_turns = sum(turns_list) / len(turns_list)
-            results[(pat1, pat2)] = {
-                'win1': win1, 'win2': win2, 'avg_turns': avg_turns
-            }
+    for pair, agg in zip(pairs, aggregates):
+        results[pair] = {
+            'win1': agg.wins[0], 'win2': agg.wins[1], 'avg_turns': agg.turns / agg.games if agg.games else 0
+        }
     print("\n=== Сравнение стратегий ===")
     for (pat1, pat2), res in results.items():
         print(f"{pat1} vs {pat2}: P1 win {res['win1']}, P2 win {res['win2']}, Avg Turns: {res['avg_turns']:.1f}")
+    return results
 
-    # detailed_log только для одной игры
-    if num_games == 1:
-        results['detailed_log'] = res.get('detailed_log')
-        # Добавляем итоговые колоды игроков
-        from collections import Counter
-        def deck_summary(player):
-            all_cards = [c.name for c in (player.deck + player.hand + player.discard)]
-            return dict(Counter(all_cards))
-        results['final_decks'] = {
-            'P1': deck_summary(res['player1']),
-            'P2': deck_summary(res['player2'])
-        }
+# --- Адаптивный турнир: швейцарская система + рейтинг Глико ---
+# Вместо всех пар × num_games каждый раунд сводит участников с близким рейтингом
+# (повторные встречи штрафуются), играет короткий матч на обоих местах и обновляет
+# рейтинг с неопределённостью (RD). Турнир останавливается, когда порядок мест
+# не меняется stable_rounds раундов подряд
+GLICKO_Q = math.log(10) / 400
+
+def tournament_entrants(entrants):
+    # Участник — имя встроенного паттерна ('red', 'poison', ...) или JSON user_strategy
+    result = []
+    names = set()
+    for i, entrant in enumerate(entrants):
+        if isinstance(entrant, str):
+            name, pattern, user_strategy = entrant, entrant, None
+        else:
+            name, pattern, user_strategy = entrant.get('name') or f"user{i + 1}", None, entrant
+        while name in names:
+            name = f"{name}#{i + 1}"
+        names.add(name)
+        result.append({'name': name, 'pattern': pattern, 'user_strategy': user_strategy})
+    return result
+
+def _glicko_g(rd):
+    return 1 / math.sqrt(1 + 3 * (GLICKO_Q * rd / math.pi) ** 2)
+
+def _glicko_expected(r, rj, rdj):
+    return 1 / (1 + 10 ** (-_glicko_g(rdj) * (r - rj) / 400))
+
+def glicko_update(player, results):
+    # results: [(соперник, число партий, сумма очков)] за раунд; соперники — в состоянии до раунда
+    if not results:
+        return player['rating'], player['rd']
+    delta_sum = 0
+    var_sum = 0
+    for opp, n, score in results:
+        g = _glicko_g(opp['rd'])
+        e = _glicko_expected(player['rating'], opp['rating'], opp['rd'])
+        delta_sum += g * (score - n * e)
+        var_sum += n * g * g * e * (1 - e)
+    d2_inv = GLICKO_Q * GLICKO_Q * var_sum
+    denom = 1 / player['rd'] ** 2 + d2_inv
+    return player['rating'] + GLICKO_Q / denom * delta_sum, math.sqrt(1 / denom)
+
+def swiss_pairs(players, played):
+    # Жадно: лидер свободных играет с ближайшим по рейтингу, повторная встреча = +100 к разнице
+    order = sorted(range(len(players)), key=lambda i: -players[i]['rating'])
+    pairs = []
+    free = list(order)
+    while len(free) > 1:
+        a = free.pop(0)
+        b = min(free, key=lambda j: abs(players[a]['rating'] - players[j]['rating'])
+                + 100 * played.get(frozenset((a, j)), 0))
+        free.remove(b)
+        pairs.append((a, b))
+    return pairs
+
+def _match_config(p1, p2, max_turns, hp):
+    return {'strategy1': p1['pattern'], 'strategy2': p2['pattern'],
+            'user_strategy1': p1['user_strategy'], 'user_strategy2': p2['user_strategy'],
+            'max_turns': max_turns, 'hp1': hp[0], 'hp2': hp[1]}
+
+def run_adaptive_tournament(entrants, games_per_match=100, max_rounds=20, stable_rounds=3, max_turns=30,
+                            hp=(50, 50), seed=None, workers=None, on_round=None):
+    players = tournament_entrants(entrants)
+    for p in players:
+        p.update(rating=1500.0, rd=350.0, games=0, wins=0, losses=0, draws=0)
+    if seed is None:
+        seed = random.getrandbits(64)
+    # Матрица только по реально сыгранным парам: matrix[a][b] — результаты a против b
+    matrix = defaultdict(dict)
+    played = {}
+    ranking = None
+    unchanged = 0
+    rounds = 0
+    half = max(1, games_per_match // 2)
+    # Один пул процессов на весь турнир: раунды играют в одних и тех же процессах
+    with ShardPool(workers) as pool:
+        for rounds in range(1, max_rounds + 1):
+            pairs = swiss_pairs(players, played)
+            if not pairs:
+                break
+            # Каждый матч — на обоих местах, чтобы не смещать рейтинг преимуществом первого хода
+            configs = []
+            for a, b in pairs:
+                configs.append(_match_config(players[a], players[b], max_turns, hp))
+                configs.append(_match_config(players[b], players[a], max_turns, hp))
+            aggregates = run_parallel(configs, half, seed=f"{seed}:{rounds}", pool=pool)
+            round_results = defaultdict(list)
+            before = [dict(p) for p in players]
+            for k, (a, b) in enumerate(pairs):
+                ab, ba = aggregates[2 * k], aggregates[2 * k + 1]
+                n = ab.games + ba.games
+                wins_a = ab.wins[0] + ba.wins[1]
+                wins_b = ab.wins[1] + ba.wins[0]
+                draws = n - wins_a - wins_b
+                round_results[a].append((before[b], n, wins_a + 0.5 * draws))
+                round_results[b].append((before[a], n, wins_b + 0.5 * draws))
+                played[frozenset((a, b))] = played.get(frozenset((a, b)), 0) + 1
+                for x, y, w, l in ((a, b, wins_a, wins_b), (b, a, wins_b, wins_a)):
+                    px = players[x]
+                    px['games'] += n
+                    px['wins'] += w
+                    px['losses'] += l
+                    px['draws'] += draws
+                    cell = matrix[px['name']].setdefault(players[y]['name'], {'games': 0, 'wins': 0, 'losses': 0, 'draws': 0})
+                    cell['games'] += n
+                    cell['wins'] += w
+                    cell['losses'] += l
+                    cell['draws'] += draws
+            for i, p in enumerate(players):
+                p['rating'], p['rd'] = glicko_update(before[i], round_results.get(i, []))
+            new_ranking = [p['name'] for p in sorted(players, key=lambda p: -p['rating'])]
+            unchanged = unchanged + 1 if new_ranking == ranking else 0
+            ranking = new_ranking
+            # Сначала отчёт о раунде: последний раунд турнира, остановленного по стабильности, тоже виден
+            if on_round is not None:
+                on_round(rounds, max_rounds)
+            if unchanged >= stable_rounds:
+                break
+    for row in matrix.values():
+        for cell in row.values():
+            cell['win_rate'] = round(cell['wins'] / cell['games'], 4) if cell['games'] else 0
+    table = [{'name': p['name'], 'rating': round(p['rating'], 1), 'rd': round(p['rd'], 1),
+              'games': p['games'], 'wins': p['wins'], 'losses': p['losses'], 'draws': p['draws']}
+             for p in sorted(players, key=lambda p: -p['rating'])]
+    return {'ratings': table, 'matrix': dict(matrix), 'rounds': rounds, 'stable': unchanged >= stable_rounds}
+
+# --- Подбор параметров user_strategy: successive halving ---
+# Кандидаты — варианты базовой стратегии: перестановки effect_priority по зонам, max_cost
+# из диапазона, значения флагов. Раунд 0 играет min_games партий на кандидата против каждого
+# соперника (поровну на обоих местах), после раунда остаётся лучшая 1/eta часть, и выжившие
+# доигрывают до бюджета в eta раз больше. Все кандидаты играют на одних и тех же seed партий,
+# а доигрывание продолжает номера партий, так что сыгранное не пропадает
+OPTIMIZE_FLAGS = ('priestess_buy_if_2', 'priestess_trash_after')
+
+def _zone_variants(effects, mode, samples, rng):
+    # -> [(описание, новый порядок)] для одной зоны
+    if mode == 'swaps':
+        return [(f"{effects[i]}<->{effects[j]}", effects[:i] + [effects[j]] + effects[i + 1:j] + [effects[i]] + effects[j + 1:])
+                for i in range(len(effects)) for j in range(i + 1, len(effects))]
+    if mode == 'permutations':
+        seen = {tuple(effects)}
+        variants = []
+        for _ in range(samples * 10):
+            if len(variants) >= samples:
+                break
+            order = list(effects)
+            rng.shuffle(order)
+            if tuple(order) not in seen:
+                seen.add(tuple(order))
+                variants.append((' > '.join(order), order))
+        return variants
+    return []
+
+def strategy_candidates(base, space=None, seed=None):
+    # space: zones — ключи зон effect_priority (по умолчанию все), priority — 'swaps' (все
+    # перестановки двух эффектов), 'permutations' (случайные порядки, permutations штук на зону)
+    # или None, max_cost — [lo, hi] или список значений, priestess_buy_if_2 / priestess_trash_after —
+    # списки значений, max_candidates — не больше стольких кандидатов (случайная выборка, база всегда)
+    space = space or {}
+    rng = random.Random(seed)
+    priority = base.get('effect_priority', [])
+    zones = space.get('zones') or (sorted(priority) if isinstance(priority, dict) else [None])
+    orders = [([], priority)]
+    for zone in zones:
+        effects = list(priority.get(str(zone), []) if isinstance(priority, dict) else priority)
+        for desc, order in _zone_variants(effects, space.get('priority', 'swaps'), int(space.get('permutations', 20)), rng):
+            if zone is None:
+                orders.append(([f"effect_priority: {desc}"], order))
+            else:
+                orders.append(([f"zone {zone}: {desc}"], dict(priority, **{str(zone): order})))
+    max_cost = space.get('max_cost')
+    if isinstance(max_cost, (list, tuple)) and len(max_cost) == 2 and max_cost[0] < max_cost[1] - 1:
+        max_cost = list(range(int(max_cost[0]), int(max_cost[1]) + 1))
+    settings = [[]]
+    for key, values in [('max_cost', max_cost)] + [(flag, space.get(flag)) for flag in OPTIMIZE_FLAGS]:
+        if values:
+            settings = [s + [(key, v)] for s in settings for v in values]
+    # Первым всегда идёт сама база: с ней сравниваются найденные варианты
+    combos = [([], priority, [])] + [(changes, order, s) for changes, order in orders for s in settings]
+    limit = int(space.get('max_candidates', 64))
+    if len(combos) > limit:
+        combos = combos[:1] + rng.sample(combos[1:], limit - 1)
+    candidates = []
+    seen = set()
+    for changes, order, s in combos:
+        strategy = dict(base, effect_priority=order)
+        changes = list(changes)
+        for key, value in s:
+            if base.get(key) != value:
+                changes.append(f"{key}={value}")
+            strategy[key] = value
+        digest = strategy_hash(strategy)
+        if digest in seen:
+            continue
+        seen.add(digest)
+        strategy['name'] = f"{base.get('name') or 'user'}#{len(candidates)}" if candidates else base.get('name') or 'user'
+        candidates.append({'name': strategy['name'], 'changes': changes, 'strategy': strategy})
+    return candidates
+
+def optimize_strategy(base, opponents, space=None, min_games=40, max_games=2000, eta=3, keep=3,
+                      max_turns=30, hp=(50, 50), confidence=0.95, seed=None, workers=None, on_round=None):
+    # -> лучшие keep кандидатов с очками (победа 1, ничья 0.5) и интервалом Уилсона, все кандидаты
+    # с раундом выбывания и число сыгранных партий против полного перебора с бюджетом max_games
+    if seed is None:
+        seed = random.getrandbits(64)
+    candidates = strategy_candidates(base, space, seed=seed)
+    opponents = tournament_entrants(opponents)
+    for c in candidates:
+        c.update(games=0, wins=0, losses=0, draws=0, eliminated=None)
+    alive = list(range(len(candidates)))
+    budget = max(2, min_games)
+    played = 0
+    total_games = 0
+    rounds = 0
+    with ShardPool(workers) as pool:
+        while True:
+            rounds += 1
+            half = max(1, budget // 2)
+            configs = []
+            for idx in alive:
+                me = {'pattern': None, 'user_strategy': candidates[idx]['strategy']}
+                for opp in opponents:
+                    configs.append(_match_config(me, opp, max_turns, hp))
+                    configs.append(_match_config(opp, me, max_turns, (hp[1], hp[0])))
+            aggregates = run_parallel(configs, half, seed=seed, start=played, pool=pool)
+            per_candidate = 2 * len(opponents)
+            for k, idx in enumerate(alive):
+                c = candidates[idx]
+                for j in range(len(opponents)):
+                    as_p1, as_p2 = aggregates[k * per_candidate + 2 * j], aggregates[k * per_candidate + 2 * j + 1]
+                    wins = as_p1.wins[0] + as_p2.wins[1]
+                    losses = as_p1.wins[1] + as_p2.wins[0]
+                    n = as_p1.games + as_p2.games
+                    c['games'] += n
+                    c['wins'] += wins
+                    c['losses'] += losses
+                    c['draws'] += n - wins - losses
+                    total_games += n
+            played = half
+            for idx in alive:
+                c = candidates[idx]
+                c['score'] = (c['wins'] + 0.5 * c['draws']) / c['games'] if c['games'] else 0
+                c['ci'] = win_rate_interval(c['wins'] + 0.5 * c['draws'], c['games'], confidence)
+            alive.sort(key=lambda i: -candidates[i]['score'])
+            if on_round is not None:
+                on_round(rounds, len(alive), total_games)
+            if len(alive) <= keep or budget >= max_games:
+                break
+            # Выбывают все за пределами лучшей 1/eta и те, чья верхняя граница ниже нижней у лидера
+            best_lo = candidates[alive[0]]['ci'][0]
+            survivors = alive[:max(keep, math.ceil(len(alive) / eta))]
+            survivors = [i for i in survivors if candidates[i]['ci'][1] >= best_lo] or survivors[:keep]
+            for idx in alive:
+                if idx not in survivors:
+                    candidates[idx]['eliminated'] = rounds
+            alive = survivors
+            budget = min(max_games, budget * eta)
+
+    def row(c):
+        return {'name': c['name'], 'changes': c['changes'], 'games': c['games'], 'wins': c['wins'],
+                'losses': c['losses'], 'draws': c['draws'], 'score': round(100 * c['score'], 2),
+                'score_ci': [round(c['ci'][0], 2), round(c['ci'][1], 2)], 'eliminated_round': c['eliminated']}
+    ranked = sorted(candidates, key=lambda c: (c['eliminated'] is not None, -(c['eliminated'] or 0), -c['score']))
+    best = [dict(row(candidates[i]), strategy=candidates[i]['strategy']) for i in alive[:keep]]
+    return {
+        'best': best,
+        'candidates': [row(c) for c in ranked],
+        'rounds': rounds,
+        'games': total_games,
+        'full_grid_games': len(candidates) * len(opponents) * 2 * max(1, max_games // 2),
+        'seed': seed,
+    }
+
+# --- Балансный перебор: стоимость, копии и сила эффектов карт ---
+# grid: {имя карты: {'cost': [...], 'copies': [...], 'effects': {'Damage': [...]}}}. Каждый вариант
+# (произведение всех осей, первым — каталог без изменений) играет полный набор матчей участников
+# (все упорядоченные пары) на одних и тех же seed партий в режиме rng_streams; варианты идут
+# одним прогоном run_parallel, каталог варианта собирается в процессе-исполнителе из базы
+def sweep_variants(grid):
+    axes = []
+    for name, spec in grid.items():
+        for key in ('cost', 'copies'):
+            if spec.get(key):
+                axes.append(((name, key, None), list(spec[key])))
+        for effect, values in (spec.get('effects') or {}).items():
+            axes.append(((name, 'effects', effect), list(values)))
+    variants = [[]]
+    for axis, values in axes:
+        variants = [v + [(axis, value)] for v in variants for value in values]
+    return [[]] + [v for v in variants if v]
+
+def _variant_changes(variant):
+    changes = {}
+    for (name, key, effect), value in variant:
+        change = changes.setdefault(name, {})
+        if effect is None:
+            change[key] = value
+        else:
+            change.setdefault('effects', {})[effect] = value
+    return changes
+
+def _variant_params(variant):
+    return {f"{name}.{effect or key}": value for (name, key, effect), value in variant}
+
+def sweep_balance(grid, entrants, games_per_matchup=200, max_variants=64, max_turns=30, hp=(50, 50),
+                  seed=None, workers=None, on_variant=None):
+    if seed is None:
+        seed = random.getrandbits(64)
+    variants = sweep_variants(grid)
+    if len(variants) > max_variants:
+        raise ValueError(f"Вариантов {len(variants)}, больше max_variants={max_variants}: сузьте сетку")
+    base = get_catalog()
+    for variant in variants:
+        # Ошибки в именах карт — до прогона, а не в процессе-исполнителе
+        variant_catalog(base, _variant_changes(variant))
+    players = tournament_entrants(entrants)
+    matchups = [(a, b) for a in range(len(players)) for b in range(len(players)) if a != b] or [(0, 0)]
+    configs = []
+    for variant in variants:
+        changes = _variant_changes(variant)
+        for a, b in matchups:
+            configs.append(dict(_match_config(players[a], players[b], max_turns, hp),
+                                catalog_changes=changes, rng_streams=True))
+    aggregates = [SimAggregate(config) for config in configs]
+    per_variant = len(matchups)
+    shards = len(plan_shards(0, games_per_matchup))
+    done = defaultdict(int)
+    # Все варианты — одним прогоном на одном пуле: каталог варианта собирается в процессе из базы
+    with ShardPool(workers) as pool:
+        for idx, agg in iter_shards(configs, games_per_matchup, seed, pool=pool):
+            aggregates[idx].merge(agg)
+            done[idx // per_variant] += 1
+            if on_variant is not None and done[idx // per_variant] == per_variant * shards:
+                on_variant(sum(1 for n in done.values() if n == per_variant * shards), len(variants))
+    swept = list(grid)
+    surface = []
+    for v, variant in enumerate(variants):
+        aggs = aggregates[v * per_variant:(v + 1) * per_variant]
+        score = defaultdict(float)
+        games = defaultdict(int)
+        matches = {}
+        for (a, b), agg in zip(matchups, aggs):
+            w1, w2 = agg.wins
+            draws = agg.games - w1 - w2
+            matches[f"{players[a]['name']} vs {players[b]['name']}"] = round(100 * w1 / agg.games, 2) if agg.games else 0
+            for x, w in ((a, w1), (b, w2)):
+                score[x] += w + 0.5 * draws
+                games[x] += agg.games
+        total = sum(agg.games for agg in aggs)
+        cards = {}
+        for name in swept:
+            i = aggs[0].card_index[name]
+            owned = sum(int(agg.cards[_C['card_value'], i] + agg.cards[_C['trashed'], i]) for agg in aggs)
+            won = sum(int(agg.cards[_C['winner_cards'], i]) for agg in aggs)
+            lost = sum(int(agg.cards[_C['loser_cards'], i]) for agg in aggs)
+            cards[name] = {
+                # Копий карты у обоих игроков к концу партии (включая трэш) — на партию
+                'picks_per_game': round(owned / total, 3) if total else 0,
+                # Доля копий карты, оказавшихся у победителя
+                'winner_share': round(100 * won / (won + lost), 2) if won + lost else None,
+            }
+        surface.append({
+            'params': _variant_params(variant),
+            'win_rates': {players[x]['name']: round(100 * score[x] / games[x], 2) if games[x] else 0
+                          for x in range(len(players))},
+            'matchups': matches,
+            'cards': cards,
+            'avg_turns': round(sum(agg.turns for agg in aggs) / total, 2) if total else 0,
+        })
+    return {
+        'entrants': [p['name'] for p in players],
+        'variants': len(variants),
+        'games': len(configs) * games_per_matchup,
+        'seed': seed,
+        'surface': surface,
+    }
 
 # if __name__ == "__main__":
 #     # Только одна стратегия: red vs red
@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def fixture_catalog():
+    # Каталог и стратегии из benchmarks/ — как у benchmark.py, без Google Sheets и cards.json
+    import benchmark
+    main_cards, starter_cards, strategies = benchmark.load_fixture()
+    return {'cards': main_cards, 'starters': starter_cards, 'strategies': strategies}
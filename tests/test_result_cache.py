@@ -0,0 +1,24 @@
+import simulator as sim
+
+SEED = 2024
+
+
+def aggro_vs_poison(catalog):
+    strategies = catalog['strategies']
+    return {
+        'strategy1': None, 'strategy2': None,
+        'user_strategy1': strategies['aggro'], 'user_strategy2': strategies['poison'],
+        'cards': catalog['cards'], 'starters': catalog['starters'],
+    }
+
+
+def test_cache_top_up_matches_fresh_run(fixture_catalog, tmp_path):
+    config = aggro_vs_poison(fixture_catalog)
+    cache = sim.ResultCache(path=str(tmp_path))
+    sim.simulate_many(config, 250, seed=SEED, workers=1, cache=cache)
+    topped_up = sim.simulate_many(config, 500, seed=SEED, workers=1, cache=cache)
+    fresh = sim.simulate_many(config, 500, seed=SEED, workers=1, cache=False)
+    assert topped_up == fresh
+    # Второй прогон доиграл только партии [250, 500)
+    key = sim.result_cache_key(config, SEED)
+    assert [(start, end) for start, end, _ in sim.ResultCache(path=str(tmp_path)).load(key)] == [(0, 250), (250, 500)]
@@ -0,0 +1,64 @@
+import math
+
+import pytest
+
+import simulator as sim
+
+SEED = 2024
+
+# Доли побед и длина партии движка до переписывания (базовый коммит: глобальный random,
+# Card со всеми полями, списки вместо Zone/LazyDeck), по 10000 партий на каталоге benchmarks/
+# с hp 40/50. Пользовательские стратегии — с приоритетами карт, как их подставлял app.py
+BASELINE = {
+    # матч: (P1 паттерн, P2 паттерн, P1 стратегия, P2 стратегия, P1 %, P2 %, средняя длина)
+    'red_vs_poison': ('red', 'poison', None, None, 66.23, 33.77, 12.565),
+    'random_vs_random': ('random', 'random', None, None, 42.74, 57.26, 15.637),
+    'aggro_vs_poison': (None, None, 'aggro', 'poison', 28.55, 54.84, 19.732),
+    'blue_vs_red': ('blue', 'red', None, None, 3.73, 96.27, 13.119),
+}
+BASELINE_GAMES = 10000
+MATCH_GAMES = 1500
+
+
+def match_config(catalog, name):
+    pattern1, pattern2, user1, user2 = BASELINE[name][:4]
+    strategies = catalog['strategies']
+    return {
+        'strategy1': pattern1, 'strategy2': pattern2,
+        'user_strategy1': strategies[user1] if user1 else None,
+        'user_strategy2': strategies[user2] if user2 else None,
+        'cards': catalog['cards'], 'starters': catalog['starters'],
+    }
+
+
+def test_stats_do_not_depend_on_workers(fixture_catalog):
+    # 600 партий — три шарда: в пуле процессов и в одном процессе
+    config = match_config(fixture_catalog, 'red_vs_poison')
+    serial = sim.simulate_many(config, 600, seed=SEED, workers=1, cache=False)
+    parallel = sim.simulate_many(config, 600, seed=SEED, workers=3, cache=False)
+    assert parallel == serial
+
+
+def test_seeded_stats_snapshot(fixture_catalog):
+    # Точные значения для seed: меняются только вместе с RESULT_CACHE_VERSION
+    stats = sim.simulate_many(match_config(fixture_catalog, 'red_vs_poison'), 500, seed=SEED, workers=1,
+                              cache=False)
+    assert (stats['P1_win'], stats['P2_win'], stats['avg_turns']) == (322, 178, 12.63)
+    assert (stats['avg_hp1'], stats['avg_hp2'], stats['avg_poison2']) == (28.02, 2.79, 1.61)
+    assert stats['top_cards'][:3] == [('Venom', 1622), ('Fire Bolt', 1610), ('Bless', 1403)]
+    stats = sim.simulate_many(match_config(fixture_catalog, 'aggro_vs_poison'), 500, seed=SEED, workers=1,
+                              cache=False)
+    assert (stats['P1_win'], stats['P2_win'], stats['avg_turns']) == (128, 288, 19.49)
+
+
+@pytest.mark.parametrize('name', sorted(BASELINE))
+def test_win_rates_match_baseline_engine(fixture_catalog, name):
+    # Допуск — 4 стандартные ошибки разницы долей: прогон детерминирован по seed,
+    # а настоящий сдвиг исходов после переписывания движка в него не укладывается
+    p1, p2, turns = BASELINE[name][4:]
+    stats = sim.simulate_many(match_config(fixture_catalog, name), MATCH_GAMES, seed=SEED, cache=False)
+    for percent, base in ((stats['P1_win_percent'], p1), (stats['P2_win_percent'], p2)):
+        p = base / 100
+        se = 100 * math.sqrt(p * (1 - p) * (1 / MATCH_GAMES + 1 / BASELINE_GAMES))
+        assert abs(percent - base) <= 4 * max(se, 0.5), (percent, base)
+    assert abs(stats['avg_turns'] - turns) <= 0.4